@@ -0,0 +1,6 @@
+# coding: utf-8
+"""Throughput, latency and memory benchmarks for both termformat backends.
+
+Run ``python -m benchmarks`` from the repository root; ``make bench`` builds
+the Cython extension first. See ``python -m benchmarks --help``.
+"""
@@ -0,0 +1,40 @@
+# coding: utf-8
+"""Bytes and encode time saved by AtomCache on atom-heavy payloads.
+
+Run with ``python -m benchmarks.atom_cache`` after building the module.
+"""
+from __future__ import print_function
+
+import timeit
+
+import termformat
+
+STATES = [":active", ":disabled", ":pending"]
+ROLES = [":admin", ":user", ":guest", ":service"]
+
+
+def payload(count):
+  return [(":user", i, STATES[i % 3], ROLES[i % 4], (":ok", ":undefined"))
+          for i in range(count)]
+
+
+def main(number=200):
+  print("termformat {0} (cython: {1})".format(termformat.__version__, termformat.__is_cython__))
+  print("{0:>8} {1:>12} {2:>12} {3:>12} {4:>12}".format(
+    "records", "plain B", "cached B", "plain us", "cached us"))
+  for count in (1, 10, 100, 1000):
+    term = payload(count)
+    cache = termformat.AtomCache()
+    # The first message stores the names in the peer's cache, every
+    # following message on the connection only carries references.
+    termformat.encode(term, atom_cache=cache)
+    plain = termformat.encode(term)
+    cached = termformat.encode(term, atom_cache=cache)
+    plain_time = timeit.timeit(lambda: termformat.encode(term), number=number)
+    cached_time = timeit.timeit(lambda: termformat.encode(term, atom_cache=cache), number=number)
+    print("{0:>8} {1:>12} {2:>12} {3:>12.1f} {4:>12.1f}".format(
+      count, len(plain), len(cached), plain_time / number * 1e6, cached_time / number * 1e6))
+
+
+if __name__ == "__main__":
+  main()
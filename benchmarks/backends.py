@@ -0,0 +1,65 @@
+# coding: utf-8
+"""Loads the pure-Python and the Cython build of termformat side by side.
+
+From the repository root ``import termformat`` always finds the package
+directory, even next to an in-place built extension, so both backends are
+loaded from their files instead.
+"""
+import glob
+import os
+
+try:
+  from importlib.machinery import EXTENSION_SUFFIXES, ExtensionFileLoader
+  from importlib.util import module_from_spec, spec_from_file_location, spec_from_loader
+except ImportError: # pragma: no cover
+  # Python 2.7
+  import imp
+  EXTENSION_SUFFIXES = [suffix for suffix, _, kind in imp.get_suffixes() if kind == imp.C_EXTENSION]
+  load_source, load_dynamic = imp.load_source, imp.load_dynamic
+else:
+  def load_source(name, path):
+    spec = spec_from_file_location(name, path)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+  def load_dynamic(name, path):
+    spec = spec_from_loader(name, ExtensionFileLoader(name, path))
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKENDS = ("python", "cython")
+
+
+def load_python():
+  return load_source("termformat_python", os.path.join(ROOT, "termformat", "__init__.py"))
+
+
+def load_cython(path=None):
+  # The extension's init function is named after ``termformat``, so that is
+  # the only name it can be loaded under.
+  if path is None:
+    for suffix in EXTENSION_SUFFIXES:
+      found = glob.glob(os.path.join(ROOT, "termformat" + suffix)) + \
+              glob.glob(os.path.join(ROOT, "build", "lib*", "termformat" + suffix))
+      if found:
+        path = found[0]
+        break
+    else:
+      return None
+  return load_dynamic("termformat", path)
+
+
+def load(names=BACKENDS, extension=None):
+  """
+  Returns ``{name: module}`` for those of the requested backends that are
+  available; ``extension`` is the path of a built Cython module to use.
+  """
+  backends = {}
+  for name in names:
+    module = load_python() if name == "python" else load_cython(extension)
+    if module is not None:
+      backends[name] = module
+  return backends
@@ -0,0 +1,58 @@
+# coding: utf-8
+"""Encode/decode time of SMALL_BIG_EXT and LARGE_BIG_EXT by bit size.
+
+Run with ``python -m benchmarks.bignum`` after building the module. The
+``legacy`` columns time the byte-at-a-time loops termformat used before
+whole-buffer conversion, up to the sizes where they still finish quickly.
+"""
+from __future__ import print_function
+
+import random
+import timeit
+
+import termformat
+
+LEGACY_MAX_BITS = 65536
+
+
+def legacy_pack(n):
+  body = b""
+  while n:
+    body += termformat._char_pack(n & 0xff)
+    n >>= 8
+  return body
+
+
+def legacy_unpack(body):
+  n = 0
+  for i in bytearray(body)[::-1]:
+    n = (n << 8) | i
+  return n
+
+
+def measure(function, number):
+  return min(timeit.repeat(function, number=number, repeat=3)) / number * 1e6
+
+
+def main():
+  print("termformat {0} (cython: {1})".format(termformat.__version__, termformat.__is_cython__))
+  print("{0:>9} {1:>12} {2:>12} {3:>12} {4:>12}".format(
+    "bits", "encode us", "decode us", "legacy enc", "legacy dec"))
+  random.seed(0)
+  for bits in (64, 256, 1024, 2048, 4096, 16384, 65536, 262144, 1048576):
+    term = random.getrandbits(bits) | (1 << (bits - 1))
+    binary = termformat.encode(term)
+    number = max(1, 20000 // bits)
+    encode_time = measure(lambda: termformat.encode(term), number)
+    decode_time = measure(lambda: termformat.decode(binary), number)
+    if bits <= LEGACY_MAX_BITS:
+      body = legacy_pack(term)
+      legacy = "{0:>12.1f} {1:>12.1f}".format(
+        measure(lambda: legacy_pack(term), number), measure(lambda: legacy_unpack(body), number))
+    else:
+      legacy = "{0:>12} {0:>12}".format("-")
+    print("{0:>9} {1:>12.1f} {2:>12.1f} {3}".format(bits, encode_time, decode_time, legacy))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,67 @@
+# coding: utf-8
+"""Deterministic corpora of representative message shapes.
+
+Every generator takes a ``random.Random`` and returns a list of terms; each
+term is encoded or decoded by one call while benchmarking.
+"""
+import random
+import string
+
+
+def rpc(rand):
+  # Small gen_server style calls and replies.
+  modules = [":users", ":orders", ":billing", ":sessions"]
+  return [(":call", i, (rand.choice(modules), ":handle"),
+           [i, "arg-{0}".format(rand.randint(0, 1000)), rand.random()], ":infinity")
+          for i in range(2000)]
+
+
+def flat_list(rand):
+  return [[rand.randint(0, 2 ** 31 - 1) for _ in range(20000)] for _ in range(10)]
+
+
+def deep(rand):
+  terms = []
+  for _ in range(20):
+    term = ":leaf"
+    for depth in range(1000):
+      term = (depth, term) if rand.random() < 0.5 else [term, depth]
+    terms.append(term)
+  return terms
+
+
+def atoms(rand):
+  states = [":active", ":disabled", ":pending", ":deleted", ":undefined"]
+  return [[(":user", rand.choice(states), rand.choice(states), (":ok", ":true"))
+           for _ in range(200)] for _ in range(100)]
+
+
+def floats(rand):
+  return [[rand.uniform(-1e6, 1e6) for _ in range(2000)] for _ in range(50)]
+
+
+def binaries(rand):
+  # Text, so that the default decode to ``str`` works on it.
+  alphabet = (string.ascii_letters + string.digits).encode("ascii")
+  return [(":blob", i, bytes(bytearray(rand.choice(alphabet) for _ in range(4096))) * 256)
+          for i in range(5)]
+
+
+def bignums(rand):
+  return [[rand.choice((1, -1)) * rand.getrandbits(rand.randint(64, 4096)) for _ in range(50)]
+          for _ in range(200)]
+
+
+CORPORA = {
+  "rpc": rpc,
+  "flat_list": flat_list,
+  "deep": deep,
+  "atoms": atoms,
+  "floats": floats,
+  "binaries": binaries,
+  "bignums": bignums,
+}
+
+
+def generate(name, seed=0):
+  return CORPORA[name](random.Random(seed))
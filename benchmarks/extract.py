@@ -0,0 +1,44 @@
+# coding: utf-8
+"""Cost of reading one nested field with extract() vs decode() and indexing.
+
+Run with ``python -m benchmarks.extract`` after building the module.
+"""
+from __future__ import print_function
+
+import timeit
+
+import termformat
+
+
+def payload(count):
+  rows = [(":row", i, "name-{0}".format(i), [i * 0.5, i * 2]) for i in range(count)]
+  return (":msg", (":route", ":orders", 42), rows)
+
+
+def lookup(term, path):
+  for index in path:
+    term = term[index]
+  return term
+
+
+def main(number=200):
+  print("termformat {0} (cython: {1})".format(termformat.__version__, termformat.__is_cython__))
+  print("{0:>8} {1:>12} {2:>12} {3:>12} {4:>12} {5:>8}".format(
+    "rows", "compressed", "path", "decode us", "extract us", "speedup"))
+  # A routing key in front of the rows, and a field that sits behind all
+  # of them so that every row has to be skipped over.
+  for path in ((1, 2), (2, -1, 1)):
+    for count in (10, 100, 1000, 10000):
+      for compressed in (False, 6):
+        binary = termformat.encode(payload(count), compressed=compressed)
+        index = lambda: lookup(termformat.decode(binary), path)
+        assert termformat.extract(binary, path) == index()
+        decode_time = timeit.timeit(index, number=number)
+        extract_time = timeit.timeit(lambda: termformat.extract(binary, path), number=number)
+        print("{0:>8} {1:>12} {2:>12} {3:>12.1f} {4:>12.1f} {5:>7.1f}x".format(
+          count, "yes" if compressed else "no", str(path), decode_time / number * 1e6,
+          extract_time / number * 1e6, decode_time / extract_time))
+
+
+if __name__ == "__main__":
+  main()
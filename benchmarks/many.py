@@ -0,0 +1,58 @@
+# coding: utf-8
+"""Throughput of encode_many()/decode_many() against one call per term,
+serially and on process pools of growing size.
+
+Run with ``python -m benchmarks.many`` after building the module.
+"""
+from __future__ import print_function
+
+import multiprocessing
+import time
+
+import termformat
+
+try:
+  from concurrent.futures import ProcessPoolExecutor
+except ImportError: # pragma: no cover
+  ProcessPoolExecutor = None
+
+
+def payload(count):
+  return [(":event", i, "user-{0}".format(i), [i * 0.5, ":ok"]) for i in range(count)]
+
+
+def rate(function, count):
+  start = time.time()
+  function()
+  return count / (time.time() - start) / 1e3
+
+
+def main(count=200000, chunksize=4096):
+  print("termformat {0} (cython: {1})".format(termformat.__version__, termformat.__is_cython__))
+  terms = payload(count)
+  binaries = termformat.encode_many(terms)
+  print("{0:>16} {1:>14} {2:>14}".format("mode", "encode k/s", "decode k/s"))
+  print("{0:>16} {1:>14.1f} {2:>14.1f}".format(
+    "per call",
+    rate(lambda: [termformat.encode(term) for term in terms], count),
+    rate(lambda: [termformat.decode(binary) for binary in binaries], count)))
+  print("{0:>16} {1:>14.1f} {2:>14.1f}".format(
+    "batch",
+    rate(lambda: termformat.encode_many(terms), count),
+    rate(lambda: termformat.decode_many(binaries), count)))
+  if ProcessPoolExecutor is None:
+    return
+  workers = 1
+  while workers <= multiprocessing.cpu_count():
+    with ProcessPoolExecutor(workers) as executor:
+      # Start the workers before timing.
+      termformat.encode_many(terms[:workers], executor=executor, chunksize=1)
+      print("{0:>16} {1:>14.1f} {2:>14.1f}".format(
+        "{0} processes".format(workers),
+        rate(lambda: termformat.encode_many(terms, executor=executor, chunksize=chunksize), count),
+        rate(lambda: termformat.decode_many(binaries, executor=executor, chunksize=chunksize), count)))
+    workers *= 2
+
+
+if __name__ == "__main__":
+  main()
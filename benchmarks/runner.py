@@ -0,0 +1,161 @@
+# coding: utf-8
+"""Runs every corpus through every backend and compares with a baseline.
+
+For each backend, corpus and operation it reports throughput (terms per
+second and MB/s of encoded data), per-call latency percentiles and the
+peak memory traced during one pass. The digest of the encoded corpus is
+checked too, so the backends must agree on every byte they produce.
+
+A stored baseline (``benchmarks/baseline.json`` by default) flags runs
+that got slower or used more memory than ``--tolerance`` allows, or whose
+output changed; ``--save-baseline`` records the current run instead.
+Numbers depend on the machine, so save a baseline before comparing.
+"""
+from __future__ import division, print_function
+
+import argparse
+import gc
+import hashlib
+import json
+import os
+
+try:
+  from time import perf_counter
+except ImportError: # pragma: no cover
+  from time import time as perf_counter
+
+try:
+  import tracemalloc
+except ImportError: # pragma: no cover
+  tracemalloc = None
+
+from benchmarks import backends, corpora
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(ordered, p):
+  return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def measure(function, items, rounds):
+  latencies = []
+  gc.collect()
+  for _ in range(rounds):
+    for item in items:
+      start = perf_counter()
+      function(item)
+      latencies.append(perf_counter() - start)
+  peak = None
+  if tracemalloc is not None:
+    gc.collect()
+    tracemalloc.start()
+    for item in items:
+      function(item)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+  total = sum(latencies)
+  latencies.sort()
+  result = {"ops": len(latencies) / total, "seconds": total / rounds, "peak": peak}
+  for p in PERCENTILES:
+    result["p{0}".format(p)] = percentile(latencies, p)
+  return result
+
+
+def run(module, corpus, rounds):
+  terms = corpora.generate(corpus)
+  binaries = [module.encode(term) for term in terms]
+  size = sum(len(binary) for binary in binaries)
+  # The decoded term may use str where the original used bytes, but it has
+  # to encode to the very same bytes.
+  for binary in binaries:
+    if module.encode(module.decode(binary)) != binary:
+      raise AssertionError("{0} does not roundtrip through {1}".format(corpus, module.__name__))
+  digest = hashlib.sha1(b"".join(binaries)).hexdigest()
+  results = {}
+  for operation, function, items in (("encode", module.encode, terms), ("decode", module.decode, binaries)):
+    result = measure(function, items, rounds)
+    result["mbps"] = size / result["seconds"] / 1e6
+    result["digest"] = digest
+    results[operation] = result
+  return results
+
+
+def compare(result, baseline, tolerance):
+  if baseline is None:
+    return "new"
+  elif result["digest"] != baseline["digest"]:
+    return "OUTPUT CHANGED"
+  problems = []
+  change = result["ops"] / baseline["ops"] - 1
+  if change < -tolerance:
+    problems.append("SLOWER {0:.0%}".format(change))
+  if result["peak"] is not None and baseline.get("peak"):
+    change = result["peak"] / baseline["peak"] - 1
+    # A few KiB either way is allocator noise, not a regression.
+    if change > tolerance and result["peak"] - baseline["peak"] > 65536:
+      problems.append("MEMORY +{0:.0%}".format(change))
+  return ", ".join(problems) or "ok"
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__,
+                                   formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--backend", action="append", choices=backends.BACKENDS,
+                      help="backend to run, may be repeated (default: all that are built)")
+  parser.add_argument("--corpus", action="append", choices=sorted(corpora.CORPORA),
+                      help="corpus to run, may be repeated (default: all)")
+  parser.add_argument("--rounds", type=int, default=3, help="passes over each corpus (default: 3)")
+  parser.add_argument("--extension", help="path of the built Cython module")
+  parser.add_argument("--baseline", default=BASELINE, help="baseline file (default: %(default)s)")
+  parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+  parser.add_argument("--tolerance", type=float, default=0.25,
+                      help="allowed slowdown or memory growth (default: %(default)s)")
+  args = parser.parse_args(argv)
+
+  modules = backends.load(args.backend or backends.BACKENDS, args.extension)
+  if not modules:
+    parser.error("no backend available, build the extension or pass --extension")
+  baseline = {}
+  if os.path.exists(args.baseline):
+    with open(args.baseline) as source:
+      baseline = json.load(source)
+
+  print("{0:<8} {1:<10} {2:<7} {3:>10} {4:>8} {5:>9} {6:>9} {7:>9} {8:>10}  {9}".format(
+    "backend", "corpus", "op", "terms/s", "MB/s", "p50 us", "p90 us", "p99 us", "peak KiB", "status"))
+  results, failed = {}, False
+  for name in backends.BACKENDS:
+    if name not in modules:
+      continue
+    for corpus in args.corpus or sorted(corpora.CORPORA):
+      for operation, result in sorted(run(modules[name], corpus, args.rounds).items(), reverse=True):
+        results.setdefault(name, {}).setdefault(corpus, {})[operation] = result
+        status = compare(result, baseline.get(name, {}).get(corpus, {}).get(operation), args.tolerance)
+        failed = failed or status not in ("ok", "new")
+        print("{0:<8} {1:<10} {2:<7} {3:>10.0f} {4:>8.1f} {5:>9.1f} {6:>9.1f} {7:>9.1f} {8:>10}  {9}".format(
+          name, corpus, operation, result["ops"], result["mbps"], result["p50"] * 1e6,
+          result["p90"] * 1e6, result["p99"] * 1e6,
+          "-" if result["peak"] is None else result["peak"] // 1024, status))
+
+  if len(results) == len(backends.BACKENDS):
+    print("\ncython speedup over python")
+    python, cython = results["python"], results["cython"]
+    for corpus in sorted(python):
+      for operation in ("encode", "decode"):
+        if python[corpus][operation]["digest"] != cython[corpus][operation]["digest"]:
+          print("{0:<10} {1:<7} OUTPUT DIFFERS".format(corpus, operation))
+          failed = True
+          continue
+        print("{0:<10} {1:<7} {2:>6.1f}x".format(
+          corpus, operation, cython[corpus][operation]["ops"] / python[corpus][operation]["ops"]))
+
+  if args.save_baseline:
+    for name, corpus_results in results.items():
+      baseline.setdefault(name, {}).update(corpus_results)
+    with open(args.baseline, "w") as output:
+      json.dump(baseline, output, indent=2, sort_keys=True)
+      output.write("\n")
+    print("\nbaseline saved to {0}".format(args.baseline))
+    return 0
+  return 1 if failed else 0
@@ -1,6 +1,27 @@
 # coding: utf-8
+import os
+import re
+import sys
+from array import array
+from collections import OrderedDict, deque
+from functools import partial
+from itertools import chain, islice
+from math import copysign
+from mmap import mmap, ACCESS_READ
+from binascii import hexlify, unhexlify
 from struct import Struct
-from zlib import compress, decompress
+from threading import Lock, local
+from zlib import compress, compressobj, crc32, decompressobj, error as _ZlibError
+
+try:
+  from time import perf_counter as _timer
+except ImportError: # pragma: no cover
+  from time import time as _timer
+
+try:
+  import asyncio
+except ImportError: # pragma: no cover
+  asyncio = None
 
 __version__ = "0.1.9"
 __is_cython__ = False
@@ -8,13 +29,40 @@ __is_cython__ = False
 try:
   # Python 2.7
   long = long
+  _buffer = bytearray
+  # zlib only takes old-style buffers, which can't be released or made
+  # from a memoryview.
+  _view = lambda data, start=0: buffer(data.tobytes() if type(data) is memoryview else data, start)
+  _release = lambda view: None
+  # There is no cast() either; writable buffers are byte-sized.
+  _byte_view = memoryview
+  # unicode() doesn't decode bytearrays.
+  _unicode = lambda data, encoding: unicode(bytes(data), encoding)
+  # No "Q" typecode before Python 3.3; "L" is 64 bits on LP64 platforms.
+  _OFFSET_TYPECODE = "L"
+  # mmap has no new-style buffer interface, so files are read into memory.
+  _mapped = bytearray
 except NameError: # pragma: no cover
   # Python 3.3
   unicode = str
   xrange = range
   long = int
+  _buffer = lambda term: term
+  _view = lambda data, start=0: memoryview(data).cast("B")[start:]
+  _release = memoryview.release
+  _unicode = str
+  _byte_view = lambda data: memoryview(data).cast("B")
+  _OFFSET_TYPECODE = "Q"
+  _mapped = memoryview
 
 DEFAULT_ENCODING = "utf-8"
+DEFAULT_ATOM_TABLE_SIZE = 4096
+DEFAULT_NEW_FLOAT = False
+DEFAULT_BINARY = "str"
+DEFAULT_STRING = "str"
+DEFAULT_MAX_SIZE = None
+DEFAULT_ENCODE_CACHE_SIZE = 4096
+DEFAULT_ENCODE_CACHE_BYTES = 16 * 1024 * 1024
 
 ERL_NEW_FLOAT = b'F'
 ERL_COMPRESSED = b'P'
@@ -30,14 +78,116 @@ ERL_LIST = b'l'
 ERL_BINARY = b'm'
 ERL_SMALL_BIGNUM = b'n'
 ERL_LARGE_BIGNUM = b'o'
+ERL_MAP = b't'
+ERL_SMALL_ATOM = b's'
+ERL_ATOM_UTF8 = b'v'
+ERL_SMALL_ATOM_UTF8 = b'w'
+ERL_ATOM_CACHE_REF = b'R'
+ERL_DIST_HEADER = b'D'
 ERL_MAGIC = b'\x83'
 
+_NEW_FLOAT = ord(ERL_NEW_FLOAT)
+_COMPRESSED = ord(ERL_COMPRESSED)
+_SMALL_INT = ord(ERL_SMALL_INT)
+_INT = ord(ERL_INT)
+_FLOAT = ord(ERL_FLOAT)
+_ATOM = ord(ERL_ATOM)
+_SMALL_TUPLE = ord(ERL_SMALL_TUPLE)
+_LARGE_TUPLE = ord(ERL_LARGE_TUPLE)
+_NIL = ord(ERL_NIL)
+_STRING = ord(ERL_STRING)
+_LIST = ord(ERL_LIST)
+_BINARY = ord(ERL_BINARY)
+_SMALL_BIGNUM = ord(ERL_SMALL_BIGNUM)
+_LARGE_BIGNUM = ord(ERL_LARGE_BIGNUM)
+_MAP = ord(ERL_MAP)
+_SMALL_ATOM = ord(ERL_SMALL_ATOM)
+_ATOM_UTF8 = ord(ERL_ATOM_UTF8)
+_SMALL_ATOM_UTF8 = ord(ERL_SMALL_ATOM_UTF8)
+_ATOM_CACHE_REF = ord(ERL_ATOM_CACHE_REF)
+_DIST_HEADER = ord(ERL_DIST_HEADER)
+_MAGIC = ord(ERL_MAGIC)
+
+# What _write_term() and encoded_size() do with a term depends on its kind,
+# looked up by exact type in _term_kinds; register_type() adds its types
+# there as _KIND_CUSTOM.
+_KIND_INT = 1
+_KIND_FLOAT = 2
+_KIND_BYTES = 3
+_KIND_TEXT = 4
+_KIND_TUPLE = 5
+_KIND_LIST = 6
+_KIND_MAP = 7
+_KIND_CONSTANT = 8
+_KIND_MEMORYVIEW = 9
+_KIND_LAZY = 10
+_KIND_CUSTOM = 11
+_KIND_SEQUENCE = 12
+_KIND_SLOT = 13
+_KIND_CACHED = 14
+
+# On Python 2 str is bytes, so bytes has to come after it.
+_term_kinds = {
+  int: _KIND_INT, long: _KIND_INT, float: _KIND_FLOAT,
+  str: _KIND_TEXT, unicode: _KIND_TEXT, bytes: _KIND_BYTES,
+  tuple: _KIND_TUPLE, set: _KIND_TUPLE, list: _KIND_LIST, dict: _KIND_MAP,
+  bool: _KIND_CONSTANT, type(None): _KIND_CONSTANT, memoryview: _KIND_MEMORYVIEW,
+  bytearray: _KIND_SEQUENCE, array: _KIND_SEQUENCE,
+}
+
+# array.array typecodes packed by _write_sequence(); other arrays, such as
+# the "u" character ones, are encoded as a list of their items.
+_sequence_typecodes = frozenset("bBhHiIlLqQfd")
+
+# True, False and None are the atoms true, false and undefined.
+_constant_atoms = {True: b":true", False: b":false", None: b":undefined"}
+_native_atoms = {b"true": True, b"false": False, b"undefined": None}
+
+# Set up by register_type(): encoders by type, decoders by record tag.
+_custom_encoders = {}
+_record_decoders = {}
+
+_missing = object()
+
 
 _char = Struct(">B")
 _int4 = Struct(">I")
 _int2 = Struct(">H")
 _signed_int4 = Struct(">i")
 _float = Struct(">d")
+_index_header = Struct("<4sQQQQI")
+
+_packet_headers = {1: _char, 2: _int2, 4: _int4}
+_binary_modes = {"str": 0, "bytes": 1, "memoryview": 2}
+_string_modes = {"str": 0, "bytes": 1, "array": 2, "list": 3}
+
+# encode() appends to a per-thread scratch buffer that is emptied once it
+# grows past this size.
+_SCRATCH_SIZE = 1 << 20
+_scratch = local()
+
+# Compressed encoding hands the body to zlib in chunks of this size.
+_DEFLATE_CHUNK = 65536
+_AUTO_MIN_SIZE = 256
+_AUTO_SAMPLE_SIZE = 1024
+
+# dump() hands binaries of at least this size to the writer by reference
+# instead of copying them into its output buffer.
+_PASSTHROUGH_SIZE = 65536
+
+# An EncodeCache keeps tuples, integers beyond 32 bits and strings of at
+# least this many characters; anything shorter is cheaper to encode.
+_cached_kinds = frozenset((_KIND_INT, _KIND_TEXT, _KIND_BYTES, _KIND_TUPLE))
+_CACHE_MIN_LENGTH = 64
+_immutable_kinds = frozenset((_KIND_INT, _KIND_FLOAT, _KIND_TEXT, _KIND_BYTES, _KIND_CONSTANT))
+
+# Sidecar index of a TermFile: magic, indexed file size, term count and a
+# stamp of the file it was made for (inode, modification time and CRC-32 of
+# the first bytes of the last indexed term), followed by the little-endian
+# 64-bit offsets of the terms.
+_INDEX_MAGIC = b"TFI2"
+_INDEX_STAMP_SIZE = 64
+_INDEX_SUFFIX = ".idx"
 
 _char_pack = _char.pack
 _int4_pack = _int4.pack
@@ -51,6 +201,38 @@ _int2_unpack = _int2.unpack
 _signed_int4_unpack = _signed_int4.unpack
 _float_unpack = _float.unpack
 
+_char_unpack_from = _char.unpack_from
+_int4_unpack_from = _int4.unpack_from
+_int2_unpack_from = _int2.unpack_from
+_signed_int4_unpack_from = _signed_int4.unpack_from
+_float_unpack_from = _float.unpack_from
+
+_constant_terms = dict((value, ERL_ATOM + _int2_pack(len(name) - 1) + name[1:])
+                       for value, name in _constant_atoms.items())
+
+try:
+  _is_ascii = bytes.isascii
+except AttributeError: # pragma: no cover
+  # Python < 3.7
+  _non_ascii = re.compile(b"[\x80-\xff]").search
+
+  def _is_ascii(name):
+    return _non_ascii(name) is None
+
+if hasattr(int, "from_bytes"):
+  def _bignum_pack(n):
+    return n.to_bytes((n.bit_length() + 7) >> 3, "little")
+
+  def _bignum_unpack(body):
+    return int.from_bytes(body, "little")
+else: # pragma: no cover
+  def _bignum_pack(n):
+    digits = "%x" % n
+    return unhexlify("0" * (len(digits) & 1) + digits)[::-1]
+
+  def _bignum_unpack(body):
+    return long(hexlify(bytes(bytearray(body)[::-1])), 16) if len(body) else 0
+
 
 def is_atom(term):
   if isinstance(term, (str, unicode, bytes)):
@@ -70,217 +252,2613 @@ def atom_to_binary(term):
 
 
 def encode_term(term):
-  term_type = type(term)
-  if term_type in (int, long):
-    if 0 <= term <= 255:
-      return ERL_SMALL_INT + _char_pack(term)
-    elif -2147483648 <= term <= 2147483647:
-      return ERL_INT + _signed_int4_pack(term)
-    else:
-      sign, term = (0, term) if term >= 0 else (1, -term)
-      body = b""
-      while term:
-        body += _char_pack(term & 0xff)
-        term >>= 8
-      length = len(body)
-      sign = _char_pack(sign)
+  buf = bytearray()
+  _write_term(term, buf)
+  return bytes(buf)
+
+
+def _write_term(term, buf, max_depth=None, atom_refs=None, new_float=False, flush=None, cache=None):
+  # Containers push an iterator over their items together with the bytes
+  # that close them, so nesting depth is bounded by memory, not recursion.
+  stack = []
+  while True:
+    kind = _term_kinds.get(type(term), 0)
+    if cache is not None and kind in _cached_kinds:
+      encoded = cache._lookup(term, kind, new_float)
+      if encoded is not None:
+        buf += encoded
+        kind = _KIND_CACHED
+    if kind == _KIND_INT:
+      if 0 <= term <= 255:
+        buf += ERL_SMALL_INT
+        buf.append(term)
+      elif -2147483648 <= term <= 2147483647:
+        buf += ERL_INT
+        buf += _signed_int4_pack(term)
+      else:
+        sign, term = (0, term) if term >= 0 else (1, -term)
+        body = _bignum_pack(term)
+        length = len(body)
+        if length <= 255:
+          buf += ERL_SMALL_BIGNUM
+          buf.append(length)
+        elif length <= 4294967295:
+          buf += ERL_LARGE_BIGNUM
+          buf += _int4_pack(length)
+        else: # pragma: no cover
+          raise ValueError("Invalid BIGNUM_EXT length: {0}".format(length))
+        buf.append(sign)
+        buf += body
+    elif kind == _KIND_TEXT:
+      term = term.encode(DEFAULT_ENCODING)
+      continue
+    elif kind == _KIND_BYTES:
+      if term.startswith(b":"):
+        length = len(term) - 1
+        if not length:
+          raise ValueError("Invalid ATOM_EXT length: 0")
+        elif length > 255:
+          raise ValueError("Invalid ATOM_EXT length: {0}".format(length))
+        elif atom_refs is not None and (len(atom_refs) < 255 or term in atom_refs):
+          buf += ERL_ATOM_CACHE_REF
+          buf.append(atom_refs.setdefault(term, len(atom_refs)))
+        elif _is_ascii(term):
+          buf += ERL_ATOM
+          buf += _int2_pack(length)
+          buf += term[1:]
+        else:
+          # ATOM_EXT is Latin-1 only.
+          buf += ERL_SMALL_ATOM_UTF8
+          buf.append(length)
+          buf += term[1:]
+      else:
+        length = len(term)
+        if length <= 4294967295:
+          buf += ERL_BINARY
+          buf += _int4_pack(length)
+          if flush is not None and length >= _PASSTHROUGH_SIZE:
+            flush(buf, term)
+          else:
+            buf += term
+        else: # pragma: no cover
+          raise ValueError("Invalid BINARY_EXT length: {0}".format(length))
+    elif kind == _KIND_TUPLE:
+      if max_depth is not None and len(stack) >= max_depth:
+        raise ValueError("Maximum nesting depth exceeded: {0}".format(max_depth))
+      length = len(term)
       if length <= 255:
-        return ERL_SMALL_BIGNUM + _char_pack(length) + sign + body
+        buf += ERL_SMALL_TUPLE
+        buf.append(length)
       elif length <= 4294967295:
-        return ERL_LARGE_BIGNUM + _int4_pack(length) + sign + body
-      else: # pragma: no cover
-        raise ValueError("Invalid BIGNUM_EXT length: {0}".format(length))
-  elif term_type is float:
-    body = "{0:.20e}".format(term)
-    body = body.encode(DEFAULT_ENCODING)
-    body = body + b"\x00" * (31 - len(body))
-    return ERL_FLOAT + body
-  elif term_type is bytes:
-    if term.startswith(b":"):
-      name = term[1:]
-      length = len(name)
+        buf += ERL_LARGE_TUPLE
+        buf += _int4_pack(length)
+      else:  # pragma: no cover
+        raise ValueError("Invalid TUPLE_EXT length: {0}".format(length))
+      if cache is not None:
+        stack.append((cache._items(term, buf, new_float), b""))
+      else:
+        stack.append((iter(term), b""))
+    elif kind == _KIND_LIST:
+      if max_depth is not None and len(stack) >= max_depth:
+        raise ValueError("Maximum nesting depth exceeded: {0}".format(max_depth))
+      length = len(term)
       if not length:
-        raise ValueError("Invalid ATOM_EXT length: 0")
-      elif length > 255:
-        raise ValueError("Invalid ATOM_EXT length: {0}".format(length))
+        buf += ERL_NIL
+      elif length <= 4294967295:
+        buf += ERL_LIST
+        buf += _int4_pack(length)
+        stack.append((iter(term), ERL_NIL))
+      else: # pragma: no cover
+        raise ValueError("Invalid LIST_EXT length: {0}".format(length))
+    elif kind == _KIND_FLOAT:
+      if new_float:
+        buf += ERL_NEW_FLOAT
+        buf += _float_pack(term)
       else:
-        return ERL_ATOM + _int2_pack(length) + name
-    else:
+        body = "{0:.20e}".format(term)
+        body = body.encode(DEFAULT_ENCODING)
+        buf += ERL_FLOAT
+        buf += body
+        buf += b"\x00" * (31 - len(body))
+    elif kind == _KIND_CONSTANT:
+      if atom_refs is not None:
+        term = _constant_atoms[term]
+        continue
+      buf += _constant_terms[term]
+    elif kind == _KIND_MAP:
+      if max_depth is not None and len(stack) >= max_depth:
+        raise ValueError("Maximum nesting depth exceeded: {0}".format(max_depth))
       length = len(term)
       if length <= 4294967295:
-        return ERL_BINARY + _int4_pack(length) + term
+        buf += ERL_MAP
+        buf += _int4_pack(length)
+      else: # pragma: no cover
+        raise ValueError("Invalid MAP_EXT arity: {0}".format(length))
+      # Keys and values alternate.
+      stack.append((chain.from_iterable(term.items()), b""))
+    elif kind == _KIND_MEMORYVIEW:
+      length = _nbytes(term)
+      if length <= 4294967295:
+        buf += ERL_BINARY
+        buf += _int4_pack(length)
+        if flush is not None and length >= _PASSTHROUGH_SIZE:
+          flush(buf, term)
+        else:
+          buf += term
       else: # pragma: no cover
         raise ValueError("Invalid BINARY_EXT length: {0}".format(length))
-  elif term_type in (str, unicode):
-    new_term = term.encode(DEFAULT_ENCODING)
-    return encode_term(new_term)
-  elif term_type in (tuple, set):
-    length = len(term)
-    if length <= 255:
-      tuple_type, tuple_length = ERL_SMALL_TUPLE, _char_pack(length)
-    elif length <= 4294967295:
-      tuple_type, tuple_length = ERL_LARGE_TUPLE, _int4_pack(length)
-    else:  # pragma: no cover
-      raise ValueError("Invalid TUPLE_EXT length: {0}".format(length))
-    content = tuple_type + tuple_length
-    for item in term:
-      content += encode_term(item)
-    return content
-  elif term_type is list:
-    length = len(term)
-    if not length:
-      return ERL_NIL
-    elif length <= 4294967295:
-      body = _int4_pack(length)
-      for item in term:
-        body += encode_term(item)
-      return ERL_LIST + body + ERL_NIL
-    else: # pragma: no cover
-      raise ValueError("Invalid LIST_EXT length: {0}".format(length))
+    elif kind == _KIND_LAZY:
+      if term._options[1] is not None:
+        # Its ATOM_CACHE_REFs point into another connection's cache.
+        term = term.decode()
+        continue
+      buf += term._term[term._pos:term._end()]
+    elif kind == _KIND_CUSTOM:
+      term = _custom_encoders[type(term)](term)
+      continue
+    elif kind == _KIND_SEQUENCE:
+      if max_depth is not None and len(stack) >= max_depth:
+        raise ValueError("Maximum nesting depth exceeded: {0}".format(max_depth))
+      elif not _is_packed(term):
+        term = term.tolist()
+        continue
+      _write_sequence(term, buf, new_float)
+    elif kind == _KIND_SLOT:
+      if type(flush) is not _TemplateSink:
+        raise ValueError("SLOT is only allowed in compile_template() shapes")
+      flush(buf, term)
+    elif kind == _KIND_CACHED:
+      pass
+    elif _is_ndarray(term):
+      continue
+    else:
+      raise ValueError("Unknown datatype: {0}".format(type(term)))
+    if flush is not None and len(buf) >= _DEFLATE_CHUNK:
+      flush(buf)
+    while stack:
+      items, tail = stack[-1]
+      for term in items:
+        # Runs of small integers, as in lists of ids or counters, are
+        # written right here instead of going round the dispatch above.
+        if type(term) is int:
+          if 0 <= term <= 255:
+            buf += ERL_SMALL_INT
+            buf.append(term)
+          elif -2147483648 <= term <= 2147483647:
+            buf += ERL_INT
+            buf += _signed_int4_pack(term)
+          else:
+            break
+          if flush is not None and len(buf) >= _DEFLATE_CHUNK:
+            flush(buf)
+          continue
+        break
+      else:
+        stack.pop()
+        buf += tail
+        continue
+      break
+    else:
+      return
+
+
+def _is_ndarray(term):
+  # NumPy arrays are encoded as sequences, but NumPy isn't imported for
+  # that; once an array turns up its type joins _term_kinds.
+  numpy = sys.modules.get("numpy")
+  if numpy is None or type(term) is not numpy.ndarray:
+    return False
+  _term_kinds[numpy.ndarray] = _KIND_SEQUENCE
+  return True
+
+
+def _is_packed(term):
+  # Whether _write_sequence() takes ``term`` or it has to become a list.
+  if type(term) is bytearray:
+    return True
+  elif type(term) is array:
+    return term.typecode in _sequence_typecodes
+  return term.ndim == 1 and term.dtype.kind in "iuf"
+
+
+def _write_sequence(term, buf, new_float):
+  # Writes a bytearray, a numeric array.array or a 1-D NumPy array of
+  # numbers at once. As with Erlang's term_to_binary(), up to 65535 values
+  # that all fit in a byte make a STRING_EXT, anything else a LIST_EXT.
+  count = len(term)
+  if not count:
+    buf += ERL_NIL
+    return
+  data = numpy = None
+  floats = False
+  if type(term) is bytearray:
+    data = term
+  elif type(term) is array:
+    floats = term.typecode in "fd"
+    if not floats and 0 <= min(term) and max(term) <= 255:
+      data = bytearray(array("B", term))
   else:
-    raise ValueError("Unknown datatype: {0}".format(term_type))
+    numpy = sys.modules["numpy"]
+    floats = term.dtype.kind == "f"
+    if not floats and 0 <= term.min() and term.max() <= 255:
+      data = bytearray(term.astype(numpy.uint8))
+  if data is not None and count <= 65535:
+    buf += ERL_STRING
+    buf += _int2_pack(count)
+    buf += data
+    return
+  elif count > 4294967295: # pragma: no cover
+    raise ValueError("Invalid LIST_EXT length: {0}".format(count))
+  buf += ERL_LIST
+  buf += _int4_pack(count)
+  if data is not None:
+    body = bytearray(ERL_SMALL_INT + b"\x00") * count
+    body[1::2] = data
+    buf += body
+  elif numpy is not None:
+    buf += memoryview(_pack_rows(numpy, count, b"", [_column_pieces(numpy, term, new_float)], b"", b""))
+  elif floats and new_float:
+    # Big-endian doubles, spread out to make room for the tags.
+    values = Struct(">{0}d".format(count)).pack(*term)
+    body = bytearray(ERL_NEW_FLOAT + b"\x00" * 8) * count
+    for index in range(8):
+      body[index + 1::9] = values[index::8]
+    buf += body
+  elif floats:
+    for value in term:
+      _write_term(value, buf, None, None, new_float)
+  else:
+    for value in term:
+      if 0 <= value <= 255:
+        buf += ERL_SMALL_INT
+        buf.append(value)
+      elif -2147483648 <= value <= 2147483647:
+        buf += ERL_INT
+        buf += _signed_int4_pack(value)
+      else:
+        _write_term(value, buf)
+  buf += ERL_NIL
+
 
+def encode(term, compressed=False, max_depth=None, atom_cache=None, new_float=None, cache=None):
+  if _stats is not None:
+    return _stats._encode(term, compressed, max_depth, atom_cache, new_float, cache)
+  return _encode(term, compressed, max_depth, atom_cache, new_float, cache)
 
-def encode(term, compressed=False):
-  body = encode_term(term)
+
+def _encode(term, compressed, max_depth, atom_cache, new_float, cache=None):
+  if new_float is None:
+    new_float = DEFAULT_NEW_FLOAT
+  if cache is not None:
+    return _encode_cached(term, compressed, max_depth, atom_cache, new_float, cache)
+  if atom_cache is not None:
+    if compressed:
+      raise ValueError("Compression is not supported with an atom cache")
+    atom_refs = {}
+    body = bytearray()
+    _write_term(term, body, max_depth, atom_refs, new_float)
+    buf = atom_cache._write_header(atom_refs)
+    buf += body
+    return bytes(buf)
   if compressed:
-    if 0 > compressed or compressed > 9:
-      raise ValueError("Invalid compression level: {0}".format(compressed))
-    else:
-      compressed = compress(body, compressed)
-      compressed_length = len(compressed)
-      if compressed_length + 5 <= len(body):
-        return ERL_MAGIC + ERL_COMPRESSED + _int4_pack(compressed_length) + compressed
-  return ERL_MAGIC + body
-
-
-def decode_term(term):
-  term_type = term[:1]
-  if term_type == ERL_SMALL_INT:
-    body = term[1:2]
-    if not body:
-      raise ValueError("Incomplete SMALL_INT_EXT length: expected 1, got 0")
+    return _encode_compressed(term, compressed, max_depth, new_float)
+  buf, start = _scratch_write(term, max_depth, new_float)
+  body = _view(buf, start)
+  binary = bytes(body)
+  _release(body)
+  _scratch_done(buf)
+  return binary
+
+
+def _encode_cached(term, compressed, max_depth, atom_cache, new_float, cache):
+  # Cached tuples are cut out of the output buffer once written, so the
+  # whole body is built before any compression.
+  if atom_cache is not None:
+    raise ValueError("An encode cache is not supported with an atom cache")
+  elif max_depth is not None:
+    raise ValueError("An encode cache is not supported with max_depth")
+  buf = bytearray(ERL_MAGIC)
+  _write_term(term, buf, None, None, new_float, None, cache)
+  if compressed:
+    return _Deflater(compressed).finish(buf)
+  return bytes(buf)
+
+
+def _scratch_write(term, max_depth, new_float):
+  # Encodes ``term`` at the end of the calling thread's scratch buffer and
+  # returns the buffer along with the offset the term starts at. Terms are
+  # appended one after another rather than overwritten, because emptying
+  # a bytearray hands its memory back and the next term would grow it
+  # from scratch again. The buffer is taken from the thread until
+  # _scratch_done() hands it back, so an encode() nested in a custom
+  # type's encoder gets a fresh one instead of clearing it mid-call; after
+  # a failed call the thread simply starts over with a new buffer.
+  buf = getattr(_scratch, "buf", None)
+  if buf is None:
+    buf = bytearray()
+  else:
+    _scratch.buf = None
+  start = len(buf)
+  buf += ERL_MAGIC
+  _write_term(term, buf, max_depth, None, new_float)
+  return buf, start
+
+
+def _scratch_done(buf):
+  if len(buf) > _SCRATCH_SIZE:
+    del buf[:]
+  _scratch.buf = buf
+
+
+def encode_into(term, buf, offset=0, max_depth=None, new_float=None):
+  """
+  Writes ``encode(term)`` into the writable buffer ``buf`` (a bytearray,
+  mmap, shared memory, ...) starting at ``offset``, and returns the offset
+  just past it. Raises ValueError when it doesn't fit.
+  """
+  if new_float is None:
+    new_float = DEFAULT_NEW_FLOAT
+  scratch, start = _scratch_write(term, max_depth, new_float)
+  target = source = None
+  try:
+    target = _byte_view(buf)
+    source = _view(scratch, start)
+    end = offset + len(source)
+    if offset < 0 or end > len(target):
+      raise ValueError("Buffer too small: {0} bytes needed at offset {1}, {2} available".format(
+        end - offset, offset, len(target) - offset))
+    target[offset:end] = source
+  finally:
+    for view in (source, target):
+      if view is not None:
+        _release(view)
+    _scratch_done(scratch)
+  return end
+
+
+def encoded_size(term, max_depth=None, new_float=None):
+  """
+  Returns ``len(encode(term))`` of an uncompressed term, worked out with
+  the encoder's size rules without producing any bytes.
+  """
+  if new_float is None:
+    new_float = DEFAULT_NEW_FLOAT
+  size = 1
+  stack = []
+  while True:
+    kind = _term_kinds.get(type(term), 0)
+    if kind == _KIND_INT:
+      if 0 <= term <= 255:
+        size += 2
+      elif -2147483648 <= term <= 2147483647:
+        size += 5
+      else:
+        length = (abs(term).bit_length() + 7) >> 3
+        if length <= 255:
+          size += 3 + length
+        elif length <= 4294967295:
+          size += 6 + length
+        else: # pragma: no cover
+          raise ValueError("Invalid BIGNUM_EXT length: {0}".format(length))
+    elif kind == _KIND_TEXT:
+      term = term.encode(DEFAULT_ENCODING)
+      continue
+    elif kind == _KIND_BYTES:
+      length = len(term)
+      if term.startswith(b":"):
+        length -= 1
+        if not length:
+          raise ValueError("Invalid ATOM_EXT length: 0")
+        elif length > 255:
+          raise ValueError("Invalid ATOM_EXT length: {0}".format(length))
+        size += (3 if _is_ascii(term) else 2) + length
+      elif length <= 4294967295:
+        size += 5 + length
+      else: # pragma: no cover
+        raise ValueError("Invalid BINARY_EXT length: {0}".format(length))
+    elif kind == _KIND_TUPLE:
+      if max_depth is not None and len(stack) >= max_depth:
+        raise ValueError("Maximum nesting depth exceeded: {0}".format(max_depth))
+      length = len(term)
+      if length <= 255:
+        size += 2
+      elif length <= 4294967295:
+        size += 5
+      else:  # pragma: no cover
+        raise ValueError("Invalid TUPLE_EXT length: {0}".format(length))
+      stack.append(iter(term))
+    elif kind == _KIND_LIST:
+      if max_depth is not None and len(stack) >= max_depth:
+        raise ValueError("Maximum nesting depth exceeded: {0}".format(max_depth))
+      length = len(term)
+      if not length:
+        size += 1
+      elif length <= 4294967295:
+        # Header and the closing NIL_EXT.
+        size += 6
+        stack.append(iter(term))
+      else: # pragma: no cover
+        raise ValueError("Invalid LIST_EXT length: {0}".format(length))
+    elif kind == _KIND_FLOAT:
+      size += 9 if new_float else 32
+    elif kind == _KIND_CONSTANT:
+      size += len(_constant_terms[term])
+    elif kind == _KIND_MAP:
+      if max_depth is not None and len(stack) >= max_depth:
+        raise ValueError("Maximum nesting depth exceeded: {0}".format(max_depth))
+      size += 5
+      stack.append(chain.from_iterable(term.items()))
+    elif kind == _KIND_MEMORYVIEW:
+      length = _nbytes(term)
+      if length <= 4294967295:
+        size += 5 + length
+      else: # pragma: no cover
+        raise ValueError("Invalid BINARY_EXT length: {0}".format(length))
+    elif kind == _KIND_LAZY:
+      if term._options[1] is not None:
+        term = term.decode()
+        continue
+      size += term._end() - term._pos
+    elif kind == _KIND_CUSTOM:
+      term = _custom_encoders[type(term)](term)
+      continue
+    elif kind == _KIND_SEQUENCE:
+      if max_depth is not None and len(stack) >= max_depth:
+        raise ValueError("Maximum nesting depth exceeded: {0}".format(max_depth))
+      elif not _is_packed(term):
+        term = term.tolist()
+        continue
+      # Whether it is a STRING_EXT depends on every value, so it is simply
+      # written out.
+      body = bytearray()
+      _write_sequence(term, body, new_float)
+      size += len(body)
+    elif _is_ndarray(term):
+      continue
     else:
-      return _char_unpack(body)[0], term[2:]
-  elif term_type == ERL_INT:
-    body = term[1:5]
-    if len(body) != 4:
-      raise ValueError("Incomplete INT_EXT length: expected 4, got {0}".format(len(body)))
+      raise ValueError("Unknown datatype: {0}".format(type(term)))
+    while stack:
+      for term in stack[-1]:
+        break
+      else:
+        stack.pop()
+        continue
+      break
     else:
-      return _signed_int4_unpack(body)[0], term[5:]
-  elif term_type in (ERL_SMALL_BIGNUM, ERL_LARGE_BIGNUM):
-    if term_type == ERL_SMALL_BIGNUM:
-      length, sign = _char_unpack(term[1:2])[0], ord(term[2:3])
-      tail = term[3:]
+      return size
+
+
+def _encode_compressed(term, compressed, max_depth, new_float):
+  deflater = _Deflater(compressed)
+  buf = bytearray(ERL_MAGIC)
+  _write_term(term, buf, max_depth, None, new_float, deflater)
+  binary = deflater.finish(buf)
+  if binary is None:
+    buf = bytearray(ERL_MAGIC)
+    _write_term(term, buf, max_depth, None, new_float)
+    binary = bytes(buf)
+  return binary
+
+
+def _auto_level(body):
+  # Picks a zlib level from the size of ``body`` and from how well a few
+  # samples spread over it compress, or 0 when it isn't worth compressing.
+  size, step = len(body), _AUTO_SAMPLE_SIZE
+  if size < _AUTO_MIN_SIZE:
+    return 0
+  elif size > 3 * step:
+    sample = b"".join(bytes(body[pos:pos + step]) for pos in (0, (size - step) // 2, size - step))
+  else:
+    sample = bytes(body)
+  if len(compress(sample, 1)) * 10 > len(sample) * 9:
+    return 0
+  return 6 if size < _DEFLATE_CHUNK else 1
+
+
+def _check_level(level):
+  if level != "auto" and (type(level) not in (int, long, bool) or not 0 <= level <= 9):
+    raise ValueError("Invalid compression level: {0}".format(level))
+
+
+class _Deflater(object):
+  """
+  Compresses a term while ``_write_term()`` is still building it: whenever
+  the output buffer grows past ``_DEFLATE_CHUNK`` bytes, its contents are
+  fed to zlib and dropped, so a large body is never held uncompressed.
+  Smaller terms are compressed in one go. Either way the term is kept
+  uncompressed when compressing doesn't make it smaller; for a streamed
+  body ``finish()`` returns None and the term has to be encoded again.
+  """
+
+  def __init__(self, level):
+    _check_level(level)
+    self.level = level
+    self.size = 0
+    self.chunks = []
+    self._deflate = None
+    self._start = 1
+
+  def __call__(self, buf, data=None):
+    if data is not None:
+      buf += data
+    body = _view(buf, self._start)
+    if self._deflate is None:
+      if self.level == "auto":
+        self.level = _auto_level(body)
+      if not self.level:
+        return
+      self._deflate = compressobj(self.level)
+    self.size += len(body)
+    self.chunks.append(self._deflate.compress(body))
+    _release(body)
+    del buf[:]
+    self._start = 0
+
+  def finish(self, buf):
+    if self._deflate is None:
+      body = _view(buf, 1)
+      level = _auto_level(body) if self.level == "auto" else self.level
+      if level:
+        compressed = compress(body, level)
+        if len(compressed) + 5 <= len(body):
+          return ERL_MAGIC + ERL_COMPRESSED + _int4_pack(len(body)) + compressed
+      _release(body)
+      return bytes(buf)
+    self(buf)
+    self.chunks.append(self._deflate.flush())
+    if sum(len(chunk) for chunk in self.chunks) + 5 > self.size:
+      return None
+    if self.size > 4294967295:
+      raise ValueError("Invalid compressed term size: {0}".format(self.size))
+    return ERL_MAGIC + ERL_COMPRESSED + _int4_pack(self.size) + b"".join(self.chunks)
+
+
+def _nbytes(data):
+  if type(data) is not memoryview:
+    return len(data)
+  elif hasattr(data, "nbytes"):
+    return data.nbytes
+  # Python 2.7
+  size = data.itemsize
+  for length in data.shape:
+    size *= length
+  return size
+
+
+class _Sink(object):
+  # The flush callback of _write_term() while dumping: passes the output
+  # buffer, followed by a large binary handed over by reference, to
+  # ``write`` as a list of buffers and empties it for the next chunk.
+
+  def __init__(self, write):
+    self.write = write
+
+  def __call__(self, buf, data=None):
+    self.write([buf] if data is None else [buf, data])
+    del buf[:]
+
+
+class _FileWriter(object):
+
+  def __init__(self, fileobj):
+    self.fileobj = fileobj
+    self.size = 0
+
+  def __call__(self, buffers):
+    for data in buffers:
+      self.fileobj.write(data)
+      self.size += _nbytes(data)
+
+
+class _SocketWriter(_FileWriter):
+  # Sends all the buffers with one sendmsg() call, like writev(), falling
+  # back to sendall() where the platform has no sendmsg().
+
+  def __call__(self, buffers):
+    sock = self.fileobj
+    if not hasattr(sock, "sendmsg"):
+      for data in buffers:
+        sock.sendall(data)
+        self.size += _nbytes(data)
+      return
+    views = [memoryview(data).cast("B") for data in buffers]
+    try:
+      pending = [view for view in views if view.nbytes]
+      while pending:
+        sent = sock.sendmsg(pending)
+        self.size += sent
+        while pending and sent >= pending[0].nbytes:
+          sent -= pending.pop(0).nbytes
+        if sent:
+          pending[0] = pending[0][sent:]
+          views.append(pending[0])
+    finally:
+      for view in views:
+        view.release()
+
+
+class _DeflateWriter(object):
+  # Stands between _Sink and the writer while dumping a compressed term.
+  # The header goes out first, with the uncompressed size worked out
+  # beforehand, and every buffer after it through zlib. An "auto" level is
+  # picked on the first chunk, which may also leave the term uncompressed.
+
+  def __init__(self, write, level, size):
+    self.write = write
+    self.level = level
+    self.size = size
+    self._deflate = None
+
+  def __call__(self, buffers):
+    if self._deflate is None:
+      if self.level == "auto":
+        sample = _view(buffers[-1])
+        self.level = _auto_level(sample)
+        _release(sample)
+      if not self.level:
+        self.write(buffers)
+        return
+      self._deflate = compressobj(self.level)
+      self.write([ERL_MAGIC + ERL_COMPRESSED + _int4_pack(self.size)])
+      del buffers[0][:1]
+    chunks = []
+    for data in buffers:
+      view = _view(data)
+      chunks.append(self._deflate.compress(view))
+      _release(view)
+    self.write([chunk for chunk in chunks if chunk])
+
+  def finish(self):
+    if self._deflate is not None:
+      self.write([self._deflate.flush()])
+
+
+def _dump(term, write, compressed, max_depth, new_float):
+  if new_float is None:
+    new_float = DEFAULT_NEW_FLOAT
+  if compressed:
+    _check_level(compressed)
+    size = encoded_size(term, max_depth, new_float)
+    if size <= _DEFLATE_CHUNK:
+      write([_encode_compressed(term, compressed, max_depth, new_float)])
+      return
+    elif size - 1 > 4294967295:
+      raise ValueError("Invalid compressed term size: {0}".format(size - 1))
+    write = _DeflateWriter(write, compressed, size - 1)
+  sink = _Sink(write)
+  buf = bytearray(ERL_MAGIC)
+  _write_term(term, buf, max_depth, None, new_float, sink)
+  if buf:
+    sink(buf)
+  if compressed:
+    write.finish()
+
+
+def dump(term, fileobj, compressed=False, max_depth=None, new_float=None):
+  """
+  Writes ``encode(term)`` to ``fileobj`` while encoding it, in chunks of
+  about 64 KiB, and returns the number of bytes written. Large ``bytes``
+  and ``memoryview`` binaries are written straight from the objects passed
+  in rather than copied. A compressed term is deflated on the fly after a
+  first pass that sizes it. ``fileobj.write()`` has to take all the data
+  given to it, as buffered files do.
+  """
+  writer = _FileWriter(fileobj)
+  _dump(term, writer, compressed, max_depth, new_float)
+  return writer.size
+
+
+def dump_to_socket(term, sock, compressed=False, max_depth=None, new_float=None):
+  """
+  Like ``dump()`` for a connected blocking socket: each chunk goes out in
+  one ``sendmsg()`` call together with the large binary that follows it.
+  """
+  writer = _SocketWriter(sock)
+  _dump(term, writer, compressed, max_depth, new_float)
+  return writer.size
+
+
+def _map_chunks(executor, function, items, chunksize):
+  # Runs ``function`` over consecutive chunks of ``items`` on ``executor``
+  # and joins the results back together in input order.
+  if chunksize < 1:
+    raise ValueError("Invalid chunk size: {0}".format(chunksize))
+  items = iter(items)
+  chunks = iter(lambda: list(islice(items, chunksize)), [])
+  results = []
+  for chunk in executor.map(function, chunks):
+    results.extend(chunk)
+  return results
+
+
+def encode_many(terms, compressed=False, max_depth=None, new_float=None, executor=None, chunksize=1024, cache=None):
+  """
+  Encodes each of ``terms`` like ``encode()`` and returns a list of the
+  results in input order, resolving options and reusing one output buffer
+  for the whole batch.
+
+  With an ``executor``, such as ``concurrent.futures.ProcessPoolExecutor``,
+  the batch is split into chunks of ``chunksize`` terms that are encoded
+  in parallel. An encode ``cache`` is shared by the whole batch, so it
+  can't be combined with an executor.
+  """
+  if new_float is None:
+    new_float = DEFAULT_NEW_FLOAT
+  if executor is not None:
+    if cache is not None:
+      raise ValueError("An encode cache is not supported with an executor")
+    function = partial(encode_many, compressed=compressed, max_depth=max_depth, new_float=new_float)
+    return _map_chunks(executor, function, terms, chunksize)
+  if cache is not None:
+    return [_encode_cached(term, compressed, max_depth, None, new_float, cache) for term in terms]
+  if compressed:
+    return [_encode_compressed(term, compressed, max_depth, new_float) for term in terms]
+  results = []
+  buf = bytearray(ERL_MAGIC)
+  for term in terms:
+    del buf[1:]
+    _write_term(term, buf, max_depth, None, new_float)
+    results.append(bytes(buf))
+  return results
+
+
+class _Slot(object):
+  __slots__ = ()
+
+  def __repr__(self):
+    return "termformat.SLOT"
+
+
+# Marks the variable parts of a compile_template() shape.
+SLOT = _Slot()
+_term_kinds[_Slot] = _KIND_SLOT
+
+
+class _TemplateSink(object):
+  # The flush callback of _write_term() while compiling a template: cuts
+  # its output into the constant parts around each slot.
+
+  def __init__(self):
+    self.parts = []
+    self.pending = bytearray()
+
+  def __call__(self, buf, data=None):
+    self.pending += buf
+    del buf[:]
+    if data is SLOT:
+      self.parts.append(bytes(self.pending))
+      del self.pending[:]
+    elif data is not None:
+      self.pending += data
+
+
+class Template(object):
+  """
+  A shape compiled by ``compile_template()``. ``encode(*values)`` writes
+  only the values and copies the pre-encoded parts around them.
+  """
+
+  def __init__(self, parts, new_float):
+    self._parts = parts
+    self._new_float = new_float
+    self.slots = len(parts) - 1
+
+  def encode(self, *values):
+    parts = self._parts
+    if len(values) != self.slots:
+      raise ValueError("Expected {0} template values, got {1}".format(self.slots, len(values)))
+    buf = bytearray(parts[0])
+    for index, value in enumerate(values):
+      _write_term(value, buf, None, None, self._new_float)
+      buf += parts[index + 1]
+    return bytes(buf)
+
+
+def _same_term(term, other):
+  # Whether two equal terms have the same types all the way down too; 1,
+  # 1.0 and True are equal dict keys but encode differently, and so do
+  # 0.0 and -0.0.
+  pairs = [(term, other)]
+  while pairs:
+    term, other = pairs.pop()
+    if term is other:
+      continue
+    elif type(term) is not type(other):
+      return False
+    elif type(term) is tuple:
+      pairs.extend(zip(term, other))
+    elif type(term) is float and copysign(1.0, term) != copysign(1.0, other):
+      return False
+  return True
+
+
+def _immutable_term(term):
+  # Whether ``term`` is a tuple of ints, floats, strings, bytes, booleans,
+  # None and such tuples only. Anything else, such as custom types, lazy
+  # views and memoryviews, may change after it has been cached.
+  stack = [term]
+  while stack:
+    for item in stack.pop():
+      if type(item) is tuple:
+        stack.append(item)
+      elif _term_kinds.get(type(item)) not in _immutable_kinds:
+        return False
+  return True
+
+
+class EncodeCache(object):
+  """Remembers the encoding of repeated subterms across ``encode()`` calls.
+
+  Pass it as ``encode(term, cache=cache)``. Tuples of immutable built-in
+  values, integers beyond 32 bits and strings of at least 64 characters
+  are looked up by value, so an equal subterm built anew still hits. Holds up to ``size``
+  entries and ``max_bytes`` of encoded data and evicts the least recently
+  used ones when full; ``hits``, ``misses`` and ``evictions`` count since
+  creation or the last ``clear()``. Not thread-safe, use one per thread.
+  """
+
+  def __init__(self, size=DEFAULT_ENCODE_CACHE_SIZE, max_bytes=DEFAULT_ENCODE_CACHE_BYTES):
+    self.size = size
+    self.max_bytes = max_bytes
+    self.nbytes = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self._entries = OrderedDict()
+
+  def __len__(self):
+    return len(self._entries)
+
+  def _lookup(self, term, kind, new_float):
+    # Returns the encoding of ``term``, or None to have it written as
+    # usual. Tuples are stored by _items() once written, anything else
+    # that qualifies is encoded and stored right here.
+    if kind == _KIND_INT:
+      if -2147483648 <= term <= 2147483647:
+        return None
+    elif kind != _KIND_TUPLE and len(term) < _CACHE_MIN_LENGTH:
+      return None
+    elif kind == _KIND_TUPLE and (type(term) is not tuple or not _immutable_term(term)):
+      return None
+    entry = self._entries.pop(term, None)
+    if entry is not None and entry[2] == new_float and _same_term(entry[0], term):
+      self.hits += 1
+      self._entries[term] = entry
+      return entry[1]
+    if entry is not None:
+      self.nbytes -= len(entry[1])
+    self.misses += 1
+    if kind == _KIND_TUPLE:
+      return None
+    body = bytearray()
+    _write_term(term, body, None, None, new_float)
+    encoded = bytes(body)
+    self._store(term, encoded, new_float)
+    return encoded
+
+  def _items(self, term, buf, new_float):
+    # Iterates over a tuple that missed the cache while _write_term()
+    # writes it, and stores the bytes it took up once done.
+    if type(term) is not tuple or not _immutable_term(term):
+      return iter(term)
+    return self._caching_items(term, buf, len(buf) - (2 if len(term) <= 255 else 5), new_float)
+
+  def _caching_items(self, term, buf, start, new_float):
+    for item in term:
+      yield item
+    self._store(term, bytes(buf[start:]), new_float)
+
+  def _store(self, term, encoded, new_float):
+    if not self.size or len(encoded) > self.max_bytes:
+      return
+    entries = self._entries
+    entry = entries.pop(term, None)
+    if entry is not None:
+      self.nbytes -= len(entry[1])
+    while entries and (len(entries) >= self.size or self.nbytes + len(encoded) > self.max_bytes):
+      self.nbytes -= len(entries.popitem(False)[1][1])
+      self.evictions += 1
+    entries[term] = (term, encoded, new_float)
+    self.nbytes += len(encoded)
+
+  def clear(self):
+    self._entries.clear()
+    self.nbytes = self.hits = self.misses = self.evictions = 0
+
+
+def compile_template(shape, new_float=None):
+  """
+  Pre-encodes ``shape``, a term with ``SLOT`` in place of each variable
+  part, and returns a ``Template`` whose ``encode()`` takes one value per
+  slot, in the order they appear, and returns the same bytes as
+  ``encode()`` of the filled-in term:
+
+    reply = compile_template((":reply", SLOT, (":ok", SLOT)))
+    reply.encode(ref, payload) # == encode((":reply", ref, (":ok", payload)))
+  """
+  if new_float is None:
+    new_float = DEFAULT_NEW_FLOAT
+  sink = _TemplateSink()
+  buf = bytearray(ERL_MAGIC)
+  _write_term(shape, buf, None, None, new_float, sink)
+  sink(buf)
+  sink.parts.append(bytes(sink.pending))
+  return Template(tuple(sink.parts), new_float)
+
+
+def register_type(cls, encoder, tag=None, decoder=None):
+  """
+  Makes ``encode()`` accept instances of ``cls`` (that exact type, not its
+  subclasses): ``encoder(obj)`` returns the term written in their place,
+  typically a tuple tagged with an atom such as ``(":point", x, y)``.
+
+  Given the atom ``tag`` and a ``decoder``, decoded tuples whose first
+  element is ``tag`` are passed to ``decoder(term)`` and replaced by what
+  it returns, in the same pass that builds them.
+  """
+  if _term_kinds.get(cls, _KIND_CUSTOM) != _KIND_CUSTOM:
+    raise ValueError("Built-in datatype: {0}".format(cls))
+  elif (tag is None) != (decoder is None):
+    raise ValueError("A record tag needs a decoder and vice versa")
+  elif tag is not None and (type(tag) not in (str, unicode) or len(tag) < 2 or tag[0] != ":"):
+    raise ValueError("Invalid record tag: {0}".format(tag))
+  _custom_encoders[cls] = encoder
+  _term_kinds[cls] = _KIND_CUSTOM
+  if tag is not None:
+    _record_decoders[unicode(tag)] = decoder
+
+
+def unregister_type(cls, tag=None):
+  """Undoes ``register_type()`` for ``cls`` and the record ``tag``."""
+  if _term_kinds.get(cls) == _KIND_CUSTOM:
+    del _term_kinds[cls]
+    del _custom_encoders[cls]
+  if tag is not None:
+    _record_decoders.pop(unicode(tag), None)
+
+
+class AtomTable(object):
+  """Interns decoded atoms so repeated names share one string object.
+
+  Holds up to ``size`` atoms and evicts the least recently used one when
+  full; ``size=0`` disables interning. ``hits`` and ``misses`` count
+  lookups since creation or the last ``clear()``.
+  """
+
+  def __init__(self, size=DEFAULT_ATOM_TABLE_SIZE):
+    self.size = size
+    self.hits = 0
+    self.misses = 0
+    self._atoms = OrderedDict()
+
+  def __len__(self):
+    return len(self._atoms)
+
+  def atom(self, name, latin1=False):
+    """
+    Returns the atom for the raw UTF-8 ``name`` bytes, or Latin-1 ones
+    with ``latin1`` as in ATOM_EXT and SMALL_ATOM_EXT; true, false and
+    undefined come back as True, False and None.
+    """
+    if type(name) is not bytes:
+      name = bytes(name)
+    # The same bytes may stand for different atoms in either encoding.
+    key = (name, True) if latin1 else name
+    atoms = self._atoms
+    value = atoms.pop(key, _missing)
+    if value is not _missing:
+      self.hits += 1
     else:
-      length, sign = _int4_unpack(term[1:5])[0], ord(term[5:6])
-      tail = term[4:]
-    n = 0
-    if length:
-      for i in tail[length-1::-1]:
-        if isinstance(i, bytes):
-          i = ord(i)
-        n = (n << 8) | i
+      self.misses += 1
+      value = _native_atoms.get(name, _missing)
+      if value is _missing:
+        value = ":" + unicode(name, "latin-1" if latin1 else DEFAULT_ENCODING)
+      if len(atoms) >= self.size:
+        if not self.size:
+          return value
+        atoms.popitem(False)
+    atoms[key] = value
+    return value
+
+  def clear(self):
+    self._atoms.clear()
+    self.hits = self.misses = 0
+
+
+atom_table = AtomTable()
+
+
+class AtomCache(object):
+  """Atom cache state of one distribution connection.
+
+  Passing the same instance to every ``encode()`` and ``decode()`` call on
+  a connection makes the terms carry a distribution header: the first time
+  an atom is sent its name is stored in the peer's cache, afterwards it is
+  sent as a one byte ATOM_CACHE_REF. Both directions of the connection are
+  tracked separately, following the 8 x 256 entry layout of ERTS.
+  """
+
+  def __init__(self):
+    self._sent = [None] * 2048
+    self._received = [None] * 2048
+
+  def clear(self):
+    self._sent = [None] * 2048
+    self._received = [None] * 2048
+
+  def _write_header(self, atom_refs):
+    names = sorted(atom_refs, key=atom_refs.get)
+    count = len(names)
+    buf = bytearray(ERL_MAGIC + ERL_DIST_HEADER)
+    buf.append(count)
+    if not count:
+      return buf
+    long_atoms = max(len(name) for name in names) > 256
+    flags = bytearray(count // 2 + 1)
+    entries = bytearray()
+    sent = self._sent
+    for i, name in enumerate(names):
+      index = crc32(name) & 0x7ff
+      flag = index >> 8
+      entries.append(index & 0xff)
+      if sent[index] != name:
+        sent[index] = name
+        flag |= 8
+        if long_atoms:
+          entries += _int2_pack(len(name) - 1)
+        else:
+          entries.append(len(name) - 1)
+        entries += name[1:]
+      flags[i >> 1] |= flag << ((i & 1) << 2)
+    if long_atoms:
+      flags[count >> 1] |= 1 << ((count & 1) << 2)
+    buf += flags
+    buf += entries
+    return buf
+
+  def _read_header(self, term, pos, atoms):
+    # Returns the atoms referenced by the header starting at ``pos`` and
+    # the offset of the term that follows it.
+    size = len(term)
+    if pos >= size:
+      raise ValueError("Incomplete distribution header")
+    count = term[pos]
+    pos += 1
+    if not count:
+      return [], pos
+    flags = pos
+    pos += count // 2 + 1
+    if pos > size:
+      raise ValueError("Incomplete distribution header")
+    long_atoms = term[flags + count // 2] >> ((count & 1) << 2) & 1
+    received = self._received
+    refs = [None] * count
+    for i in xrange(count):
+      flag = term[flags + i // 2] >> ((i & 1) << 2)
+      if pos >= size:
+        raise ValueError("Incomplete distribution header")
+      index = (flag & 7) << 8 | term[pos]
+      pos += 1
+      if flag & 8:
+        if long_atoms:
+          if pos + 2 > size:
+            raise ValueError("Incomplete distribution header")
+          length, = _int2_unpack_from(term, pos)
+          pos += 2
+        elif pos >= size:
+          raise ValueError("Incomplete distribution header")
+        else:
+          length = term[pos]
+          pos += 1
+        if pos + length > size:
+          raise ValueError("Incomplete distribution header")
+        received[index] = atoms.atom(term[pos:pos + length])
+        pos += length
+      elif received[index] is None:
+        raise ValueError("Unknown atom cache entry: {0}".format(index))
+      refs[i] = received[index]
+    return refs, pos
+
+
+def decode_term(term, pos=0, max_depth=None, atoms=None, atom_refs=None, binary=None, string=None):
+  # Containers push a frame of (items decoded so far, expected length,
+  # tag), so nesting depth is bounded by memory, not recursion.
+  if atoms is None:
+    atoms = atom_table
+  view = None
+  binary_mode = _binary_mode(binary)
+  string_mode = _string_mode(string)
+  if binary_mode == 2:
+    view = memoryview(term)
+  size = len(term)
+  stack = []
+  while True:
+    term_type = term[pos] if pos < size else None
+    if term_type == _SMALL_INT:
+      if pos + 2 > size:
+        raise ValueError("Incomplete SMALL_INT_EXT length: expected 1, got 0")
+      value = term[pos + 1]
+      pos += 2
+    elif term_type == _INT:
+      available = size - pos - 1
+      if available < 4:
+        raise ValueError("Incomplete INT_EXT length: expected 4, got {0}".format(available))
+      value, = _signed_int4_unpack_from(term, pos + 1)
+      pos += 5
+    elif term_type == _SMALL_BIGNUM or term_type == _LARGE_BIGNUM:
+      header = 1 if term_type == _SMALL_BIGNUM else 4
+      start = pos + header + 2
+      if start > size:
+        raise ValueError("Incomplete BIGNUM_EXT length header")
+      elif header == 1:
+        length = term[pos + 1]
+      else:
+        length, = _int4_unpack_from(term, pos + 1)
+      sign = term[start - 1]
+      pos = start + length
+      if pos > size:
+        raise ValueError("Incomplete BIGNUM_EXT length: expected {0}, got {1}".format(length, size - start))
+      value = _bignum_unpack(term[start:pos])
       if sign:
-        n = -n
-    return n, tail[length:]
-  elif term_type == ERL_FLOAT:
-    body = term[1:32]
-    if len(body) != 31:
-      raise ValueError("Incomplete FLOAT_EXT length: expected 31, got {0}".format(len(body)))
-    else:
-      body = body.split(b"\x00")[0]
-      return float(body), term[32:]
-  elif term_type == ERL_NEW_FLOAT:
-    body = term[1:9]
-    if len(body) != 8:
-      raise ValueError("Incomplete NEW_FLOAT_EXT length: expected 8, got {0}".format(len(body)))
+        value = -value
+    elif term_type == _FLOAT:
+      body = bytes(term[pos + 1:pos + 32])
+      if len(body) != 31:
+        raise ValueError("Incomplete FLOAT_EXT length: expected 31, got {0}".format(len(body)))
+      value = float(body.split(b"\x00")[0])
+      pos += 32
+    elif term_type == _NEW_FLOAT:
+      available = size - pos - 1
+      if available < 8:
+        raise ValueError("Incomplete NEW_FLOAT_EXT length: expected 8, got {0}".format(available))
+      value, = _float_unpack_from(term, pos + 1)
+      pos += 9
+    elif term_type == _STRING:
+      if pos + 3 > size:
+        raise ValueError("Incomplete STRING_EXT length header")
+      length, = _int2_unpack_from(term, pos + 1)
+      start = pos + 3
+      pos = start + length
+      if pos > size:
+        raise ValueError("Incomplete STRING_EXT length: expected {0}, got {1}".format(length, size - start))
+      if not string_mode:
+        # Each byte is one character code, which is what Latin-1 maps
+        # them to, so any STRING_EXT decodes.
+        value = _unicode(term[start:pos], "latin-1")
+      elif string_mode == 1:
+        value = bytes(term[start:pos])
+      elif string_mode == 2:
+        value = array("B", term[start:pos])
+      else:
+        value = list(bytearray(term[start:pos]))
+    elif term_type == _BINARY:
+      if pos + 5 > size:
+        raise ValueError("Incomplete BINARY_EXT length header")
+      length = _int4_unpack_from(term, pos + 1)[0] + 5
+      if pos + length > size:
+        raise ValueError("Incomplete BINARY_EXT length: expected {0}, got {1}".format(length, size - pos - 5))
+      if not binary_mode:
+        value = _unicode(term[pos + 5:pos + length], DEFAULT_ENCODING)
+      elif view is None:
+        value = bytes(term[pos + 5:pos + length])
+      else:
+        value = view[pos + 5:pos + length]
+      pos += length
+    elif term_type == _ATOM:
+      if pos + 3 > size:
+        raise ValueError("Incomplete ATOM_EXT length header")
+      atom_length = _int2_unpack_from(term, pos + 1)[0] + 3
+      if pos + atom_length > size:
+        raise ValueError("Invalid ATOM_EXT length: expected {0}, got {1}".format(atom_length, size - pos - 3))
+      value = atoms.atom(term[pos + 3:pos + atom_length], True)
+      pos += atom_length
+    elif term_type == _SMALL_ATOM_UTF8 or term_type == _SMALL_ATOM:
+      if pos + 2 > size:
+        raise ValueError("Incomplete SMALL_ATOM_EXT length header")
+      atom_length = term[pos + 1] + 2
+      if pos + atom_length > size:
+        raise ValueError("Invalid SMALL_ATOM_EXT length: expected {0}, got {1}".format(atom_length, size - pos - 2))
+      value = atoms.atom(term[pos + 2:pos + atom_length], term_type == _SMALL_ATOM)
+      pos += atom_length
+    elif term_type == _ATOM_UTF8:
+      if pos + 3 > size:
+        raise ValueError("Incomplete ATOM_UTF8_EXT length header")
+      atom_length = _int2_unpack_from(term, pos + 1)[0] + 3
+      if pos + atom_length > size:
+        raise ValueError("Invalid ATOM_UTF8_EXT length: expected {0}, got {1}".format(atom_length, size - pos - 3))
+      value = atoms.atom(term[pos + 3:pos + atom_length])
+      pos += atom_length
+    elif term_type == _ATOM_CACHE_REF:
+      if pos + 2 > size:
+        raise ValueError("Incomplete ATOM_CACHE_REF")
+      index = term[pos + 1]
+      if atom_refs is None or index >= len(atom_refs):
+        raise ValueError("Invalid ATOM_CACHE_REF index: {0}".format(index))
+      value = atom_refs[index]
+      pos += 2
+    elif term_type == _NIL:
+      value = []
+      pos += 1
+    elif term_type == _SMALL_TUPLE or term_type == _LARGE_TUPLE or term_type == _LIST:
+      if term_type == _SMALL_TUPLE:
+        if pos + 2 > size:
+          raise ValueError("Incomplete SMALL_TUPLE_EXT length header")
+        length = term[pos + 1]
+        pos += 2
+      elif pos + 5 > size:
+        if term_type == _LIST:
+          raise ValueError("Incomplete ERL_LIST length header")
+        raise ValueError("Incomplete LARGE_TUPLE_EXT length header")
+      else:
+        length, = _int4_unpack_from(term, pos + 1)
+        pos += 5
+      if max_depth is not None and len(stack) >= max_depth:
+        raise ValueError("Maximum nesting depth exceeded: {0}".format(max_depth))
+      if length:
+        stack.append(([], length, term_type))
+        continue
+      elif term_type == _LIST:
+        value = []
+        if pos < size and term[pos] == _NIL:
+          pos += 1
+      else:
+        value = ()
+    elif term_type == _MAP:
+      if pos + 5 > size:
+        raise ValueError("Incomplete MAP_EXT arity header")
+      length, = _int4_unpack_from(term, pos + 1)
+      pos += 5
+      if max_depth is not None and len(stack) >= max_depth:
+        raise ValueError("Maximum nesting depth exceeded: {0}".format(max_depth))
+      if length:
+        # Keys and values alternate.
+        stack.append(([], 2 * length, _MAP))
+        continue
+      value = {}
     else:
-      return _float_unpack(body)[0], term[9:]
-  elif term_type == ERL_STRING:
-    length = term[1:3]
-    if len(length) != 2:
-      raise ValueError("Incomplete STRING_EXT length header")
+      raise ValueError("Invalid term type: {0}".format(bytes(term[pos:pos + 1])))
+    while stack:
+      objects, length, tag = stack[-1]
+      objects.append(value)
+      if len(objects) < length:
+        break
+      stack.pop()
+      if tag == _LIST:
+        value = objects
+        if pos < size and term[pos] == _NIL:
+          pos += 1
+      elif tag == _MAP:
+        value = _map_from_pairs(objects)
+      else:
+        value = tuple(objects)
+        if _record_decoders and type(objects[0]) is unicode:
+          decoder = _record_decoders.get(objects[0])
+          if decoder is not None:
+            value = decoder(value)
     else:
-      length, = _int2_unpack(length)
-    body = term[3:length + 3]
-    if length > 65535:
-      raise ValueError("Invalid STRING_EXT length: {0}".format(length))
-    elif length > len(body):
-      raise ValueError("Incomplete STRING_EXT length: expected {0}, got {1}".format(length, len(body)))
+      return value, pos
+
+
+def _map_from_pairs(objects):
+  try:
+    return dict(zip(islice(objects, 0, None, 2), islice(objects, 1, None, 2)))
+  except TypeError:
+    raise ValueError("Unhashable MAP_EXT key")
+
+
+def _skip_term(term, pos):
+  # Returns the offset just past the term starting at ``pos`` without
+  # building any objects, or -1 when ``term`` ends before the term does.
+  pos, pending = _skip_partial(term, pos, 1)
+  return -1 if pending else pos
+
+
+def _skip_partial(term, pos, pending):
+  # Skips the ``pending`` terms that follow each other from ``pos``. Returns
+  # the offset just past them and 0, or, when ``term`` ends first, where
+  # the first incomplete term starts and how many terms are left from
+  # there, so that the walk can carry on once more data is in.
+  size = len(term)
+  while pending and pos < size:
+    term_type = term[pos]
+    if term_type == _SMALL_INT:
+      end = pos + 2
+    elif term_type == _INT:
+      end = pos + 5
+    elif term_type == _NEW_FLOAT:
+      end = pos + 9
+    elif term_type == _FLOAT:
+      end = pos + 32
+    elif term_type == _NIL:
+      end = pos + 1
+    elif term_type == _ATOM_CACHE_REF:
+      end = pos + 2
+    elif term_type == _ATOM or term_type == _STRING or term_type == _ATOM_UTF8:
+      if pos + 3 > size:
+        break
+      end = pos + 3 + _int2_unpack_from(term, pos + 1)[0]
+    elif term_type == _SMALL_ATOM_UTF8 or term_type == _SMALL_ATOM:
+      if pos + 2 > size:
+        break
+      end = pos + 2 + term[pos + 1]
+    elif term_type == _BINARY:
+      if pos + 5 > size:
+        break
+      end = pos + 5 + _int4_unpack_from(term, pos + 1)[0]
+    elif term_type == _SMALL_BIGNUM:
+      if pos + 2 > size:
+        break
+      end = pos + 3 + term[pos + 1]
+    elif term_type == _LARGE_BIGNUM:
+      if pos + 5 > size:
+        break
+      end = pos + 6 + _int4_unpack_from(term, pos + 1)[0]
+    elif term_type == _SMALL_TUPLE:
+      if pos + 2 > size:
+        break
+      pending += term[pos + 1]
+      end = pos + 2
+    elif term_type == _LARGE_TUPLE:
+      if pos + 5 > size:
+        break
+      pending += _int4_unpack_from(term, pos + 1)[0]
+      end = pos + 5
+    elif term_type == _LIST:
+      if pos + 5 > size:
+        break
+      # Elements plus the tail, which is NIL_EXT for proper lists.
+      pending += _int4_unpack_from(term, pos + 1)[0] + 1
+      end = pos + 5
+    elif term_type == _MAP:
+      if pos + 5 > size:
+        break
+      pending += 2 * _int4_unpack_from(term, pos + 1)[0]
+      end = pos + 5
     else:
-      return body.decode(DEFAULT_ENCODING), term[length:]
-  elif term_type == ERL_BINARY:
-    length = term[1:5]
-    if len(length) != 4:
-      raise ValueError("Incomplete BINARY_EXT length header")
+      raise ValueError("Invalid term type: {0}".format(bytes(term[pos:pos + 1])))
+    if end > size:
+      break
+    pos = end
+    pending -= 1
+  return pos, pending
+
+
+def _binary_mode(binary):
+  try:
+    return _binary_modes[DEFAULT_BINARY if binary is None else binary]
+  except KeyError:
+    raise ValueError("Invalid binary mode: {0}".format(binary))
+
+
+def _string_mode(string):
+  try:
+    return _string_modes[DEFAULT_STRING if string is None else string]
+  except KeyError:
+    raise ValueError("Invalid string mode: {0}".format(string))
+
+
+def _term_body(term, atoms=None, atom_cache=None, max_size=None):
+  # Strips the version magic and any distribution header or compression,
+  # returning (buffer, offset of the term, atom cache refs).
+  term = _buffer(term)
+  if term[:1] != ERL_MAGIC:
+    raise ValueError("Invalid external term format version")
+  elif term[1:2] == ERL_DIST_HEADER:
+    if atom_cache is None:
+      raise ValueError("Distribution header requires an atom cache")
+    atom_refs, pos = atom_cache._read_header(term, 2, atom_table if atoms is None else atoms)
+    return term, pos, atom_refs
+  elif term[1:2] == ERL_COMPRESSED:
+    return _inflate_term(term, max_size), 0, None
+  return term, 1, None
+
+
+def _inflate_term(term, max_size=None):
+  # Inflates a compressed term straight out of ``term``, producing no more
+  # than the uncompressed size declared in its header.
+  if len(term) < 16:
+    raise ValueError("Incomplete compressed packet")
+  if max_size is None:
+    max_size = DEFAULT_MAX_SIZE
+  size, = _int4_unpack_from(term, 2)
+  _check_size(size, max_size)
+  data = _view(term, 6)
+  inflate = decompressobj()
+  body = inflate.decompress(data, size + 1)
+  if len(body) > size and size == len(data):
+    # Written by an earlier version, which stored the compressed length.
+    body += inflate.decompress(inflate.unconsumed_tail, 0 if max_size is None else max(max_size - len(body), 0) + 1)
+    size = len(body)
+    _check_size(size, max_size)
+  if len(body) > size:
+    raise ValueError("Invalid compressed packet: more than {0} bytes".format(size))
+  elif len(body) < size or not _inflate_eof(inflate):
+    raise ValueError("Incomplete compressed packet: expected {0} bytes, but got only {1}".format(size, len(body)))
+  return _buffer(body)
+
+
+def _inflate_eof(inflate):
+  # Decompress.eof is new in Python 3.3. Before that, anything fed in after
+  # the end of the stream is left in unused_data, so a copy is probed.
+  try:
+    return inflate.eof
+  except AttributeError:
+    if inflate.unused_data:
+      return True
+    probe = inflate.copy()
+    try:
+      probe.decompress(b"\x00")
+    except _ZlibError:
+      return False
+    return bool(probe.unused_data)
+
+
+def _check_size(size, max_size):
+  if max_size is not None and size > max_size:
+    raise ValueError("Compressed term too large: {0} bytes, at most {1} allowed".format(size, max_size))
+
+
+def decode(term, max_depth=None, atoms=None, atom_cache=None, binary=None, max_size=None, string=None):
+  if _stats is not None:
+    return _stats._decode(term, max_depth, atoms, atom_cache, binary, max_size, string)
+  term, pos, atom_refs = _term_body(term, atoms, atom_cache, max_size)
+  return decode_term(term, pos, max_depth, atoms, atom_refs, binary, string)[0]
+
+
+def decode_many(terms, max_depth=None, atoms=None, binary=None, executor=None, chunksize=1024, string=None,
+                max_size=None):
+  """
+  Decodes each of ``terms`` like ``decode()`` and returns a list of the
+  results in input order. ``executor`` and ``chunksize`` work as they do
+  for ``encode_many()``; ``max_size`` bounds the uncompressed size of
+  compressed terms.
+  """
+  if binary is None:
+    binary = DEFAULT_BINARY
+  if string is None:
+    string = DEFAULT_STRING
+  _binary_mode(binary)
+  _string_mode(string)
+  if executor is not None:
+    function = partial(decode_many, max_depth=max_depth, atoms=atoms, binary=binary, string=string,
+                       max_size=max_size)
+    return _map_chunks(executor, function, terms, chunksize)
+  if atoms is None:
+    atoms = atom_table
+  results = []
+  for term in terms:
+    term, pos, atom_refs = _term_body(term, atoms, None, max_size)
+    results.append(decode_term(term, pos, max_depth, atoms, atom_refs, binary, string)[0])
+  return results
+
+
+def _elements_start(term, pos):
+  # Returns how many elements the tuple, list or map at ``pos`` holds, how
+  # many terms follow them (the tail of a list) and where the first one
+  # starts; (0, 1, pos) for any other term.
+  size = len(term)
+  term_type = term[pos] if pos < size else None
+  if term_type == _SMALL_TUPLE and pos + 2 <= size:
+    return term[pos + 1], 0, pos + 2
+  if term_type in (_LARGE_TUPLE, _LIST, _MAP) and pos + 5 <= size:
+    length = _int4_unpack_from(term, pos + 1)[0]
+    if term_type == _LIST:
+      return length, 1, pos + 5
+    return 2 * length if term_type == _MAP else length, 0, pos + 5
+  return 0, 1, pos
+
+
+def scan(term, offsets=False, max_size=None):
+  """
+  Checks that ``term`` holds exactly one complete, well-formed external
+  term without decoding it, raising ValueError otherwise. With
+  ``offsets``, returns an ``array("Q")`` (``array("L")`` on Python 2.7)
+  of where each element of the top-level tuple, list or map starts (keys
+  and values alternate; empty for any other term). Offsets of compressed
+  terms refer to the decompressed body.
+  """
+  term, pos, _ = _term_body(term, None, None, max_size)
+  elements = None
+  length, tail = 0, 1
+  if offsets:
+    elements = array(_OFFSET_TYPECODE)
+    length, tail, pos = _elements_start(term, pos)
+    # Every element takes at least one byte.
+    if length > len(term) - pos:
+      raise ValueError("Incomplete term at offset {0}".format(pos))
+  for index in xrange(length + tail):
+    if index < length:
+      elements.append(pos)
+    end = _skip_term(term, pos)
+    if end < 0:
+      raise ValueError("Incomplete term at offset {0}".format(pos))
+    pos = end
+  if pos != len(term):
+    raise ValueError("Trailing data after term at offset {0}".format(pos))
+  return elements
+
+
+def _term_end(term, pos, options):
+  # Like _skip_term(), but lets the decoder report what exactly is
+  # missing when ``term`` ends early.
+  end = _skip_term(term, pos)
+  if end < 0:
+    atoms, atom_refs, binary = options
+    decode_term(term, pos, None, atoms, atom_refs, binary)
+    raise ValueError("Incomplete term at offset {0}".format(pos))
+  return end
+
+
+class _LazyTerm(object):
+  """
+  Read-only view of a tuple or list inside an encoded term.
+
+  Element offsets are found as far as the highest index read so far, and
+  each element is decoded on first access; nested tuples and lists come
+  back as views of their own. Passing a view to ``encode()`` copies its
+  encoded bytes through without re-encoding them.
+  """
+
+  __slots__ = ("_term", "_pos", "_length", "_offsets", "_items", "_options")
+
+  def __init__(self, term, pos, length, start, options):
+    self._term = term
+    self._pos = pos
+    self._length = length
+    self._offsets = [start]
+    self._items = {}
+    self._options = options
+
+  def __len__(self):
+    return self._length
+
+  def __iter__(self):
+    for index in range(self._length):
+      yield self[index]
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return self._type(self[i] for i in range(*index.indices(self._length)))
+    if index < 0:
+      index += self._length
+    if not 0 <= index < self._length:
+      raise IndexError("{0} index out of range".format(self._type.__name__))
+    try:
+      return self._items[index]
+    except KeyError:
+      value = self._items[index] = _lazy_term(self._term, self._offset(index), self._options)
+      return value
+
+  def __repr__(self):
+    return "<{0} of {1} elements>".format(type(self).__name__, self._length)
+
+  def raw(self, index=None):
+    """
+    Encoded bytes of the whole term (without the version magic), or of
+    the element at ``index``.
+    """
+    if index is None:
+      return bytes(self._term[self._pos:self._end()])
+    if index < 0:
+      index += self._length
+    if not 0 <= index < self._length:
+      raise IndexError("{0} index out of range".format(self._type.__name__))
+    return bytes(self._term[self._offset(index):self._offset(index + 1)])
+
+  def decode(self):
+    """
+    Decodes the whole term into a regular tuple or list.
+    """
+    atoms, atom_refs, binary = self._options
+    return decode_term(self._term, self._pos, None, atoms, atom_refs, binary)[0]
+
+  def _offset(self, index):
+    offsets = self._offsets
+    while len(offsets) <= index:
+      offsets.append(_term_end(self._term, offsets[-1], self._options))
+    return offsets[index]
+
+  def _end(self):
+    return _term_end(self._term, self._pos, self._options)
+
+
+class LazyTuple(_LazyTerm):
+  __slots__ = ()
+  _type = tuple
+
+
+class LazyList(_LazyTerm):
+  __slots__ = ()
+  _type = list
+
+
+_term_kinds[LazyTuple] = _term_kinds[LazyList] = _KIND_LAZY
+
+
+def _lazy_term(term, pos, options):
+  size = len(term)
+  term_type = term[pos] if pos < size else None
+  if term_type == _SMALL_TUPLE and pos + 2 <= size:
+    return LazyTuple(term, pos, term[pos + 1], pos + 2, options)
+  elif (term_type == _LARGE_TUPLE or term_type == _LIST) and pos + 5 <= size:
+    length, = _int4_unpack_from(term, pos + 1)
+    lazy_type = LazyList if term_type == _LIST else LazyTuple
+    return lazy_type(term, pos, length, pos + 5, options)
+  atoms, atom_refs, binary = options
+  return decode_term(term, pos, None, atoms, atom_refs, binary)[0]
+
+
+def decode_lazy(term, atoms=None, atom_cache=None, binary=None, max_size=None):
+  """
+  Like ``decode()``, but tuples and lists are returned as ``LazyTuple`` and
+  ``LazyList`` views backed by ``term`` that decode elements only as they
+  are accessed. ``max_size`` bounds the uncompressed size of a compressed
+  term.
+  """
+  _binary_mode(binary)
+  term, pos, atom_refs = _term_body(term, atoms, atom_cache, max_size)
+  return _lazy_term(term, pos, (atoms, atom_refs, binary))
+
+
+
+def extract(term, path, atoms=None, atom_cache=None, binary=None, max_size=None):
+  """
+  Decodes only the subterm at ``path``, a sequence of tuple or list
+  indexes, so that ``extract(term, (2, 0))`` equals ``decode(term)[2][0]``.
+  Siblings on the way are skipped over by their length headers.
+  ``max_size`` bounds the uncompressed size of a compressed term.
+  """
+  _binary_mode(binary)
+  term, pos, atom_refs = _term_body(term, atoms, atom_cache, max_size)
+  options = (atoms, atom_refs, binary)
+  size = len(term)
+  path = tuple(path)
+  for step in range(len(path)):
+    term_type = term[pos] if pos < size else None
+    if term_type == _SMALL_TUPLE and pos + 2 <= size:
+      length = term[pos + 1]
+      pos += 2
+    elif (term_type == _LARGE_TUPLE or term_type == _LIST) and pos + 5 <= size:
+      length, = _int4_unpack_from(term, pos + 1)
+      pos += 5
     else:
-      length = _int4_unpack(length)[0] + 5
-    body = term[5:length]
-    if length > 4294967295:
-      raise ValueError("Invalid BINARY_EXT length: {0}".format(length))
-    elif length > len(body) + 5:
-      raise ValueError("Incomplete BINARY_EXT length: expected {0}, got {1}".format(length, len(body)))
+      # Not a container: index the decoded value, just like decode() would.
+      value = decode_term(term, pos, None, atoms, atom_refs, binary)[0]
+      for index in path[step:]:
+        value = value[index]
+      return value
+    index = path[step]
+    if index < 0:
+      index += length
+    if not 0 <= index < length:
+      raise IndexError("{0} index out of range".format("list" if term_type == _LIST else "tuple"))
+    while index:
+      pos = _term_end(term, pos, options)
+      index -= 1
+  return decode_term(term, pos, None, atoms, atom_refs, binary)[0]
+
+
+def _numpy():
+  # NumPy is optional and slow to import, so only columnar calls load it.
+  try:
+    import numpy
+  except ImportError:
+    raise ImportError("Columnar encoding and decoding need NumPy")
+  return numpy
+
+
+# Columns of these NumPy kinds are decoded natively, any other dtype via
+# an object array.
+_column_kinds = {"i": "i", "u": "u", "f": "f", "b": "b"}
+_column_buffers = {"i": "i8", "u": "u8", "f": "f8", "b": "?", "O": "O"}
+_column_names = {"i": "integers", "u": "non-negative integers", "f": "numbers", "b": "booleans"}
+
+
+def _columns_start(term, pos):
+  # Returns the row count of the list at ``pos`` and where its rows start.
+  size = len(term)
+  term_type = term[pos] if pos < size else None
+  if term_type == _NIL:
+    return 0, pos + 1
+  elif term_type == _LIST and pos + 5 <= size:
+    count, = _int4_unpack_from(term, pos + 1)
+    # Every row takes at least two bytes; check before sizing the columns.
+    if count > (size - pos - 5) // 2:
+      raise ValueError("Invalid LIST_EXT length: {0} rows in {1} bytes".format(count, size - pos - 5))
+    return count, pos + 5
+  raise ValueError("Expected a list of tuples at offset {0}".format(pos))
+
+
+def _row_start(term, pos, arity):
+  size = len(term)
+  term_type = term[pos] if pos < size else None
+  if term_type == _SMALL_TUPLE and pos + 2 <= size:
+    length = term[pos + 1]
+    pos += 2
+  elif term_type == _LARGE_TUPLE and pos + 5 <= size:
+    length, = _int4_unpack_from(term, pos + 1)
+    pos += 5
+  else:
+    raise ValueError("Expected a tuple at offset {0}".format(pos))
+  if length != arity:
+    raise ValueError("Expected a tuple of {0} elements, got {1}".format(arity, length))
+  return pos
+
+
+def _columns_end(term, pos, count):
+  if count:
+    if pos >= len(term) or term[pos] != _NIL:
+      raise ValueError("Expected the end of the list at offset {0}".format(pos))
+    pos += 1
+  return pos
+
+
+def _column_value(value, kind, index):
+  value_type = type(value)
+  if kind == "O":
+    return value
+  elif kind == "i" and value_type in (int, long):
+    if -9223372036854775808 <= value <= 9223372036854775807:
+      return value
+  elif kind == "u" and value_type in (int, long):
+    if 0 <= value <= 18446744073709551615:
+      return value
+  elif kind == "f" and value_type in (float, int, long):
+    return value
+  elif kind == "b" and value_type is bool:
+    return value
+  raise ValueError("Column {0} expects {1}, got {2!r}".format(index, _column_names.get(kind, "int64"), value))
+
+
+def _column_result(numpy, column, dtype):
+  if column.dtype == dtype:
+    return column
+  elif dtype.kind in "iu" and len(column):
+    limits = numpy.iinfo(dtype)
+    if column.min() < limits.min or column.max() > limits.max:
+      raise ValueError("Column values out of {0} range".format(dtype))
+  return column.astype(dtype)
+
+
+def decode_columns(term, schema, atoms=None, atom_cache=None, binary=None, max_size=None):
+  """
+  Decodes a list of same-shape tuples, such as ``[(Ts, Value, Count), ...]``,
+  into one NumPy array per tuple element and returns them as a tuple.
+
+  ``schema`` holds a dtype for every column. Integer, float and boolean
+  columns are filled straight from the encoded numbers (or the atoms true
+  and false) without building a tuple for each row; other dtypes are
+  decoded as terms and converted at the end.
+  """
+  numpy = _numpy()
+  dtypes = [numpy.dtype(dtype) for dtype in schema]
+  kinds = [_column_kinds.get(dtype.kind, "O") for dtype in dtypes]
+  term, pos, atom_refs = _term_body(term, atoms, atom_cache, max_size)
+  count, pos = _columns_start(term, pos)
+  values = [[] for _ in kinds]
+  fields = list(zip(range(len(kinds)), kinds, values))
+  size = len(term)
+  for _ in xrange(count):
+    pos = _row_start(term, pos, len(kinds))
+    for index, kind, column in fields:
+      term_type = term[pos] if pos < size else None
+      if term_type == _SMALL_INT and kind in "ifu" and pos + 2 <= size:
+        column.append(term[pos + 1])
+        pos += 2
+      elif term_type == _INT and kind in "if" and pos + 5 <= size:
+        column.append(_signed_int4_unpack_from(term, pos + 1)[0])
+        pos += 5
+      elif term_type == _NEW_FLOAT and kind == "f" and pos + 9 <= size:
+        column.append(_float_unpack_from(term, pos + 1)[0])
+        pos += 9
+      else:
+        value, pos = decode_term(term, pos, None, atoms, atom_refs, binary)
+        column.append(_column_value(value, kind, index))
+  _columns_end(term, pos, count)
+  return tuple(_column_result(numpy, numpy.array(column, _column_buffers[kind]), dtype)
+               for column, kind, dtype in zip(values, kinds, dtypes))
+
+
+def _column_pieces(numpy, column, new_float):
+  # Encodes every element of ``column`` at once. Returns the encoded width
+  # of each element and (rows, matrix) pieces: the rows listed (None for
+  # all of them) take the encoded elements from the matching matrix rows.
+  count = len(column)
+  kind = column.dtype.kind
+  uint8 = numpy.uint8
+  if kind == "f":
+    column = column.astype(numpy.float64)
+    if new_float:
+      matrix = numpy.empty((count, 9), uint8)
+      matrix[:, 0] = _NEW_FLOAT
+      matrix[:, 1:] = column.astype(">f8").view(uint8).reshape(count, 8)
     else:
-      return body.decode(DEFAULT_ENCODING), term[length:]
-  elif term_type == ERL_SMALL_TUPLE:
-    length = term[1:2]
-    if not length:
-      raise ValueError("Incomplete SMALL_TUPLE_EXT length header")
+      # NUL padded to 31 bytes, just like FLOAT_EXT.
+      text = numpy.char.mod("%.20e", column).astype("S31")
+      matrix = numpy.empty((count, 32), uint8)
+      matrix[:, 0] = _FLOAT
+      matrix[:, 1:] = text.view(uint8).reshape(count, 31)
+    return numpy.full(count, matrix.shape[1]), [(None, matrix)]
+  elif kind in "iu":
+    widths = numpy.empty(count, numpy.int64)
+    pieces = []
+    small = (column >= 0) & (column <= 255)
+    medium = ~small & (column >= -2147483648) & (column <= 2147483647)
+    rows = numpy.flatnonzero(small)
+    if len(rows):
+      matrix = numpy.empty((len(rows), 2), uint8)
+      matrix[:, 0] = _SMALL_INT
+      matrix[:, 1] = column[rows]
+      widths[rows] = 2
+      pieces.append((rows, matrix))
+    rows = numpy.flatnonzero(medium)
+    if len(rows):
+      matrix = numpy.empty((len(rows), 5), uint8)
+      matrix[:, 0] = _INT
+      matrix[:, 1:] = column[rows].astype(">i4").view(uint8).reshape(len(rows), 4)
+      widths[rows] = 5
+      pieces.append((rows, matrix))
+    rows = numpy.flatnonzero(~(small | medium))
+    if len(rows):
+      values = column[rows]
+      if kind == "u":
+        sign = numpy.zeros(len(rows), bool)
+        magnitude = values.astype(numpy.uint64)
+      else:
+        values = values.astype(numpy.int64)
+        sign = values < 0
+        # Two's complement, so that the most negative int64 works too.
+        magnitude = numpy.where(sign, ~values.astype(numpy.uint64) + numpy.uint64(1), values.astype(numpy.uint64))
+      digits = magnitude.astype("<u8").view(uint8).reshape(len(rows), 8)
+      lengths = 8 - numpy.argmax(digits[:, ::-1] != 0, axis=1)
+      for length in numpy.unique(lengths):
+        subset = numpy.flatnonzero(lengths == length)
+        matrix = numpy.empty((len(subset), 3 + length), uint8)
+        matrix[:, 0] = _SMALL_BIGNUM
+        matrix[:, 1] = length
+        matrix[:, 2] = sign[subset]
+        matrix[:, 3:] = digits[subset, :length]
+        widths[rows[subset]] = 3 + length
+        pieces.append((rows[subset], matrix))
+    return widths, pieces
+  # Anything else is encoded element by element, then grouped by width.
+  encoded = [encode(value, new_float=new_float)[1:] for value in column.tolist()]
+  widths = numpy.array([len(value) for value in encoded], numpy.int64)
+  pieces = []
+  for width in numpy.unique(widths):
+    rows = numpy.flatnonzero(widths == width)
+    body = b"".join(encoded[row] for row in rows)
+    pieces.append((rows, numpy.frombuffer(body, uint8).reshape(len(rows), width)))
+  return widths, pieces
+
+
+def encode_columns(columns, new_float=None):
+  """
+  Encodes equally long 1-D arrays as the list of tuples that
+  ``decode_columns()`` reads, ``[(a[0], b[0]), (a[1], b[1]), ...]``, and
+  returns the same bytes ``encode()`` would. Integer and float columns are
+  packed with whole-array NumPy operations; other dtypes, booleans
+  included, are encoded element by element.
+  """
+  numpy = _numpy()
+  if new_float is None:
+    new_float = DEFAULT_NEW_FLOAT
+  columns = [numpy.asarray(column) for column in columns]
+  if not columns:
+    raise ValueError("No columns to encode")
+  count = len(columns[0])
+  if any(column.ndim != 1 or len(column) != count for column in columns):
+    raise ValueError("Columns must be 1-D arrays of equal length")
+  elif not count:
+    return ERL_MAGIC + ERL_NIL
+  elif count > 4294967295: # pragma: no cover
+    raise ValueError("Invalid LIST_EXT length: {0}".format(count))
+  arity = len(columns)
+  if arity <= 255:
+    header = ERL_SMALL_TUPLE + _char_pack(arity)
+  else:
+    header = ERL_LARGE_TUPLE + _int4_pack(arity)
+  fields = [_column_pieces(numpy, column, new_float) for column in columns]
+  output = _pack_rows(numpy, count, header, fields, ERL_MAGIC + ERL_LIST + _int4_pack(count), ERL_NIL)
+  return output.tobytes()
+
+
+def _pack_rows(numpy, count, header, fields, prefix, suffix):
+  # Lays out ``count`` rows, each ``header`` followed by one element from
+  # every _column_pieces() field, between ``prefix`` and ``suffix``, and
+  # returns them as a uint8 array.
+  widths = numpy.full(count, len(header), numpy.int64)
+  for column_widths, _ in fields:
+    widths += column_widths
+  offsets = numpy.cumsum(widths) - widths + len(prefix)
+  output = numpy.empty(int(widths.sum()) + len(prefix) + len(suffix), numpy.uint8)
+  output[:len(prefix)] = numpy.frombuffer(prefix, numpy.uint8)
+  output[len(output) - len(suffix):] = numpy.frombuffer(suffix, numpy.uint8)
+  for index, value in enumerate(bytearray(header)):
+    output[offsets + index] = value
+  offsets += len(header)
+  for column_widths, pieces in fields:
+    for rows, matrix in pieces:
+      starts = offsets if rows is None else offsets[rows]
+      for index in range(matrix.shape[1]):
+        output[starts + index] = matrix[:, index]
+    offsets += column_widths
+  return output
+
+
+_tag_names = {
+  _SMALL_INT: "ERL_SMALL_INT", _INT: "ERL_INT", _FLOAT: "ERL_FLOAT",
+  _NEW_FLOAT: "ERL_NEW_FLOAT", _ATOM: "ERL_ATOM", _ATOM_CACHE_REF: "ERL_ATOM_CACHE_REF",
+  _SMALL_TUPLE: "ERL_SMALL_TUPLE", _LARGE_TUPLE: "ERL_LARGE_TUPLE", _NIL: "ERL_NIL",
+  _STRING: "ERL_STRING", _LIST: "ERL_LIST", _BINARY: "ERL_BINARY",
+  _SMALL_BIGNUM: "ERL_SMALL_BIGNUM", _LARGE_BIGNUM: "ERL_LARGE_BIGNUM", _MAP: "ERL_MAP",
+  _SMALL_ATOM: "ERL_SMALL_ATOM", _ATOM_UTF8: "ERL_ATOM_UTF8", _SMALL_ATOM_UTF8: "ERL_SMALL_ATOM_UTF8",
+}
+
+
+def _tag_stats(term, pos, tags):
+  # Walks the well-formed term at ``pos`` like _skip_term(), adding every
+  # subterm's tag and encoded size (only the header for tuples and lists)
+  # to ``tags``. Returns the deepest nesting level.
+  pending = [1]
+  depth = 0
+  while pending:
+    if not pending[-1]:
+      pending.pop()
+      continue
+    pending[-1] -= 1
+    term_type = term[pos]
+    children = None
+    if term_type == _SMALL_INT or term_type == _ATOM_CACHE_REF:
+      length = 2
+    elif term_type == _INT:
+      length = 5
+    elif term_type == _NEW_FLOAT:
+      length = 9
+    elif term_type == _FLOAT:
+      length = 32
+    elif term_type == _NIL:
+      length = 1
+    elif term_type == _ATOM or term_type == _STRING or term_type == _ATOM_UTF8:
+      length = 3 + _int2_unpack_from(term, pos + 1)[0]
+    elif term_type == _SMALL_ATOM_UTF8 or term_type == _SMALL_ATOM:
+      length = 2 + term[pos + 1]
+    elif term_type == _BINARY:
+      length = 5 + _int4_unpack_from(term, pos + 1)[0]
+    elif term_type == _SMALL_BIGNUM:
+      length = 3 + term[pos + 1]
+    elif term_type == _LARGE_BIGNUM:
+      length = 6 + _int4_unpack_from(term, pos + 1)[0]
+    elif term_type == _SMALL_TUPLE:
+      length, children = 2, term[pos + 1]
+    elif term_type == _LARGE_TUPLE:
+      length, children = 5, _int4_unpack_from(term, pos + 1)[0]
+    elif term_type == _LIST:
+      # Elements plus the tail, which is NIL_EXT for proper lists.
+      length, children = 5, _int4_unpack_from(term, pos + 1)[0] + 1
+    elif term_type == _MAP:
+      length, children = 5, 2 * _int4_unpack_from(term, pos + 1)[0]
     else:
-      length, = _char_unpack(length)
-    objects, tail = decode_iterable(length, term[2:])
-    return tuple(objects), tail
-  elif term_type == ERL_LARGE_TUPLE:
-    length = term[1:5]
-    if len(length) != 4:
-      raise ValueError("Incomplete LARGE_TUPLE_EXT length header")
+      raise ValueError("Invalid term type: {0}".format(bytes(term[pos:pos + 1])))
+    counters = tags.get(term_type)
+    if counters is None:
+      counters = tags[term_type] = [0, 0]
+    counters[0] += 1
+    counters[1] += length
+    pos += length
+    if children is not None:
+      depth = max(depth, len(pending))
+      pending.append(children)
+  return depth
+
+
+def _histogram(histogram, value):
+  # Power of two buckets, keyed by their exclusive upper bound.
+  bucket = 1 << int(value).bit_length()
+  histogram[bucket] = histogram.get(bucket, 0) + 1
+
+
+class Stats(object):
+  """
+  Counters that ``encode()`` and ``decode()`` update while collection is
+  switched on with ``enable_stats()``: calls and wall time, terms and
+  bytes per external tag, sizes of compressed terms before and after
+  compression, and histograms of message size and nesting depth.
+
+  Calls run through a separate instrumented path that walks each message
+  once more, so none of this costs anything while collection is off.
+  """
+
+  def __init__(self):
+    self._lock = Lock()
+    self.reset()
+
+  def reset(self):
+    """Zeroes all counters."""
+    with self._lock:
+      self._counters = {"encode": self._empty(), "decode": self._empty()}
+
+  def snapshot(self):
+    """
+    Returns the counters as plain dicts keyed by ``"encode"`` and
+    ``"decode"``, detached from further updates.
+    """
+    with self._lock:
+      counters = self._counters
+      return dict((operation, {
+        "calls": values["calls"],
+        "seconds": values["seconds"],
+        "bytes": values["bytes"],
+        "tags": dict((_tag_names[tag], {"count": count, "bytes": size})
+                     for tag, (count, size) in values["tags"].items()),
+        "compressed": dict(values["compressed"]),
+        "sizes": dict(values["sizes"]),
+        "depths": dict(values["depths"]),
+      }) for operation, values in counters.items())
+
+  def _empty(self):
+    return {"calls": 0, "seconds": 0.0, "bytes": 0, "tags": {}, "sizes": {}, "depths": {},
+            "compressed": {"count": 0, "bytes": 0, "uncompressed": 0}}
+
+  def _encode(self, term, compressed, max_depth, atom_cache, new_float, cache):
+    start = _timer()
+    binary = _encode(term, compressed, max_depth, atom_cache, new_float, cache)
+    elapsed = _timer() - start
+    if binary[1:2] == ERL_COMPRESSED:
+      self._record("encode", elapsed, binary, _inflate_term(binary, 4294967295), 0)
+    elif binary[1:2] == ERL_DIST_HEADER:
+      self._record("encode", elapsed, binary, None, None)
     else:
-      length, = _int4_unpack(length)
-    objects, tail = decode_iterable(length, term[5:])
-    return tuple(objects), tail
-  elif term_type == ERL_LIST:
-    length = term[1:5]
-    if len(length) != 4:
-      raise ValueError("Incomplete ERL_LIST length header")
+      self._record("encode", elapsed, binary, _buffer(binary), 1)
+    return binary
+
+  def _decode(self, term, max_depth, atoms, atom_cache, binary, max_size, string):
+    start = _timer()
+    body, pos, atom_refs = _term_body(term, atoms, atom_cache, max_size)
+    value = decode_term(body, pos, max_depth, atoms, atom_refs, binary, string)[0]
+    elapsed = _timer() - start
+    self._record("decode", elapsed, term, body, pos)
+    return value
+
+  def _record(self, operation, elapsed, binary, body, pos):
+    # Messages with a distribution header are counted, but the atom cache
+    # refs in them can't be walked without the cache, so have no tags.
+    tags = {}
+    depth = None if body is None else _tag_stats(body, pos, tags)
+    with self._lock:
+      counters = self._counters[operation]
+      counters["calls"] += 1
+      counters["seconds"] += elapsed
+      counters["bytes"] += len(binary)
+      _histogram(counters["sizes"], len(binary))
+      if depth is not None:
+        _histogram(counters["depths"], depth)
+      for tag, (count, size) in tags.items():
+        total = counters["tags"].setdefault(tag, [0, 0])
+        total[0] += count
+        total[1] += size
+      if pos == 0:
+        compressed = counters["compressed"]
+        compressed["count"] += 1
+        compressed["bytes"] += len(binary)
+        compressed["uncompressed"] += len(body) + 1
+
+
+_stats = None
+
+
+def enable_stats(stats=None):
+  """
+  Makes ``encode()`` and ``decode()`` update ``stats``, a new ``Stats``
+  unless given, and returns it.
+  """
+  global _stats
+  _stats = Stats() if stats is None else stats
+  return _stats
+
+
+def disable_stats():
+  """Switches the collection started by ``enable_stats()`` off again."""
+  global _stats
+  _stats = None
+
+
+_incomplete = object()
+
+
+class StreamDecoder(object):
+  """Incrementally decodes terms from a byte stream.
+
+  ``packet`` is the size of the big-endian length prefix in front of every
+  term, as set up by an Erlang port opened with ``{packet, N}`` (1, 2 or 4).
+  Pass ``packet=0`` for a stream of back-to-back external terms without any
+  framing, e.g. ``term_to_binary`` blobs written one after another.
+
+  ``binary`` is passed on to ``decode()``; in ``"memoryview"`` mode each
+  term is copied out of the stream buffer first so its views stay valid.
+  ``max_size`` bounds the uncompressed size of compressed terms.
+  """
+
+  def __init__(self, packet=4, binary=None, max_size=None):
+    if packet and packet not in _packet_headers:
+      raise ValueError("Invalid packet size: {0}".format(packet))
+    self.packet = packet
+    self.binary = binary
+    self.max_size = max_size
+    self._buffer = bytearray()
+    self._pos = 0
+    self._fed = 0
+    # Where the walk over a term that is still arriving got to, and how
+    # many of its subterms are left from there.
+    self._walked = 0
+    self._pending = 0
+    self._inflate = None
+
+  def feed(self, chunk):
+    """Buffers ``chunk`` and returns an iterator over the terms it completes."""
+    if self._pos:
+      # Dropping a bytearray prefix only moves its start pointer.
+      del self._buffer[:self._pos]
+      self._fed -= self._pos
+      self._walked -= self._pos
+      self._pos = 0
+    self._buffer += chunk
+    return self._terms()
+
+  def _terms(self):
+    next_term = self._next_frame if self.packet else self._next_term
+    while True:
+      term = next_term()
+      if term is _incomplete:
+        return
+      yield term
+
+  def _next_frame(self):
+    buf, pos, packet = self._buffer, self._pos, self.packet
+    if len(buf) - pos < packet:
+      return _incomplete
+    end = pos + packet + _packet_headers[packet].unpack_from(buf, pos)[0]
+    if end > len(buf):
+      return _incomplete
+    self._pos = end
+    if _binary_mode(self.binary) == 2:
+      return decode(bytes(buf[pos + packet:end]), binary=self.binary, max_size=self.max_size)
+    frame = memoryview(buf)[pos + packet:end]
+    try:
+      return decode(frame, binary=self.binary, max_size=self.max_size)
+    finally:
+      _release(frame)
+
+  def _next_term(self):
+    buf, pos = self._buffer, self._pos
+    if self._inflate is None:
+      if len(buf) - pos < 2:
+        return _incomplete
+      elif buf[pos] != _MAGIC:
+        raise ValueError("Invalid external term format version")
+      elif buf[pos + 1] != _COMPRESSED:
+        if not self._pending:
+          self._walked, self._pending = pos + 1, 1
+        self._walked, self._pending = _skip_partial(buf, self._walked, self._pending)
+        if self._pending:
+          return _incomplete
+        end = self._pos = self._walked
+        if _binary_mode(self.binary) == 2:
+          return decode_term(bytes(buf[pos + 1:end]), 0, None, None, None, self.binary)[0]
+        return decode_term(buf, pos + 1, None, None, None, self.binary)[0]
+      elif len(buf) - pos < 6:
+        return _incomplete
+      self._size, = _int4_unpack_from(buf, pos + 2)
+      _check_size(self._size, DEFAULT_MAX_SIZE if self.max_size is None else self.max_size)
+      self._inflate, self._inflated, self._fed = decompressobj(), bytearray(), pos + 6
+    chunk = _view(buf, self._fed)
+    try:
+      # Never inflate more than one byte past the declared size.
+      self._inflated += self._inflate.decompress(chunk, self._size - len(self._inflated) + 1)
+    finally:
+      _release(chunk)
+    self._fed = len(buf)
+    if len(self._inflated) > self._size:
+      raise ValueError("Invalid compressed packet: more than {0} bytes".format(self._size))
+    elif not _inflate_eof(self._inflate):
+      return _incomplete
+    elif len(self._inflated) < self._size:
+      raise ValueError("Incomplete compressed packet: expected {0} bytes, but got only {1}".format(self._size, len(self._inflated)))
+    self._pos = len(buf) - len(self._inflate.unused_data)
+    body, self._inflate, self._inflated = self._inflated, None, None
+    return decode_term(body, 0, None, None, None, self.binary)[0]
+
+
+class TermProtocol(object):
+  """asyncio protocol exchanging ``{packet, N}`` framed terms with Erlang.
+
+  Use it with ``loop.create_connection``/``create_server`` for sockets, or
+  hand the same instance to ``connect_read_pipe`` and ``connect_write_pipe``
+  to serve an Erlang port over stdin/stdout.
+
+  Incoming terms are passed to ``handler`` if one is given, otherwise they
+  are queued for ``read()`` and ``async for``. Reading from the transport is
+  paused while more than ``limit`` terms are queued. ``write()`` encodes and
+  frames a reply and sends everything written during one loop iteration as
+  a single batch; await ``drain()`` to respect the transport's write buffer
+  limits.
+  """
+
+  def __init__(self, packet=4, handler=None, limit=1024, compressed=False):
+    self.packet = packet
+    self.handler = handler
+    self.limit = limit
+    self.compressed = compressed
+    self._decoder = StreamDecoder(packet)
+    self._header = _packet_headers[packet]
+    self._terms = deque()
+    self._loop = None
+    self._reader = None
+    self._writer = None
+    self._read_paused = False
+    self._write_paused = False
+    self._waiters = deque()
+    self._drain_waiters = []
+    self._outgoing = []
+    self._eof = False
+    self._exception = None
+
+  def connection_made(self, transport):
+    self._loop = asyncio.get_event_loop()
+    if hasattr(transport, "pause_reading"):
+      self._reader = transport
+    if hasattr(transport, "write"):
+      self._writer = transport
+
+  def data_received(self, data):
+    try:
+      for term in self._decoder.feed(data):
+        if self.handler is not None:
+          self.handler(term)
+        else:
+          self._terms.append(term)
+    except ValueError as e:
+      self._exception = e
+      self._wakeup()
+      if self._reader is not None:
+        self._reader.close()
+      return
+    self._wakeup()
+    if len(self._terms) > self.limit and not self._read_paused:
+      self._read_paused = True
+      self._reader.pause_reading()
+
+  def eof_received(self):
+    self._eof = True
+    self._wakeup()
+
+  def connection_lost(self, exc):
+    self._eof = True
+    if exc is not None and self._exception is None:
+      self._exception = exc
+    self._wakeup()
+    self._write_paused = False
+    self._release_drain_waiters(exc or ConnectionError("Connection lost"))
+
+  def pause_writing(self):
+    self._write_paused = True
+
+  def resume_writing(self):
+    self._write_paused = False
+    self._release_drain_waiters()
+
+  def read(self):
+    """Returns a future resolving to the next term, or raising EOFError."""
+    return self._read(EOFError)
+
+  def __aiter__(self):
+    return self
+
+  def __anext__(self):
+    return self._read(StopAsyncIteration)
+
+  def write(self, term):
+    body = encode(term, self.compressed)
+    if not self._outgoing:
+      self._loop.call_soon(self._flush)
+    self._outgoing.append(self._header.pack(len(body)))
+    self._outgoing.append(body)
+
+  def drain(self):
+    """Returns a future that resolves once the transport accepts more data."""
+    waiter = self._loop.create_future()
+    if self._write_paused:
+      self._drain_waiters.append(waiter)
+    elif self._writer is None or self._writer.is_closing():
+      waiter.set_exception(ConnectionError("Connection lost"))
     else:
-      length, = _int4_unpack(length)
-    return decode_iterable(length, term[5:])
-  elif term_type == ERL_ATOM:
-    atom_length = _int2_unpack(term[1:3])[0] + 3
-    atom_name = term[3:atom_length]
-    if atom_length > len(atom_name) + 3:
-      raise ValueError("Invalid ATOM_EXT length: expected {0}, got {1}".format(atom_length, len(atom_name)))
+      waiter.set_result(None)
+    return waiter
+
+  def close(self):
+    self._flush()
+    for transport in (self._reader, self._writer):
+      if transport is not None:
+        transport.close()
+
+  def _read(self, eof_error):
+    # Readers are served in the order they asked, so any number of reads
+    # can be pending at once.
+    waiter = self._loop.create_future()
+    self._waiters.append((waiter, eof_error))
+    self._wakeup()
+    return waiter
+
+  def _resolve(self, waiter, eof_error):
+    if self._terms:
+      waiter.set_result(self._terms.popleft())
+      if self._read_paused and len(self._terms) <= self.limit // 2:
+        self._read_paused = False
+        self._reader.resume_reading()
+    elif self._exception is not None:
+      waiter.set_exception(self._exception)
     else:
-      atom_name = atom_name.decode(DEFAULT_ENCODING)
-      return ":" + atom_name, term[atom_length:]
-  elif term_type == ERL_NIL:
-    return [], term[1:]
-  else:
-    raise ValueError("Invalid term type: {0}".format(term_type))
+      waiter.set_exception(eof_error())
 
+  def _wakeup(self):
+    waiters = self._waiters
+    while waiters and (self._terms or self._eof or self._exception is not None):
+      waiter, eof_error = waiters.popleft()
+      if not waiter.done():
+        self._resolve(waiter, eof_error)
 
-def decode_iterable(length, source):
-  objects = [0] * length
-  for i in xrange(length):
-    term, source = decode_term(source)
-    objects[i] = term
-  if source[:1] == ERL_NIL:
-    source = source[1:]
-  return objects, source
+  def _flush(self):
+    if self._outgoing and self._writer is not None and not self._writer.is_closing():
+      self._writer.write(b"".join(self._outgoing))
+    del self._outgoing[:]
 
+  def _release_drain_waiters(self, exc=None):
+    waiters, self._drain_waiters = self._drain_waiters, []
+    for waiter in waiters:
+      if not waiter.done():
+        if exc is None:
+          waiter.set_result(None)
+        else:
+          waiter.set_exception(exc)
 
-def decode(term):
-  if term[:1] != ERL_MAGIC:
-    raise ValueError("Invalid external term format version")
-  elif term[1:2] == ERL_COMPRESSED:
-    if len(term) < 16:
-      raise ValueError("Incomplete compressed packet")
-    body = term[6:]
-    length, = _int4_unpack(term[2:6])
-    if len(body) != length:
-      raise ValueError("Incomplete compressed packet: expected {0} bytes, but got only {1}".format(length, len(body)))
-    else:
-      body = decompress(term[6:])
-    return decode_term(body)[0]
-  return decode_term(term[1:])[0]
+
+def _compressed_end(term, pos):
+  # Returns the offset just past the compressed term starting at ``pos``,
+  # or -1 when ``term`` ends first. The zlib stream is inflated piecewise
+  # and thrown away, since its length isn't stored anywhere.
+  size = len(term)
+  inflate = decompressobj()
+  pos += 6
+  while not _inflate_eof(inflate):
+    if pos >= size:
+      return -1
+    chunk = term[pos:pos + _DEFLATE_CHUNK]
+    inflate.decompress(_view(chunk), _DEFLATE_CHUNK)
+    while inflate.unconsumed_tail:
+      inflate.decompress(inflate.unconsumed_tail, _DEFLATE_CHUNK)
+    pos += len(chunk)
+  return pos - len(inflate.unused_data)
+
+
+def _index_path(path, index):
+  if index is True:
+    return path + _INDEX_SUFFIX
+  return index or None
+
+
+def _modified(stat):
+  # Modification time in nanoseconds; Python 2.7 only has a float.
+  modified = getattr(stat, "st_mtime_ns", None)
+  return int(stat.st_mtime * 1000000) * 1000 if modified is None else modified
+
+
+def _index_stamp(stat, last):
+  # What an index records about the file it was made for, with ``last``
+  # the first bytes of the last indexed term.
+  return stat.st_ino, _modified(stat), crc32(bytes(last)) & 0xffffffff
+
+
+def _read_index(path, offsets=True):
+  # Returns (indexed file size, term count, file stamp, term offsets) from
+  # an index file, or None when it is missing or damaged. Offsets are only
+  # read when asked for.
+  try:
+    with open(path, "rb") as index:
+      header = index.read(_index_header.size)
+      if len(header) != _index_header.size:
+        return None
+      magic, size, count, inode, modified, checksum = _index_header.unpack(header)
+      stamp = inode, modified, checksum
+      if magic != _INDEX_MAGIC:
+        return None
+      elif not offsets:
+        return size, count, stamp, None
+      offsets = array(_OFFSET_TYPECODE)
+      offsets.fromfile(index, count)
+  except (EnvironmentError, EOFError):
+    return None
+  if sys.byteorder == "big": # pragma: no cover
+    offsets.byteswap()
+  return size, count, stamp, offsets
+
+
+def _write_index(path, size, stamp, offsets, start=0):
+  # Writes ``offsets`` after the first ``start`` entries of the index. The
+  # header goes last, so an interrupted write leaves the old index intact.
+  count = start + len(offsets)
+  if sys.byteorder == "big": # pragma: no cover
+    offsets = array(_OFFSET_TYPECODE, offsets)
+    offsets.byteswap()
+  with open(path, "r+b" if start else "wb") as index:
+    index.seek(_index_header.size + start * offsets.itemsize)
+    offsets.tofile(index)
+    index.truncate()
+    index.flush()
+    index.seek(0)
+    index.write(_index_header.pack(_INDEX_MAGIC, size, count, *stamp))
+
+
+class TermFile(object):
+  """
+  Read access to a file of back-to-back external terms, each starting with
+  the version magic, such as ``term_to_binary`` blobs written one after
+  another or the output of ``TermFileWriter``.
+
+  The file is memory mapped and the offsets of its terms are found in a
+  single pass, then saved to a sidecar index (``<path>.idx``, or the path
+  given as ``index``; ``index=False`` disables it) that makes reopening
+  instant. Terms appended since the index was written are picked up by
+  scanning only the new part. A term that is still incomplete at the end
+  of the file is left out until a later reopen.
+
+  ``tf[i]`` and iteration decode terms straight from the mapping.
+  ``binary`` and ``max_size`` are passed on to ``decode()``; with
+  ``binary="memoryview"`` the file can't be closed while those views are
+  alive.
+
+  Python 2.7 is not supported for files that don't fit in memory: its
+  mmap can't be viewed without copying, so the whole file is read in.
+  """
+
+  def __init__(self, path, index=True, binary=None, max_size=None):
+    self.path = path
+    self.binary = binary
+    self.max_size = max_size
+    self._index_path = _index_path(path, index)
+    with open(path, "rb") as source:
+      stat = os.fstat(source.fileno())
+      size = stat.st_size
+      self._mmap = mmap(source.fileno(), 0, access=ACCESS_READ) if size else None
+    self._view = _mapped(self._mmap if size else b"")
+    self._offsets, self._end = array(_OFFSET_TYPECODE), 0
+    if self._index_path is not None:
+      indexed = _read_index(self._index_path)
+      if indexed is not None and self._valid_index(stat, *indexed):
+        self._end, _, _, self._offsets = indexed
+    indexed = len(self._offsets), self._end
+    self._scan()
+    if self._index_path is not None and (len(self._offsets), self._end) != indexed:
+      try:
+        stamp = _index_stamp(stat, self._last_term(self._end, self._offsets))
+        _write_index(self._index_path, self._end, stamp, self._offsets)
+      except EnvironmentError:
+        # The index only saves time on the next open, e.g. read-only
+        # archives just get scanned every time.
+        pass
+
+  def __len__(self):
+    return len(self._offsets)
+
+  def __iter__(self):
+    for index in range(len(self._offsets)):
+      yield self[index]
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [self[i] for i in range(*index.indices(len(self._offsets)))]
+    return decode(self.raw(index), binary=self.binary, max_size=self.max_size)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def raw(self, index):
+    """Memoryview (a copy on Python 2.7) of the encoded term at ``index``, version magic included."""
+    count = len(self._offsets)
+    if index < 0:
+      index += count
+    if not 0 <= index < count:
+      raise IndexError("TermFile index out of range")
+    end = self._offsets[index + 1] if index + 1 < count else self._end
+    return self._view[self._offsets[index]:end]
+
+  def close(self):
+    _release(self._view)
+    if self._mmap is not None:
+      self._mmap.close()
+
+  def _valid_index(self, stat, size, count, stamp, offsets):
+    # An index is trusted for the file it was made for, unchanged since or
+    # only appended to, as far as its inode, modification time and last
+    # indexed term tell.
+    if size > len(self._view) or stat.st_ino != stamp[0]:
+      return False
+    elif size == len(self._view) and _modified(stat) != stamp[1]:
+      return False
+    return _index_stamp(stat, self._last_term(size, offsets))[2] == stamp[2]
+
+  def _last_term(self, size, offsets):
+    # The first bytes of the last term in ``offsets``, which ends at ``size``.
+    if not offsets:
+      return b""
+    start = offsets[-1]
+    return self._view[start:min(start + _INDEX_STAMP_SIZE, size)]
+
+  def _scan(self):
+    view, offsets = self._view, self._offsets
+    size, pos = len(view), self._end
+    while pos < size:
+      if view[pos] != _MAGIC:
+        raise ValueError("Invalid external term format version at offset {0}".format(pos))
+      elif pos + 1 < size and view[pos + 1] == _COMPRESSED:
+        end = _compressed_end(view, pos)
+      else:
+        end = _skip_term(view, pos + 1)
+      if end < 0:
+        break
+      offsets.append(pos)
+      pos = end
+    self._end = pos
+
+
+class TermFileWriter(object):
+  """
+  Appends terms to a file read by ``TermFile``, with ``compressed`` and
+  ``new_float`` passed on to ``encode()``. When the file has an up to date
+  sidecar index, ``flush()`` and ``close()`` extend it with the new terms.
+  """
+
+  def __init__(self, path, index=True, compressed=False, new_float=None):
+    self.path = path
+    self.compressed = compressed
+    self.new_float = new_float
+    self._index_path = _index_path(path, index)
+    self._file = open(path, "ab")
+    self._file.seek(0, os.SEEK_END)
+    self._indexed = self._pos = self._file.tell()
+    self._offsets = array(_OFFSET_TYPECODE)
+    self._last = b""
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+
+  def write(self, term):
+    """Appends ``term`` and returns the offset it was written at."""
+    binary = encode(term, self.compressed, new_float=self.new_float)
+    self._file.write(binary)
+    self._offsets.append(self._pos)
+    self._pos += len(binary)
+    self._last = binary[:_INDEX_STAMP_SIZE]
+    return self._offsets[-1]
+
+  def flush(self):
+    self._file.flush()
+    if self._index_path is None or not self._offsets:
+      return
+    indexed = _read_index(self._index_path, False)
+    if indexed is not None and indexed[0] == self._indexed:
+      stat = os.fstat(self._file.fileno())
+      stamp = _index_stamp(stat, self._last)
+      _write_index(self._index_path, self._pos, stamp, self._offsets, indexed[1])
+    self._indexed = self._pos
+    self._offsets = array(_OFFSET_TYPECODE)
+
+  def close(self):
+    if not self._file.closed:
+      self.flush()
+      self._file.close()
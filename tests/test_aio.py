@@ -0,0 +1,65 @@
+# coding: utf-8
+import socket
+import termformat
+from unittest import TestCase, skipIf
+
+try:
+  import asyncio
+except ImportError: # pragma: no cover
+  asyncio = None
+
+
+@skipIf(asyncio is None, "asyncio is not available")
+class TermProtocolTest(TestCase):
+
+  def setUp(self):
+    self.loop = asyncio.new_event_loop()
+    left, right = socket.socketpair()
+    self.server = termformat.TermProtocol(handler=self.reply)
+    self.client = termformat.TermProtocol(packet=4)
+    self.loop.run_until_complete(self.loop.create_connection(lambda: self.server, sock=left))
+    self.loop.run_until_complete(self.loop.create_connection(lambda: self.client, sock=right))
+
+  def tearDown(self):
+    self.client.close()
+    self.server.close()
+    self.loop.run_until_complete(asyncio.sleep(0))
+    self.loop.close()
+
+  def reply(self, term):
+    self.server.write((":reply", term[0], (":ok", term[1])))
+
+  def test_concurrent_requests(self):
+    for i in range(5000):
+      self.client.write((i, "payload"))
+    self.loop.run_until_complete(self.client.drain())
+    replies = [self.loop.run_until_complete(self.client.read()) for _ in range(5000)]
+    self.assertEqual(replies, [(":reply", i, (":ok", "payload")) for i in range(5000)])
+
+  def test_concurrent_readers(self):
+    reads = [self.client.read() for _ in range(3)]
+    for i in range(3):
+      self.client.write((i, "payload"))
+    replies = self.loop.run_until_complete(asyncio.wait_for(asyncio.gather(*reads), 1))
+    self.assertEqual(replies, [(":reply", i, (":ok", "payload")) for i in range(3)])
+    self.assertFalse(self.client._terms)
+
+  def test_async_iteration(self):
+    self.client.write((1, [1, 2, 3]))
+    term = self.loop.run_until_complete(self.client.__aiter__().__anext__())
+    self.assertEqual(term, (":reply", 1, (":ok", [1, 2, 3])))
+
+  def test_read_after_close(self):
+    self.server.close()
+    with self.assertRaises(EOFError):
+      self.loop.run_until_complete(self.client.read())
+
+  def test_pause_reading_over_limit(self):
+    self.client.limit = 10
+    for i in range(100):
+      self.client.write((i, i))
+    self.loop.run_until_complete(asyncio.sleep(0.05))
+    self.assertTrue(self.client._read_paused)
+    replies = [self.loop.run_until_complete(self.client.read())[1] for _ in range(100)]
+    self.assertEqual(replies, list(range(100)))
+    self.assertFalse(self.client._read_paused)
@@ -0,0 +1,58 @@
+# coding: utf-8
+import termformat
+from unittest import TestCase
+
+
+class AtomCacheTest(TestCase):
+
+  def test_encode_with_atom_cache(self):
+    cache = termformat.AtomCache()
+    term = [(":record", ":ok", 1), (":record", ":error", 2)]
+    first = termformat.encode(term, atom_cache=cache)
+    second = termformat.encode(term, atom_cache=cache)
+    self.assertEqual(first[:3], b"\x83D\x03")
+    self.assertTrue(len(second) < len(first))
+    self.assertTrue(len(second) < len(termformat.encode(term)))
+
+  def test_decode_with_atom_cache(self):
+    sender, receiver = termformat.AtomCache(), termformat.AtomCache()
+    term = [(":record", ":ok", 1), (":record", ":error", 2), "binary"]
+    for _ in range(3):
+      bytes = termformat.encode(term, atom_cache=sender)
+      self.assertEqual(termformat.decode(bytes, atom_cache=receiver), term)
+
+  def test_decode_erlang_header(self):
+    cache = termformat.AtomCache()
+    self.assertEqual(termformat.decode(b"\x83D\x01\x08\x05\x02okR\x00", atom_cache=cache), ":ok")
+    self.assertEqual(termformat.decode(b"\x83D\x01\x00\x05h\x02R\x00R\x00", atom_cache=cache), (":ok", ":ok"))
+
+  def test_decode_long_atoms_header(self):
+    cache = termformat.AtomCache()
+    self.assertEqual(termformat.decode(b"\x83D\x01\x18\x05\x00\x02okR\x00", atom_cache=cache), ":ok")
+
+  def test_decode_empty_header(self):
+    cache = termformat.AtomCache()
+    self.assertEqual(termformat.decode(b"\x83D\x00a\x01", atom_cache=cache), 1)
+
+  def test_decode_unknown_cache_entry(self):
+    with self.assertRaises(ValueError):
+      termformat.decode(b"\x83D\x01\x00\x05R\x00", atom_cache=termformat.AtomCache())
+
+  def test_decode_header_without_atom_cache(self):
+    with self.assertRaises(ValueError):
+      termformat.decode(b"\x83D\x01\x08\x05\x02okR\x00")
+
+  def test_decode_invalid_cache_ref(self):
+    with self.assertRaises(ValueError):
+      termformat.decode(b"\x83D\x01\x08\x05\x02okR\x01", atom_cache=termformat.AtomCache())
+
+  def test_encode_more_than_255_atoms(self):
+    sender, receiver = termformat.AtomCache(), termformat.AtomCache()
+    term = [":atom{0}".format(i) for i in range(300)]
+    bytes = termformat.encode(term, atom_cache=sender)
+    self.assertEqual(bytes[:3], b"\x83D\xff")
+    self.assertEqual(termformat.decode(bytes, atom_cache=receiver), term)
+
+  def test_encode_compressed_with_atom_cache(self):
+    with self.assertRaises(ValueError):
+      termformat.encode(":ok", compressed=6, atom_cache=termformat.AtomCache())
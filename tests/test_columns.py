@@ -0,0 +1,95 @@
+# coding: utf-8
+import termformat
+from unittest import TestCase, skipIf
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+@skipIf(numpy is None, "NumPy is not available")
+class ColumnsTest(TestCase):
+
+  rows = [(1500000000 + i, i * 0.5, i % 300, i % 3 == 0, ":ok" if i % 2 else "text") for i in range(1000)]
+  schema = ("i8", "f8", "u2", "?", "O")
+
+  def assertColumns(self, columns, rows, schema=schema):
+    self.assertEqual(len(columns), len(schema))
+    for index, (column, dtype) in enumerate(zip(columns, schema)):
+      self.assertEqual(column.dtype, numpy.dtype(dtype))
+      self.assertEqual(column.tolist(), [row[index] for row in rows])
+
+  def test_decode_columns(self):
+    for new_float in (False, True):
+      binary = termformat.encode(self.rows, new_float=new_float)
+      self.assertColumns(termformat.decode_columns(binary, self.schema), self.rows)
+
+  def test_decode_columns_number_encodings(self):
+    # SMALL_INT, INT, SMALL_BIG, FLOAT_EXT and integers in a float column.
+    rows = [(0, 1), (-5, 2.5), (2 ** 40, 3), (-2 ** 63, -2 ** 31), (2 ** 63 - 1, 1e300)]
+    columns = termformat.decode_columns(termformat.encode(rows), ("i8", "f8"))
+    self.assertColumns(columns, rows, ("i8", "f8"))
+
+  def test_decode_columns_other_dtypes(self):
+    rows = [(1, "a"), (2, "bc")]
+    columns = termformat.decode_columns(termformat.encode(rows), ("i4", "U2"))
+    self.assertColumns(columns, rows, ("i4", "U2"))
+
+  def test_decode_columns_compressed(self):
+    binary = termformat.encode(self.rows, compressed=True)
+    self.assertColumns(termformat.decode_columns(binary, self.schema), self.rows)
+
+  def test_decode_columns_empty(self):
+    columns = termformat.decode_columns(termformat.encode([]), ("i8", "f8"))
+    self.assertEqual([len(column) for column in columns], [0, 0])
+
+  def test_decode_columns_errors(self):
+    for term, schema in (((1, 2), ("i8",)), ([(1, 2)], ("i8",)), ([(1,), 2], ("i8",)), ([(1.5,)], ("i8",)),
+                         ([(2 ** 64,)], ("i8",)), ([("text",)], ("f8",)), ([(1,)], ("?",)), ([(300,)], ("u1",))):
+      with self.assertRaises(ValueError):
+        termformat.decode_columns(termformat.encode(term), schema)
+    binary = termformat.encode([(1, 2.5)] * 3, new_float=True)
+    for end in range(1, len(binary)):
+      with self.assertRaises(ValueError):
+        termformat.decode_columns(binary[:end], ("i8", "f8"))
+
+  def test_decode_columns_truncated_header(self):
+    for binary in (b"\x83l\xff\xff\xff\xff", b"\x83l\x00\x00\x00\x03a\x01a\x02j"):
+      with self.assertRaises(ValueError) as error:
+        termformat.decode_columns(binary, ("i8", "f8", "u8"))
+      self.assertIn("Invalid LIST_EXT length", str(error.exception))
+
+  def test_encode_columns(self):
+    columns = [numpy.array([row[index] for row in self.rows], dtype) for index, dtype in enumerate(self.schema)]
+    for new_float in (False, True):
+      binary = termformat.encode_columns(columns, new_float=new_float)
+      self.assertEqual(binary, termformat.encode(self.rows, new_float=new_float))
+
+  def test_encode_columns_integer_ranges(self):
+    values = [0, 255, 256, -1, 2 ** 31 - 1, -2 ** 31, 2 ** 31, -2 ** 31 - 1, 2 ** 40, -2 ** 63, 2 ** 63 - 1]
+    self.assertEqual(termformat.encode_columns([numpy.array(values)]), termformat.encode([(value,) for value in values]))
+    values = [0, 2 ** 63, 2 ** 64 - 1]
+    self.assertEqual(termformat.encode_columns([numpy.array(values, numpy.uint64)]),
+                     termformat.encode([(value,) for value in values]))
+
+  def test_encode_columns_roundtrip(self):
+    columns = (numpy.arange(-500, 500, dtype=numpy.int32), numpy.linspace(-1, 1, 1000, dtype=numpy.float32))
+    decoded = termformat.decode_columns(termformat.encode_columns(columns, new_float=True), ("i4", "f4"))
+    for original, result in zip(columns, decoded):
+      self.assertTrue(numpy.array_equal(original, result))
+
+  def test_encode_columns_unsigned_roundtrip(self):
+    column = numpy.array([0, 255, 300, 2 ** 31, 2 ** 40, 2 ** 63 + 5, 2 ** 64 - 1], numpy.uint64)
+    decoded, = termformat.decode_columns(termformat.encode_columns([column]), ("u8",))
+    self.assertEqual(decoded.dtype, numpy.dtype("u8"))
+    self.assertTrue(numpy.array_equal(decoded, column))
+    for value in (-1, -300, -2 ** 40, 2 ** 64):
+      with self.assertRaises(ValueError):
+        termformat.decode_columns(termformat.encode([(value,)]), ("u8",))
+
+  def test_encode_columns_errors(self):
+    for columns in ([], [numpy.arange(3), numpy.arange(4)], [numpy.zeros((2, 2))], [numpy.array([1j])]):
+      with self.assertRaises(ValueError):
+        termformat.encode_columns(columns)
+    self.assertEqual(termformat.encode_columns([numpy.arange(0)]), termformat.encode([]))
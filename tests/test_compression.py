@@ -0,0 +1,91 @@
+# coding: utf-8
+import os
+import zlib
+import termformat
+from struct import pack
+from unittest import TestCase
+
+
+class CompressionTest(TestCase):
+
+  term = [(":row", i, "name-{0}".format(i)) for i in range(10000)]
+
+  def test_header_holds_uncompressed_size(self):
+    plain = termformat.encode([[1, 2, 3]] * 10)
+    binary = termformat.encode([[1, 2, 3]] * 10, compressed=6)
+    self.assertEqual(binary[:6], b"\x83P" + pack(">I", len(plain) - 1))
+    self.assertEqual(zlib.decompress(binary[6:]), plain[1:])
+
+  def test_encode_large_term_in_chunks(self):
+    plain = termformat.encode(self.term)
+    binary = termformat.encode(self.term, compressed=6)
+    self.assertTrue(len(plain) > 65536)
+    self.assertEqual(binary[:6], b"\x83P" + pack(">I", len(plain) - 1))
+    self.assertEqual(zlib.decompress(binary[6:]), plain[1:])
+    self.assertEqual(termformat.decode(binary), self.term)
+
+  def test_decode_erlang_compressed(self):
+    body = termformat.encode([0] * 100)[1:]
+    binary = b"\x83P" + pack(">I", len(body)) + zlib.compress(body)
+    self.assertEqual(termformat.decode(binary), [0] * 100)
+
+  def test_decode_compressed_length_header(self):
+    # Earlier versions put the compressed length into the header.
+    body = zlib.compress(termformat.encode([0] * 100)[1:], 6)
+    self.assertEqual(termformat.decode(b"\x83P" + pack(">I", len(body)) + body), [0] * 100)
+
+  def test_decode_wrong_size(self):
+    body = termformat.encode([0] * 100)[1:]
+    for size in (len(body) - 1, len(body) + 1):
+      with self.assertRaises(ValueError):
+        termformat.decode(b"\x83P" + pack(">I", size) + zlib.compress(body))
+
+  def test_decode_max_size(self):
+    binary = termformat.encode(self.term, compressed=6)
+    with self.assertRaises(ValueError):
+      termformat.decode(binary, max_size=65536)
+    self.assertEqual(termformat.decode(binary, max_size=len(binary) * 100), self.term)
+    termformat.DEFAULT_MAX_SIZE = 65536
+    try:
+      with self.assertRaises(ValueError):
+        termformat.decode(binary)
+    finally:
+      termformat.DEFAULT_MAX_SIZE = None
+
+  def test_other_decoders_max_size(self):
+    binary = termformat.encode(self.term, compressed=6)
+    for function in (lambda **options: termformat.decode_many([binary], **options)[0],
+                     lambda **options: termformat.decode_lazy(binary, **options).decode(),
+                     lambda **options: termformat.extract(binary, (), **options)):
+      with self.assertRaises(ValueError):
+        function(max_size=65536)
+      self.assertEqual(function(max_size=len(binary) * 100), self.term)
+
+  def test_stream_max_size(self):
+    decoder = termformat.StreamDecoder(packet=0, max_size=65536)
+    with self.assertRaises(ValueError):
+      list(decoder.feed(termformat.encode(self.term, compressed=6)[:100]))
+
+  def test_auto_compression(self):
+    self.assertEqual(termformat.encode(":ok", compressed="auto"), termformat.encode(":ok"))
+    binary = termformat.encode(self.term, compressed="auto")
+    self.assertEqual(binary[:2], b"\x83P")
+    self.assertEqual(termformat.decode(binary), self.term)
+    small = [[1, 2, 3]] * 100
+    self.assertEqual(termformat.encode(small, compressed="auto"), termformat.encode(small, compressed=6))
+
+  def test_auto_compression_skips_random_data(self):
+    for size in (1000, 200000):
+      data = os.urandom(size)
+      self.assertEqual(termformat.encode(data, compressed="auto"), termformat.encode(data))
+
+  def test_incompressible_term_stays_plain(self):
+    for size in (1000, 200000):
+      data = os.urandom(size)
+      self.assertEqual(termformat.encode(data, compressed=6), termformat.encode(data))
+      self.assertEqual(termformat.encode_many([data], compressed=6), [termformat.encode(data)])
+
+  def test_invalid_compression_level(self):
+    for level in (-1, 10, "fast"):
+      with self.assertRaises(ValueError):
+        termformat.encode([1], compressed=level)
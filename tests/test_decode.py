@@ -14,6 +14,34 @@ class TermFormatDecoderTest(TestCase):
       result = termformat.decode(b"\x83d\x00\x03fo")
       self.assertEqual(result, ":foo")
 
+  def test_decode_utf8_atoms(self):
+    self.assertEqual(termformat.decode(b"\x83w\x08\xd1\x82\xd0\xb5\xd1\x81\xd1\x82"), u":тест")
+    self.assertEqual(termformat.decode(b"\x83v\x00\x03foo"), ":foo")
+    self.assertEqual(termformat.decode(b"\x83s\x03foo"), ":foo")
+
+  def test_decode_latin1_atoms(self):
+    self.assertEqual(termformat.decode(b"\x83s\x01\xe9"), u":\xe9")
+    self.assertEqual(termformat.decode(b"\x83d\x00\x01\xe9"), u":\xe9")
+    self.assertEqual(termformat.decode(b"\x83h\x02d\x00\x02\xc3\xa9w\x02\xc3\xa9"), (u":\xc3\xa9", u":\xe9"))
+
+  def test_atom_table_keys_encoding(self):
+    atoms = termformat.AtomTable()
+    self.assertEqual(atoms.atom(b"\xc3\xa9", True), u":\xc3\xa9")
+    self.assertEqual(atoms.atom(b"\xc3\xa9"), u":\xe9")
+    self.assertEqual(atoms.atom(b"\xc3\xa9", True), u":\xc3\xa9")
+    self.assertEqual((len(atoms), atoms.hits, atoms.misses), (2, 1, 2))
+
+  def test_decode_incomplete_utf8_atoms(self):
+    for binary in (b"\x83w", b"\x83w\x03fo", b"\x83v\x00", b"\x83v\x00\x03fo"):
+      with self.assertRaises(ValueError):
+        termformat.decode(binary)
+
+  def test_decode_booleans(self):
+    self.assertIs(termformat.decode(b"\x83d\x00\x04true"), True)
+    self.assertIs(termformat.decode(b"\x83w\x05false"), False)
+    self.assertIs(termformat.decode(b"\x83d\x00\tundefined"), None)
+    self.assertEqual(termformat.decode(b"\x83d\x00\x03nil"), ":nil")
+
   def test_decode_small_int(self):
     result = termformat.decode(b"\x83a\x14")
     self.assertEqual(result, 20)
@@ -98,7 +126,7 @@ class TermFormatDecoderTest(TestCase):
                                b"atomd\x00\x04trued\x00\x05falsed\x00\tundefinedl\x00"
                                b"\x00\x00\x02a\x02l\x00\x00\x00\x01a\x02jjh\x03a\x01a"
                                b"\x02a\x03")
-    self.assertEqual(result, (1, 1337, 3.14, "binary", ":atom", ":true", ":false", ":undefined", [2, [2]], (1, 2, 3)))
+    self.assertEqual(result, (1, 1337, 3.14, "binary", ":atom", True, False, None, [2, [2]], (1, 2, 3)))
 
   def test_decode_large_tuple(self):
     bytes = termformat.encode((1, 2, 3) * 256)
@@ -137,3 +165,89 @@ class TermFormatDecoderTest(TestCase):
     bytes = termformat.encode([[1, 2, 3]] * 10, 6)
     with self.assertRaises(ValueError):
       self.assertEqual(termformat.decode(bytes[:-1]), [[1, 2, 3]] * 10) 
+
+  def test_decode_large_bignum(self):
+    result = termformat.decode(termformat.encode(4294967295 ** 1000))
+    self.assertEqual(result, 4294967295 ** 1000)
+
+  def test_decode_incomplete_bignum(self):
+    with self.assertRaises(ValueError):
+      termformat.decode(b"\x83n\x05\x00\x00\x00\x00")
+
+  def test_decode_string_inside_tuple(self):
+    result = termformat.decode(b"\x83h\x02k\x00\x03fooa\x01")
+    self.assertEqual(result, ("foo", 1))
+
+  def test_decode_tuple_followed_by_empty_list(self):
+    result = termformat.decode(b"\x83h\x02h\x01a\x01j")
+    self.assertEqual(result, ((1,), []))
+
+  def test_decode_long_list_of_tuples(self):
+    data = [(i, ":ok", "payload") for i in range(10000)]
+    self.assertEqual(termformat.decode(termformat.encode(data)), data)
+
+  def test_decode_deeply_nested_tuple(self):
+    term = ()
+    for _ in range(100000):
+      term = (term,)
+    result, depth = termformat.decode(termformat.encode(term)), 0
+    while result:
+      result, = result
+      depth += 1
+    self.assertEqual(depth, 100000)
+
+  def test_decode_max_depth(self):
+    bytes = termformat.encode([(1, [2])])
+    self.assertEqual(termformat.decode(bytes, max_depth=3), [(1, [2])])
+    with self.assertRaises(ValueError):
+      termformat.decode(bytes, max_depth=2)
+
+  def test_decode_interns_atoms(self):
+    atoms = termformat.AtomTable()
+    first, second = termformat.decode(b"\x83h\x02d\x00\x02okd\x00\x02ok", atoms=atoms)
+    self.assertEqual(first, ":ok")
+    self.assertIs(first, second)
+    self.assertEqual((atoms.hits, atoms.misses), (1, 1))
+
+  def test_atom_table_evicts_least_recently_used(self):
+    atoms = termformat.AtomTable(2)
+    for name in (b"a", b"b", b"a", b"c"):
+      atoms.atom(name)
+    self.assertEqual(len(atoms), 2)
+    self.assertEqual((atoms.hits, atoms.misses), (1, 3))
+    atoms.atom(b"a")
+    atoms.atom(b"b")
+    self.assertEqual((atoms.hits, atoms.misses), (2, 4))
+
+  def test_atom_table_disabled(self):
+    atoms = termformat.AtomTable(0)
+    self.assertEqual(termformat.decode(b"\x83d\x00\x03foo", atoms=atoms), ":foo")
+    self.assertEqual(len(atoms), 0)
+    atoms.clear()
+    self.assertEqual((atoms.hits, atoms.misses), (0, 0))
+
+  def test_decode_large_negative_bignum(self):
+    bytes = termformat.encode(-(2 ** 4096 + 1))
+    self.assertEqual(bytes[:7], b"\x83o\x00\x00\x02\x01\x01")
+    self.assertEqual(termformat.decode(bytes), -(2 ** 4096 + 1))
+
+  def test_decode_binary_as_bytes(self):
+    result = termformat.decode(b"\x83h\x02m\x00\x00\x00\x03foom\x00\x00\x00\x02\xff\xfe", binary="bytes")
+    self.assertEqual(result, (b"foo", b"\xff\xfe"))
+
+  def test_decode_binary_as_memoryview(self):
+    source = b"\x83l\x00\x00\x00\x01m\x00\x00\x00\x03fooj"
+    result, = termformat.decode(source, binary="memoryview")
+    self.assertIsInstance(result, memoryview)
+    if hasattr(result, "obj"):
+      # Python 2.7 decodes from a bytearray copy and has no memoryview.obj.
+      self.assertIs(result.obj, source)
+    self.assertEqual(result.tobytes(), b"foo")
+
+  def test_decode_non_utf8_binary(self):
+    with self.assertRaises(ValueError):
+      termformat.decode(b"\x83m\x00\x00\x00\x02\xff\xfe")
+
+  def test_decode_invalid_binary_mode(self):
+    with self.assertRaises(ValueError):
+      termformat.decode(b"\x83m\x00\x00\x00\x03foo", binary="text")
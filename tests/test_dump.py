@@ -0,0 +1,113 @@
+# coding: utf-8
+import os
+import socket
+import termformat
+from array import array
+from io import BytesIO
+from threading import Thread
+from unittest import TestCase, skipIf
+
+
+class RecordingFile(object):
+
+  def __init__(self):
+    self.writes = []
+
+  def write(self, data):
+    # The output buffer is reused once write() returns.
+    self.writes.append(data if type(data) is bytes else bytes(bytearray(data)))
+
+  def getvalue(self):
+    return b"".join(self.writes)
+
+
+class DumpTest(TestCase):
+
+  big = b"x" * 200000
+  terms = [1, "foo", (":ok", [1, 2.5, "three"]), [b"a" * 70000, b"b" * 100000],
+           [(i, "item-{0}".format(i)) for i in range(20000)], (":blob", big)]
+
+  def test_dump(self):
+    for term in self.terms:
+      output = BytesIO()
+      size = termformat.dump(term, output)
+      self.assertEqual(output.getvalue(), termformat.encode(term))
+      self.assertEqual(size, len(output.getvalue()))
+
+  def test_dump_compressed(self):
+    for term in self.terms:
+      for compressed in (True, 1, 9, "auto"):
+        output = BytesIO()
+        size = termformat.dump(term, output, compressed=compressed)
+        self.assertEqual(size, len(output.getvalue()))
+        self.assertEqual(termformat.decode(output.getvalue(), binary="bytes"),
+                         termformat.decode(termformat.encode(term), binary="bytes"))
+
+  def test_dump_compressed_header(self):
+    term = [(i, "item-{0}".format(i)) for i in range(20000)]
+    output = BytesIO()
+    termformat.dump(term, output, compressed=True)
+    self.assertEqual(output.getvalue()[:6],
+                     b"\x83P" + termformat._int4_pack(len(termformat.encode(term)) - 1))
+
+  def test_dump_auto_incompressible(self):
+    term = (":blob", os.urandom(300000))
+    output = BytesIO()
+    termformat.dump(term, output, compressed="auto")
+    self.assertEqual(output.getvalue()[:2], b"\x83h")
+
+  def test_dump_in_chunks(self):
+    term = [(i, "item-{0}".format(i)) for i in range(20000)]
+    output = RecordingFile()
+    termformat.dump(term, output)
+    self.assertGreater(len(output.writes), 1)
+    self.assertTrue(all(len(data) < 2 * termformat._DEFLATE_CHUNK for data in output.writes))
+    self.assertEqual(output.getvalue(), termformat.encode(term))
+
+  def test_dump_passes_binaries_through(self):
+    output = RecordingFile()
+    termformat.dump((":blob", self.big), output)
+    self.assertTrue(any(data is self.big for data in output.writes))
+    self.assertEqual(output.getvalue(), termformat.encode((":blob", self.big)))
+
+  def test_dump_memoryview(self):
+    data = bytes(bytearray(range(256))) * 1000
+    output = RecordingFile()
+    termformat.dump([memoryview(data), memoryview(b"small")], output)
+    self.assertEqual(output.getvalue(), termformat.encode([data, b"small"]))
+    self.assertEqual(termformat.encode(memoryview(b"abc")), termformat.encode(b"abc"))
+    self.assertEqual(termformat.encoded_size(memoryview(data)), len(termformat.encode(data)))
+
+  @skipIf(not hasattr(memoryview, "cast"), "array.array has no new-style buffer")
+  def test_dump_typed_memoryview(self):
+    data = array("I", range(50000))
+    output = RecordingFile()
+    termformat.dump([memoryview(data), memoryview(b"small")], output, compressed=True)
+    self.assertEqual(output.getvalue(), termformat.encode([data.tobytes(), b"small"], compressed=True))
+    self.assertEqual(termformat.encoded_size(memoryview(data)), len(termformat.encode(data.tobytes())))
+
+  def test_dump_errors(self):
+    for term, options in ((object(), {}), ([[1]], {"max_depth": 1}), (1, {"compressed": 10})):
+      with self.assertRaises(ValueError):
+        termformat.dump(term, BytesIO(), **options)
+
+  @skipIf(not hasattr(socket, "socketpair"), "socketpair() is not available")
+  def test_dump_to_socket(self):
+    term = [(":blob", self.big), [(i, "item-{0}".format(i)) for i in range(20000)]]
+    expected = termformat.encode(term)
+    left, right = socket.socketpair()
+    received = []
+
+    def receive():
+      while sum(len(data) for data in received) < len(expected):
+        received.append(right.recv(65536))
+
+    reader = Thread(target=receive)
+    reader.start()
+    try:
+      self.assertEqual(termformat.dump_to_socket(term, left), len(expected))
+      reader.join()
+    finally:
+      left.close()
+      right.close()
+    self.assertEqual(b"".join(received), expected)
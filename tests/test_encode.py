@@ -21,19 +21,16 @@ class LargeStringMock(LargeMock, str):
 class TermFormatEncoderTest(TestCase):
 
   def test_encode_false(self):
-    with self.assertRaises(ValueError):
-      bytes = termformat.encode(False)
-      self.assertEqual(bytes, b'\x83d\x00\x05false')
+    bytes = termformat.encode(False)
+    self.assertEqual(bytes, b'\x83d\x00\x05false')
 
   def test_encode_true(self):
-    with self.assertRaises(ValueError):
-      bytes = termformat.encode(True)
-      self.assertEqual(bytes, b'\x83d\x00\x04true')
+    bytes = termformat.encode(True)
+    self.assertEqual(bytes, b'\x83d\x00\x04true')
 
   def test_encode_none(self):
-    with self.assertRaises(ValueError):
-      bytes = termformat.encode(None)
-      self.assertEqual(bytes, b'\x83d\x00\tundefined')
+    bytes = termformat.encode(None)
+    self.assertEqual(bytes, b'\x83d\x00\tundefined')
 
   def test_encode_small_int(self):
     bytes = termformat.encode(20)
@@ -126,7 +123,19 @@ class TermFormatEncoderTest(TestCase):
 
   def test_encode_not_supported_data_type(self):
     with self.assertRaises(ValueError):
-      bytes = termformat.encode({'dictionary': 'item'})
+      bytes = termformat.encode(object())
+
+  def test_encode_map(self):
+    bytes = termformat.encode({'dictionary': 'item'})
+    self.assertEqual(bytes, b'\x83t\x00\x00\x00\x01m\x00\x00\x00\ndictionarym\x00\x00\x00\x04item')
+
+  def test_encode_empty_map(self):
+    bytes = termformat.encode({})
+    self.assertEqual(bytes, b'\x83t\x00\x00\x00\x00')
+
+  def test_encode_utf8_atom(self):
+    bytes = termformat.encode(u":тест")
+    self.assertEqual(bytes, b'\x83w\x08\xd1\x82\xd0\xb5\xd1\x81\xd1\x82')
 
   def test_encode_binary(self):
     bytes = termformat.encode('foo')
@@ -156,3 +165,35 @@ class TermFormatEncoderTest(TestCase):
   def test_encode_with_compression(self):
     plain, compressed = termformat.encode([[1, 2, 3]] * 10), termformat.encode([[1, 2, 3]] * 10, 6)
     self.assertTrue(len(plain) > len(compressed))
+
+  def test_encode_list_of_tuples(self):
+    bytes = termformat.encode([(1, ":ok"), (2, "foo")])
+    self.assertEqual(bytes, b'\x83l\x00\x00\x00\x02h\x02a\x01d\x00\x02okh\x02a\x02'
+                            b'm\x00\x00\x00\x03fooj')
+
+  def test_encode_deeply_nested_list(self):
+    term = []
+    for _ in range(100000):
+      term = [term]
+    bytes = termformat.encode(term)
+    self.assertEqual(bytes[:11], b'\x83l\x00\x00\x00\x01l\x00\x00\x00\x01')
+    self.assertEqual(len(bytes), 1 + 100000 * 6 + 1)
+
+  def test_encode_max_depth(self):
+    self.assertEqual(termformat.encode((1, (2,)), max_depth=2), b'\x83h\x02a\x01h\x01a\x02')
+    with self.assertRaises(ValueError):
+      termformat.encode((1, (2, [3])), max_depth=2)
+
+  def test_encode_new_float(self):
+    bytes = termformat.encode(3.14, new_float=True)
+    self.assertEqual(bytes, b'\x83F@\t\x1e\xb8Q\xeb\x85\x1f')
+    self.assertEqual(termformat.decode(bytes), 3.14)
+
+  def test_encode_new_float_by_default(self):
+    default = termformat.DEFAULT_NEW_FLOAT
+    termformat.DEFAULT_NEW_FLOAT = True
+    try:
+      self.assertEqual(termformat.encode([0.5]), b'\x83l\x00\x00\x00\x01F?\xe0\x00\x00\x00\x00\x00\x00j')
+      self.assertEqual(termformat.encode(0.5, new_float=False)[:2], b'\x83c')
+    finally:
+      termformat.DEFAULT_NEW_FLOAT = default
@@ -0,0 +1,103 @@
+# coding: utf-8
+import termformat
+from unittest import TestCase
+
+
+def snapshot():
+  return [(":route", "10.0.{0}.0/24".format(i), (":node", "host-{0}".format(i % 5), 2 ** 40 + i), (i, 1.5))
+          for i in range(100)]
+
+
+class EncodeCacheTest(TestCase):
+
+  def test_encode(self):
+    cache = termformat.EncodeCache()
+    for _ in range(2):
+      for term in (snapshot(), snapshot()[::-1], ("x" * 100, [("x" * 100,)], {"key": ("x" * 100, 2 ** 70)})):
+        self.assertEqual(termformat.encode(term, cache=cache), termformat.encode(term))
+        self.assertEqual(termformat.encode(term, cache=cache, new_float=True), termformat.encode(term, new_float=True))
+    self.assertGreater(cache.hits, 0)
+
+  def test_hits(self):
+    cache = termformat.EncodeCache()
+    termformat.encode(snapshot(), cache=cache)
+    self.assertEqual(cache.hits, 0)
+    self.assertEqual(cache.misses, 400)
+    termformat.encode(snapshot(), cache=cache)
+    # Each route tuple hits as a whole, so what it holds isn't looked up.
+    self.assertEqual(cache.hits, 100)
+    self.assertEqual(cache.misses, 400)
+    self.assertEqual(len(cache), 400)
+
+  def test_types(self):
+    cache = termformat.EncodeCache()
+    terms = [(1, (2,)), (1.0, (2,)), (True, (2,)), (1, (2.0,)), (1, (2,)), (0.0, "x"), (-0.0, "x"),
+             (1, (0.0, "x")), (1, (-0.0, "x"))]
+    for new_float in (False, True, False):
+      for term in terms:
+        self.assertEqual(termformat.encode(term, cache=cache, new_float=new_float),
+                         termformat.encode(term, new_float=new_float))
+
+  def test_uncached(self):
+    cache = termformat.EncodeCache()
+    termformat.encode([1, 2 ** 31 - 1, "short", b"short", 1.5, ([1],), {"a": 1}], cache=cache)
+    self.assertEqual(len(cache), 0)
+    self.assertEqual(cache.misses, 0)
+
+  def test_mutable_items(self):
+    class Point(object):
+      def __init__(self, x):
+        self.x = x
+    termformat.register_type(Point, lambda point: (":point", point.x))
+    try:
+      cache = termformat.EncodeCache()
+      point, data = Point(1), bytearray(b"abc")
+      terms = [(point, 2), ((point,), 2), (memoryview(data), 2), (termformat.decode_lazy(termformat.encode((1, (2,)))), 3)]
+      for term in terms:
+        termformat.encode(term, cache=cache)
+      point.x, data[0] = 99, ord("x")
+      for term in terms:
+        self.assertEqual(termformat.encode(term, cache=cache), termformat.encode(term))
+      self.assertEqual(termformat.decode(termformat.encode((point, 2), cache=cache)), ((":point", 99), 2))
+    finally:
+      termformat.unregister_type(Point)
+
+  def test_eviction(self):
+    cache = termformat.EncodeCache(size=10)
+    termformat.encode(snapshot(), cache=cache)
+    self.assertEqual(len(cache), 10)
+    self.assertEqual(cache.evictions, 390)
+    cache = termformat.EncodeCache(max_bytes=200)
+    termformat.encode(snapshot(), cache=cache)
+    self.assertLessEqual(cache.nbytes, 200)
+    self.assertGreater(len(cache), 0)
+    cache = termformat.EncodeCache(size=0)
+    termformat.encode(snapshot(), cache=cache)
+    self.assertEqual(len(cache), 0)
+
+  def test_clear(self):
+    cache = termformat.EncodeCache()
+    termformat.encode(snapshot(), cache=cache)
+    cache.clear()
+    self.assertEqual((len(cache), cache.nbytes, cache.hits, cache.misses, cache.evictions), (0, 0, 0, 0, 0))
+
+  def test_compressed(self):
+    cache = termformat.EncodeCache()
+    term = snapshot() * 10
+    for _ in range(2):
+      self.assertEqual(termformat.decode(termformat.encode(term, compressed=6, cache=cache)),
+                       termformat.decode(termformat.encode(term)))
+
+  def test_encode_many(self):
+    cache = termformat.EncodeCache()
+    terms = snapshot()
+    self.assertEqual(termformat.encode_many(terms * 2, cache=cache), termformat.encode_many(terms * 2))
+    self.assertEqual(cache.hits, 100)
+
+  def test_errors(self):
+    cache = termformat.EncodeCache()
+    for options in ({"atom_cache": termformat.AtomCache()}, {"max_depth": 10}):
+      with self.assertRaises(ValueError):
+        termformat.encode((1, 2), cache=cache, **options)
+    with self.assertRaises(ValueError):
+      termformat.encode_many([(1, 2)], cache=cache, executor=object())
@@ -0,0 +1,92 @@
+# coding: utf-8
+import termformat
+from array import array
+from threading import Thread
+from unittest import TestCase, skipIf
+
+
+class Blob(object):
+
+  def __init__(self, inner):
+    self.inner = inner
+
+
+class EncodeIntoTest(TestCase):
+
+  terms = [0, 255, 256, -1, 2 ** 31, -2 ** 31 - 1, 2 ** 2040, 2 ** 2048, 1.5, b"foo", ":foo", u"ünicode",
+           (), (1, 2), tuple(range(300)), [], [1, [2, []]], set([1]), "", ":" + "a" * 255]
+
+  def test_encoded_size(self):
+    for term in self.terms:
+      self.assertEqual(termformat.encoded_size(term), len(termformat.encode(term)), term)
+      self.assertEqual(termformat.encoded_size(term, new_float=True),
+                       len(termformat.encode(term, new_float=True)), term)
+
+  def test_encoded_size_lazy(self):
+    lazy = termformat.decode_lazy(termformat.encode((1, [2, "three"])))
+    self.assertEqual(termformat.encoded_size(lazy[1]), len(termformat.encode([2, "three"])))
+
+  def test_encoded_size_errors(self):
+    for term in (":", ":" + "a" * 256, object(), [[1]]):
+      with self.assertRaises(ValueError):
+        termformat.encoded_size(term, max_depth=1)
+
+  def test_encode_into(self):
+    buf = bytearray(64)
+    end = termformat.encode_into((":ok", "foo"), buf, 10)
+    expected = termformat.encode((":ok", "foo"))
+    self.assertEqual(end, 10 + len(expected))
+    self.assertEqual(bytes(buf[10:end]), expected)
+    self.assertEqual(bytes(buf[:10]) + bytes(buf[end:]), b"\x00" * (64 - len(expected)))
+    self.assertEqual(termformat.encode_into(1, buf), 3)
+    self.assertEqual(bytes(buf[:3]), b"\x83a\x01")
+
+  @skipIf(not hasattr(memoryview, "cast"), "memoryview.cast() is not available")
+  def test_encode_into_typed_buffer(self):
+    buf = array("I", [0] * 4)
+    end = termformat.encode_into([1, 2], buf, 2)
+    self.assertEqual(buf.tobytes()[2:end], termformat.encode([1, 2]))
+
+  def test_encode_into_too_small(self):
+    buf = bytearray(8)
+    with self.assertRaises(ValueError):
+      termformat.encode_into("too long for it", buf)
+    with self.assertRaises(ValueError):
+      termformat.encode_into(1, buf, 6)
+    with self.assertRaises(ValueError):
+      termformat.encode_into(1, buf, -1)
+    self.assertEqual(buf, bytearray(8))
+    with self.assertRaises(TypeError):
+      termformat.encode_into(1, b"read-only")
+
+  def test_scratch_buffer_threads(self):
+    errors = []
+
+    def work(n):
+      for i in range(200):
+        term = [n, i, "x" * (i * 50)]
+        if termformat.decode(termformat.encode(term)) != term:
+          errors.append(term)
+
+    threads = [Thread(target=work, args=(n,)) for n in range(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(errors, [])
+
+  def test_scratch_buffer_after_error(self):
+    with self.assertRaises(ValueError):
+      termformat.encode([1, 2, object()])
+    self.assertEqual(termformat.encode([1, 2]), b"\x83l\x00\x00\x00\x02a\x01a\x02j")
+
+  def test_scratch_buffer_nested_encode(self):
+    # The encoder runs while the outer term is still in the scratch buffer.
+    termformat.register_type(Blob, lambda blob: termformat.encode(blob.inner))
+    try:
+      inner = list(range(300000))
+      binary = termformat.encode(("head", Blob(inner), "tail"))
+      self.assertEqual(binary, termformat.encode(("head", termformat.encode(inner), "tail")))
+      self.assertEqual(termformat.decode(binary, binary="bytes")[2], b"tail")
+    finally:
+      termformat.unregister_type(Blob)
@@ -0,0 +1,47 @@
+# coding: utf-8
+import termformat
+from unittest import TestCase
+
+
+class ExtractTest(TestCase):
+
+  value = (":msg", 1, [(":a", 2.5), ("foo", [3, 4, 5])], "bar")
+
+  def test_extract(self):
+    binary = termformat.encode(self.value)
+    self.assertEqual(termformat.extract(binary, ()), self.value)
+    self.assertEqual(termformat.extract(binary, (0,)), ":msg")
+    self.assertEqual(termformat.extract(binary, (2, 1, 1, 2)), 5)
+    self.assertEqual(termformat.extract(binary, [2, 0]), (":a", 2.5))
+    self.assertEqual(termformat.extract(binary, (-1,)), "bar")
+    self.assertEqual(termformat.extract(binary, (2, -1, 0)), "foo")
+
+  def test_extract_skips_siblings(self):
+    # The first element is garbage, but it is only skipped over.
+    binary = b"\x83h\x02m\x00\x00\x00\x02\xff\xfea\x07"
+    self.assertEqual(termformat.extract(binary, (1,)), 7)
+    with self.assertRaises(ValueError):
+      termformat.extract(binary, (0,))
+
+  def test_extract_compressed(self):
+    value = ([0] * 1024, (":done", 1))
+    binary = termformat.encode(value, compressed=6)
+    self.assertEqual(termformat.extract(binary, (1, 0)), ":done")
+
+  def test_extract_from_string(self):
+    binary = b"\x83h\x01k\x00\x03foo"
+    self.assertEqual(termformat.extract(binary, (0, 1)), termformat.decode(binary)[0][1])
+
+  def test_extract_out_of_range(self):
+    binary = termformat.encode((1, [2, 3]))
+    with self.assertRaises(IndexError):
+      termformat.extract(binary, (2,))
+    with self.assertRaises(IndexError):
+      termformat.extract(binary, (1, -3))
+    with self.assertRaises(TypeError):
+      termformat.extract(binary, (0, 0))
+
+  def test_extract_incomplete(self):
+    binary = termformat.encode((1, "foo", 2))[:-3]
+    with self.assertRaises(ValueError):
+      termformat.extract(binary, (2,))
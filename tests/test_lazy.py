@@ -0,0 +1,80 @@
+# coding: utf-8
+import termformat
+from unittest import TestCase
+
+
+class LazyDecodeTest(TestCase):
+
+  def test_decode_lazy_tuple(self):
+    term = termformat.decode_lazy(termformat.encode((":msg", 1, [2.5, "foo"])))
+    self.assertIsInstance(term, termformat.LazyTuple)
+    self.assertEqual(len(term), 3)
+    self.assertEqual(term[0], ":msg")
+    self.assertEqual(term[-2], 1)
+    self.assertIsInstance(term[2], termformat.LazyList)
+    self.assertEqual(list(term[2]), [2.5, "foo"])
+    self.assertEqual(term[1:], (1, term[2]))
+
+  def test_decode_lazy_scalar(self):
+    self.assertEqual(termformat.decode_lazy(termformat.encode(42)), 42)
+    self.assertEqual(termformat.decode_lazy(termformat.encode([])), [])
+
+  def test_decode_lazy_touches_only_prefix(self):
+    # The third element is garbage, but it is never looked at.
+    binary = b"\x83h\x03a\x01a\x02\xff"
+    term = termformat.decode_lazy(binary)
+    self.assertEqual(term[0], 1)
+    self.assertEqual(term[1], 2)
+    with self.assertRaises(ValueError):
+      term[2]
+
+  def test_decode_lazy_incomplete(self):
+    term = termformat.decode_lazy(b"\x83h\x02m\x00\x00\x00\x05fooa\x01")
+    with self.assertRaises(ValueError):
+      term[1]
+
+  def test_decode_lazy_index_error(self):
+    term = termformat.decode_lazy(termformat.encode((1, 2)))
+    with self.assertRaises(IndexError):
+      term[2]
+    with self.assertRaises(IndexError):
+      term.raw(-3)
+
+  def test_decode_lazy_raw(self):
+    body = termformat.encode((":route", 7, [1, (2, 3)]))
+    term = termformat.decode_lazy(body)
+    self.assertEqual(term.raw(), body[1:])
+    self.assertEqual(term.raw(2), termformat.encode([1, (2, 3)])[1:])
+    self.assertEqual(term[2].raw(1), termformat.encode((2, 3))[1:])
+
+  def test_decode_lazy_full_decode(self):
+    value = (":ok", [1, 2, (3, "four")])
+    term = termformat.decode_lazy(termformat.encode(value))
+    self.assertEqual(term.decode(), value)
+    self.assertEqual(term[1].decode(), value[1])
+
+  def test_encode_lazy_passthrough(self):
+    payload = [1, 2.0, "three", (":four", 5)]
+    term = termformat.decode_lazy(termformat.encode((":msg", payload)))
+    forwarded = termformat.encode((":fwd", term[1]))
+    self.assertEqual(forwarded, termformat.encode((":fwd", payload)))
+    self.assertEqual(termformat.encode(term), termformat.encode((":msg", payload)))
+
+  def test_decode_lazy_compressed(self):
+    value = ([0] * 1024, ":done")
+    term = termformat.decode_lazy(termformat.encode(value, compressed=6))
+    self.assertEqual(term[1], ":done")
+    self.assertEqual(len(term[0]), 1024)
+
+  def test_decode_lazy_atom_cache(self):
+    sender, receiver = termformat.AtomCache(), termformat.AtomCache()
+    value = (":reply", [":ok", ":ok"])
+    term = termformat.decode_lazy(termformat.encode(value, atom_cache=sender), atom_cache=receiver)
+    self.assertEqual(term[0], ":reply")
+    self.assertEqual(termformat.decode(termformat.encode(term)), value)
+
+  def test_decode_lazy_binary_mode(self):
+    term = termformat.decode_lazy(termformat.encode(("foo",)), binary="bytes")
+    self.assertEqual(term[0], b"foo")
+    with self.assertRaises(ValueError):
+      termformat.decode_lazy(termformat.encode(("foo",)), binary="text")
@@ -0,0 +1,50 @@
+# coding: utf-8
+import termformat
+from unittest import TestCase, skipIf
+
+try:
+  from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+except ImportError: # pragma: no cover
+  ProcessPoolExecutor = ThreadPoolExecutor = None
+
+
+class ManyTest(TestCase):
+
+  terms = [1, -1, 2.5, "foo", ":bar", (1, [2, ":three"]), [], 2 ** 100] * 25
+
+  def test_encode_many(self):
+    self.assertEqual(termformat.encode_many(self.terms), [termformat.encode(term) for term in self.terms])
+    self.assertEqual(termformat.encode_many(iter([1, 2])), [b"\x83a\x01", b"\x83a\x02"])
+    self.assertEqual(termformat.encode_many([]), [])
+
+  def test_encode_many_options(self):
+    terms = [[0] * 1024, 2.5]
+    expected = [termformat.encode(term, compressed=6, new_float=True) for term in terms]
+    self.assertEqual(termformat.encode_many(terms, compressed=6, new_float=True), expected)
+    with self.assertRaises(ValueError):
+      termformat.encode_many([[[1]]], max_depth=1)
+
+  def test_decode_many(self):
+    binaries = [termformat.encode(term, compressed=6) for term in self.terms]
+    self.assertEqual(termformat.decode_many(binaries), self.terms)
+    self.assertEqual(termformat.decode_many([b"\x83m\x00\x00\x00\x01\xff"], binary="bytes"), [b"\xff"])
+    with self.assertRaises(ValueError):
+      termformat.decode_many([b"\x83a\x01", b"\x84a\x01"])
+
+  def test_invalid_chunk_size(self):
+    with self.assertRaises(ValueError):
+      termformat.encode_many(self.terms, executor=object(), chunksize=0)
+
+  @skipIf(ThreadPoolExecutor is None, "concurrent.futures is not available")
+  def test_many_thread_pool(self):
+    with ThreadPoolExecutor(4) as executor:
+      binaries = termformat.encode_many(self.terms, executor=executor, chunksize=7)
+      self.assertEqual(binaries, termformat.encode_many(self.terms))
+      self.assertEqual(termformat.decode_many(binaries, executor=executor, chunksize=7), self.terms)
+
+  @skipIf(ProcessPoolExecutor is None, "concurrent.futures is not available")
+  def test_many_process_pool(self):
+    with ProcessPoolExecutor(2) as executor:
+      binaries = termformat.encode_many(self.terms, executor=executor, chunksize=64)
+      self.assertEqual(binaries, termformat.encode_many(self.terms))
+      self.assertEqual(termformat.decode_many(binaries, executor=executor, chunksize=64), self.terms)
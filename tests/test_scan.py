@@ -0,0 +1,57 @@
+# coding: utf-8
+import termformat
+from array import array
+from unittest import TestCase
+
+
+class ScanTest(TestCase):
+
+  terms = [1, -2 ** 40, 2 ** 100, 1.5, "text", b"bytes", ":atom", None, True, [], (), {},
+           [1, [2, (3, {"a": [4.5]})]], (":ok", b"x" * 70000), {":key": (1, 2), "list": list(range(300))}]
+
+  def test_scan(self):
+    for term in self.terms:
+      for new_float in (False, True):
+        self.assertIsNone(termformat.scan(termformat.encode(term, new_float=new_float)))
+    self.assertIsNone(termformat.scan(b"\x83l\x00\x00\x00\x01a\x01a\x02"))
+
+  def test_offsets(self):
+    binary = termformat.encode((":ok", [1, 2], b"xyz"))
+    offsets = termformat.scan(binary, offsets=True)
+    self.assertIsInstance(offsets, array)
+    self.assertEqual(offsets.itemsize, 8)
+    self.assertEqual(offsets.tolist(), [3, 8, 18])
+    self.assertEqual(termformat.scan(termformat.encode([1, 300]), offsets=True).tolist(), [6, 8])
+    self.assertEqual(termformat.scan(termformat.encode({"a": 1}), offsets=True).tolist(), [6, 12])
+    self.assertEqual(termformat.scan(termformat.encode(1), offsets=True).tolist(), [])
+    self.assertEqual(termformat.scan(termformat.encode([]), offsets=True).tolist(), [])
+    for term in self.terms:
+      binary = termformat.encode(term)
+      offsets = termformat.scan(binary, offsets=True)
+      if isinstance(term, (list, tuple)):
+        self.assertEqual([termformat.decode(b"\x83" + binary[pos:]) for pos in offsets],
+                         list(termformat.decode(binary)))
+
+  def test_compressed(self):
+    term = [(":ok", "x" * 100)] * 100
+    binary = termformat.encode(term, compressed=6)
+    offsets = termformat.scan(binary, offsets=True)
+    self.assertEqual(len(offsets), 100)
+    with self.assertRaises(ValueError):
+      termformat.scan(binary, max_size=100)
+
+  def test_incomplete(self):
+    for term in self.terms[:14]:
+      binary = termformat.encode(term)
+      for size in range(len(binary)):
+        for offsets in (False, True):
+          with self.assertRaises(ValueError):
+            termformat.scan(binary[:size], offsets=offsets)
+    with self.assertRaises(ValueError):
+      termformat.scan(b"\x83l\xff\xff\xff\xffj", offsets=True)
+
+  def test_invalid(self):
+    for binary in (b"\x84a\x01", b"\x83\xff", b"\x83h\x02a\x01\xff", b"\x83a\x01a\x02"):
+      for offsets in (False, True):
+        with self.assertRaises(ValueError):
+          termformat.scan(binary, offsets=offsets)
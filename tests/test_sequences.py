@@ -0,0 +1,99 @@
+# coding: utf-8
+import termformat
+from array import array
+from io import BytesIO
+from unittest import TestCase, skipIf
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+try:
+  INT64, UINT64 = array("q").typecode, array("Q").typecode
+except ValueError: # Python 2.7, where "l" is 64 bits on LP64 platforms
+  INT64, UINT64 = "l", "L"
+
+
+class SequenceTest(TestCase):
+
+  def assertEncodes(self, sequence, values, new_float=False):
+    expected = termformat.encode(values, new_float=new_float)
+    if values and all(type(value) is int and 0 <= value <= 255 for value in values) and len(values) <= 65535:
+      expected = b"\x83k" + termformat._int2_pack(len(values)) + bytes(bytearray(values))
+    self.assertEqual(termformat.encode(sequence, new_float=new_float), expected)
+    self.assertEqual(termformat.encoded_size(sequence, new_float=new_float), len(expected))
+    output = BytesIO()
+    termformat.dump(sequence, output, new_float=new_float)
+    self.assertEqual(output.getvalue(), expected)
+
+  def test_encode_bytearray(self):
+    self.assertEqual(termformat.encode(bytearray(b"abc")), b"\x83k\x00\x03abc")
+    self.assertEqual(termformat.encode(bytearray()), b"\x83j")
+    for values in ([1, 2, 3], list(range(256)) * 300):
+      self.assertEncodes(bytearray(values), values)
+
+  def test_encode_array(self):
+    for typecode, values in (("B", [1, 2, 3]), ("h", [-1, 0, 255]), ("i", [0, 300, -2 ** 31, 2 ** 31 - 1]),
+                             (INT64, [2 ** 40, -2 ** 63, 7]), (UINT64, [2 ** 64 - 1, 0]), ("I", [5] * 70000),
+                             ("d", [1.5, -2.25, 1e300]), ("f", [0.5, -0.25]), ("l", [])):
+      for new_float in (False, True):
+        self.assertEncodes(array(typecode, values), values, new_float)
+
+  def test_encode_other_arrays(self):
+    self.assertEqual(termformat.encode(array("u", u"ab")), termformat.encode([u"a", u"b"]))
+
+  def test_encode_sequence_in_term(self):
+    term = (":data", array("i", [1, 2, 1000]), [bytearray(b"xy"), 3])
+    self.assertEqual(termformat.encode(term), termformat.encode((":data", [1, 2, 1000], [[120, 121], 3]))
+                     .replace(b"l\x00\x00\x00\x02axayj", b"k\x00\x02xy"))
+    with self.assertRaises(ValueError):
+      termformat.encode([bytearray(b"x")], max_depth=1)
+
+  def test_encode_integer_runs(self):
+    values = [0, 255, 256, -1, 2 ** 31 - 1, -2 ** 31, 2 ** 31, -2 ** 31 - 1, 2 ** 100, True, 1.5, ":ok", 7]
+    self.assertEqual(termformat.decode(termformat.encode(values)), values)
+    self.assertEqual(termformat.encode((1, 300, 2 ** 40)), b"\x83h\x03a\x01b\x00\x00\x01,n\x06\x00\x00\x00\x00\x00\x00\x01")
+
+  def test_decode_string_modes(self):
+    binary = termformat.encode(bytearray(b"abc"))
+    self.assertEqual(termformat.decode(binary), u"abc")
+    self.assertEqual(termformat.decode(binary, string="bytes"), b"abc")
+    self.assertEqual(termformat.decode(binary, string="array"), array("B", b"abc"))
+    self.assertEqual(termformat.decode(binary, string="list"), [97, 98, 99])
+    self.assertEqual(termformat.decode_many([binary, binary], string="list"), [[97, 98, 99]] * 2)
+    self.assertEqual(termformat.decode(termformat.encode([1, 2]), string="bytes"), [1, 2])
+
+  def test_decode_string_roundtrip(self):
+    # STRING_EXT holds one byte per character, so the default text mode
+    # is lossless and the other modes give the values back.
+    for sequence, values in ((bytearray(b"\x00\x7f\x80\xff"), [0, 127, 128, 255]),
+                             (array("i", [1, 2, 3]), [1, 2, 3]), (bytearray(range(256)), list(range(256)))):
+      binary = termformat.encode(sequence)
+      self.assertEqual([ord(char) for char in termformat.decode(binary)], values)
+      self.assertEqual(termformat.decode(binary, string="list"), values)
+      self.assertEqual(termformat.decode(binary, string="bytes"), bytes(bytearray(values)))
+    self.assertEqual(termformat.decode(b"\x83k\x00\x05h\xe9llo"), u"h\xe9llo")
+    with self.assertRaises(ValueError):
+      termformat.decode(binary, string="tuple")
+    with self.assertRaises(ValueError):
+      termformat.decode_many([binary], string="tuple")
+
+
+@skipIf(numpy is None, "NumPy is not available")
+class NumpySequenceTest(TestCase):
+
+  def test_encode_ndarray(self):
+    for typecode, dtype, values in (("B", "u1", [1, 2, 3]), ("q", "i8", [0, 300, -2 ** 31, 2 ** 40, -2 ** 63]),
+                                    ("q", "i2", [7] * 70000), ("d", "f8", [1.5, -2.25, 1e300]), ("q", "i8", [])):
+      for new_float in (False, True):
+        sequence = numpy.array(values, dtype)
+        expected = termformat.encode(array(typecode, values), new_float=new_float)
+        self.assertEqual(termformat.encode(sequence, new_float=new_float), expected)
+        self.assertEqual(termformat.encoded_size(sequence, new_float=new_float), len(expected))
+
+  def test_encode_other_ndarrays(self):
+    self.assertEqual(termformat.encode(numpy.arange(4).reshape(2, 2)), termformat.encode([[0, 1], [2, 3]]))
+    self.assertEqual(termformat.encode(numpy.array([True, False])), termformat.encode([True, False]))
+    self.assertEqual(termformat.encode(numpy.arange(300, dtype=numpy.float32)[::3], new_float=True),
+                     termformat.encode([float(value) for value in range(0, 300, 3)], new_float=True))
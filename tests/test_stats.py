@@ -0,0 +1,94 @@
+# coding: utf-8
+import termformat
+from unittest import TestCase
+
+
+class StatsTest(TestCase):
+
+  def setUp(self):
+    self.stats = termformat.enable_stats()
+
+  def tearDown(self):
+    termformat.disable_stats()
+
+  def test_encode_tags(self):
+    binary = termformat.encode((":ok", [1, 300, "foo"]))
+    encode = self.stats.snapshot()["encode"]
+    self.assertEqual(encode["calls"], 1)
+    self.assertEqual(encode["bytes"], len(binary))
+    self.assertTrue(encode["seconds"] >= 0)
+    self.assertEqual(encode["tags"], {
+      "ERL_SMALL_TUPLE": {"count": 1, "bytes": 2},
+      "ERL_ATOM": {"count": 1, "bytes": 5},
+      "ERL_LIST": {"count": 1, "bytes": 5},
+      "ERL_SMALL_INT": {"count": 1, "bytes": 2},
+      "ERL_INT": {"count": 1, "bytes": 5},
+      "ERL_BINARY": {"count": 1, "bytes": 8},
+      "ERL_NIL": {"count": 1, "bytes": 1},
+    })
+    self.assertEqual(sum(tag["bytes"] for tag in encode["tags"].values()), len(binary) - 1)
+    self.assertEqual(encode["depths"], {4: 1})
+    self.assertEqual(encode["sizes"], {32: 1})
+
+  def test_decode_tags(self):
+    binary = termformat.encode([[[1.5]]], new_float=True)
+    self.assertEqual(termformat.decode(binary), [[[1.5]]])
+    self.assertEqual(termformat.decode(binary), [[[1.5]]])
+    decode = self.stats.snapshot()["decode"]
+    self.assertEqual(decode["calls"], 2)
+    self.assertEqual(decode["tags"]["ERL_LIST"], {"count": 6, "bytes": 30})
+    self.assertEqual(decode["tags"]["ERL_NEW_FLOAT"], {"count": 2, "bytes": 18})
+    self.assertEqual(decode["depths"], {4: 2})
+    self.assertEqual(self.stats.snapshot()["encode"]["calls"], 1)
+
+  def test_compressed(self):
+    term = [[1, 2, 3]] * 100
+    plain = len(termformat.encode(term))
+    self.stats.reset()
+    binary = termformat.encode(term, compressed=6)
+    termformat.decode(binary)
+    for operation in ("encode", "decode"):
+      compressed = self.stats.snapshot()[operation]["compressed"]
+      self.assertEqual(compressed, {"count": 1, "bytes": len(binary), "uncompressed": plain})
+      self.assertEqual(self.stats.snapshot()[operation]["tags"]["ERL_LIST"]["count"], 101)
+
+  def test_atom_cache(self):
+    cache = termformat.AtomCache()
+    binary = termformat.encode((":a", ":b"), atom_cache=cache)
+    termformat.decode(binary, atom_cache=termformat.AtomCache())
+    snapshot = self.stats.snapshot()
+    self.assertEqual(snapshot["encode"]["calls"], 1)
+    self.assertEqual(snapshot["encode"]["tags"], {})
+    self.assertEqual(snapshot["decode"]["tags"]["ERL_ATOM_CACHE_REF"], {"count": 2, "bytes": 4})
+
+  def test_snapshot_is_detached(self):
+    termformat.encode(1)
+    snapshot = self.stats.snapshot()
+    termformat.encode(1)
+    self.assertEqual(snapshot["encode"]["calls"], 1)
+    self.assertEqual(snapshot["encode"]["tags"]["ERL_SMALL_INT"]["count"], 1)
+
+  def test_reset(self):
+    termformat.encode(1)
+    self.stats.reset()
+    self.assertEqual(self.stats.snapshot()["encode"]["calls"], 0)
+    self.assertEqual(self.stats.snapshot()["encode"]["tags"], {})
+
+  def test_disable(self):
+    termformat.disable_stats()
+    termformat.encode(1)
+    termformat.decode(b"\x83a\x01")
+    snapshot = self.stats.snapshot()
+    self.assertEqual((snapshot["encode"]["calls"], snapshot["decode"]["calls"]), (0, 0))
+
+  def test_errors_not_counted(self):
+    with self.assertRaises(ValueError):
+      termformat.decode(b"\x83a")
+    self.assertEqual(self.stats.snapshot()["decode"]["calls"], 0)
+
+  def test_shared_stats(self):
+    stats = termformat.Stats()
+    self.assertIs(termformat.enable_stats(stats), stats)
+    termformat.encode(1)
+    self.assertEqual(stats.snapshot()["encode"]["calls"], 1)
+    self.assertEqual(self.stats.snapshot()["encode"]["calls"], 0)
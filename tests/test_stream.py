@@ -0,0 +1,79 @@
+# coding: utf-8
+import termformat
+from struct import pack
+from unittest import TestCase
+
+
+class StreamDecoderTest(TestCase):
+
+  def frame(self, term, packet=4):
+    body = termformat.encode(term)
+    return pack({1: ">B", 2: ">H", 4: ">I"}[packet], len(body)) + body
+
+  def test_decode_single_frame(self):
+    decoder = termformat.StreamDecoder()
+    self.assertEqual(list(decoder.feed(self.frame((":ok", 1)))), [(":ok", 1)])
+
+  def test_decode_frames_split_across_chunks(self):
+    decoder = termformat.StreamDecoder()
+    data = self.frame([1, 2, 3]) + self.frame(":foo") + self.frame("bar")
+    result = []
+    for i in range(len(data)):
+      result.extend(decoder.feed(data[i:i + 1]))
+    self.assertEqual(result, [[1, 2, 3], ":foo", "bar"])
+
+  def test_decode_packet_sizes(self):
+    for packet in (1, 2, 4):
+      decoder = termformat.StreamDecoder(packet)
+      data = self.frame((1, 2), packet) + self.frame([":a"], packet)
+      self.assertEqual(list(decoder.feed(data)), [(1, 2), [":a"]])
+
+  def test_decode_compressed_frame(self):
+    decoder = termformat.StreamDecoder(2)
+    body = termformat.encode([[1, 2, 3]] * 10, 6)
+    self.assertEqual(list(decoder.feed(pack(">H", len(body)) + body)), [[[1, 2, 3]] * 10])
+
+  def test_decode_invalid_packet_size(self):
+    with self.assertRaises(ValueError):
+      termformat.StreamDecoder(3)
+
+  def test_decode_unframed_terms(self):
+    decoder = termformat.StreamDecoder(packet=0)
+    terms = [(":reply", 1, [1.5, "x"]), [[1, 2, 3]] * 10, 4294967296, []]
+    data = termformat.encode(terms[0]) + termformat.encode(terms[1], 6) + \
+           termformat.encode(terms[2]) + termformat.encode(terms[3])
+    result = []
+    for i in range(0, len(data), 3):
+      result.extend(decoder.feed(data[i:i + 3]))
+    self.assertEqual(result, terms)
+
+  def test_decode_unframed_terms_bytewise(self):
+    decoder = termformat.StreamDecoder(packet=0, binary="bytes")
+    terms = [{":key": (b"\x00" * 300, 2 ** 100, -1)}, [1.5, ":atom", b"text", []], 7]
+    data = b"".join(termformat.encode(term, new_float=True) for term in terms)
+    result = []
+    for i in range(len(data)):
+      result.extend(decoder.feed(data[i:i + 1]))
+    self.assertEqual(result, terms)
+
+  def test_decode_unframed_walk_resumes(self):
+    decoder = termformat.StreamDecoder(packet=0)
+    data = termformat.encode(list(range(100000)))
+    half = len(data) // 2
+    self.assertEqual(list(decoder.feed(data[:half])), [])
+    # The elements walked so far are not walked again once the rest arrives.
+    self.assertGreater(decoder._walked, half // 2)
+    self.assertEqual(list(decoder.feed(data[half:])), [list(range(100000))])
+
+  def test_decode_unframed_invalid_magic(self):
+    decoder = termformat.StreamDecoder(packet=0)
+    with self.assertRaises(ValueError):
+      list(decoder.feed(b"\x84a\x01"))
+
+  def test_decode_memoryview_binaries(self):
+    decoder = termformat.StreamDecoder(binary="memoryview")
+    data = self.frame((":blob", b"\x00\xff")) + self.frame(b"next")
+    first, second = decoder.feed(data)
+    self.assertEqual(first[1].tobytes(), b"\x00\xff")
+    self.assertEqual(list(decoder.feed(self.frame(b"more")))[0].tobytes(), b"more")
+    self.assertEqual(second.tobytes(), b"next")
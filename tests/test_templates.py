@@ -0,0 +1,51 @@
+# coding: utf-8
+import termformat
+from io import BytesIO
+from termformat import SLOT
+from unittest import TestCase
+
+
+class TemplateTest(TestCase):
+
+  values = [1, 300, -2 ** 40, 2.5, "text", b"bytes", ":atom", None, True, [], (":ok", [1, {"a": 2}])]
+
+  def test_encode(self):
+    reply = termformat.compile_template((":reply", SLOT, (":ok", SLOT)))
+    self.assertEqual(reply.slots, 2)
+    for ref in self.values:
+      for payload in self.values:
+        self.assertEqual(reply.encode(ref, payload), termformat.encode((":reply", ref, (":ok", payload))))
+
+  def test_encode_containers(self):
+    # Slots and map entries follow the dict's order, which is arbitrary
+    # before Python 3.7, so each map holds at most one slot here.
+    shape = [SLOT, {":key": SLOT, "const": "value"}, {SLOT: 1}, (SLOT,), [SLOT, SLOT]]
+    template = termformat.compile_template(shape)
+    values = (1, "a", ":b", [2], 3, (4,))
+    term = [1, {":key": "a", "const": "value"}, {":b": 1}, ([2],), [3, (4,)]]
+    self.assertEqual(termformat.decode(template.encode(*values)), termformat.decode(termformat.encode(term)))
+    template = termformat.compile_template([SLOT, {SLOT: "value"}])
+    self.assertEqual(template.encode(1, ":b"), termformat.encode([1, {":b": "value"}]))
+
+  def test_encode_constant(self):
+    template = termformat.compile_template((":ping", 1, b"x" * 100000))
+    self.assertEqual(template.slots, 0)
+    self.assertEqual(template.encode(), termformat.encode((":ping", 1, b"x" * 100000)))
+    self.assertEqual(termformat.compile_template(SLOT).encode("x"), termformat.encode("x"))
+
+  def test_new_float(self):
+    template = termformat.compile_template((1.5, SLOT), new_float=True)
+    self.assertEqual(template.encode(2.5), termformat.encode((1.5, 2.5), new_float=True))
+
+  def test_errors(self):
+    template = termformat.compile_template((":reply", SLOT))
+    for values in ((), (1, 2)):
+      with self.assertRaises(ValueError):
+        template.encode(*values)
+    with self.assertRaises(ValueError):
+      template.encode(SLOT)
+    with self.assertRaises(ValueError):
+      template.encode(object())
+    for function in (termformat.encode, termformat.encoded_size, lambda term: termformat.dump(term, BytesIO())):
+      with self.assertRaises(ValueError):
+        function((":reply", SLOT))
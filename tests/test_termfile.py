@@ -0,0 +1,148 @@
+# coding: utf-8
+import os
+import shutil
+import tempfile
+import termformat
+from unittest import TestCase
+
+
+class TermFileTest(TestCase):
+
+  terms = [(":msg", i, "body-{0}".format(i), [i * 0.5]) for i in range(100)] + [[0] * 1000, 2 ** 100, []]
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, "terms.bin")
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def write(self, terms, compressed=False):
+    with open(self.path, "ab") as output:
+      for term in terms:
+        output.write(termformat.encode(term, compressed))
+
+  def test_read_terms(self):
+    self.write(self.terms)
+    with termformat.TermFile(self.path) as tf:
+      self.assertEqual(len(tf), len(self.terms))
+      self.assertEqual(list(tf), self.terms)
+      self.assertEqual(tf[5], self.terms[5])
+      self.assertEqual(tf[-1], [])
+      self.assertEqual(tf[1:3], self.terms[1:3])
+      self.assertEqual(bytes(tf.raw(2)), termformat.encode(self.terms[2]))
+      with self.assertRaises(IndexError):
+        tf[len(self.terms)]
+
+  def test_read_compressed_terms(self):
+    self.write(self.terms[:3])
+    self.write(self.terms[100:], compressed=6)
+    self.write(self.terms[3:5])
+    expected = self.terms[:3] + self.terms[100:] + self.terms[3:5]
+    with termformat.TermFile(self.path, index=False) as tf:
+      self.assertEqual(list(tf), expected)
+
+  def test_empty_file(self):
+    open(self.path, "wb").close()
+    with termformat.TermFile(self.path) as tf:
+      self.assertEqual(len(tf), 0)
+      self.assertEqual(list(tf), [])
+
+  def test_index_reused(self):
+    self.write(self.terms)
+    termformat.TermFile(self.path).close()
+    size, count, stamp, offsets = termformat._read_index(self.path + ".idx")
+    self.assertEqual((size, count), (os.path.getsize(self.path), len(self.terms)))
+    # Claim that only the first two terms are indexed: reopening trusts the
+    # index and scans just the rest of the file.
+    with open(self.path, "rb") as source:
+      last = source.read()[offsets[1]:offsets[2]][:termformat._INDEX_STAMP_SIZE]
+    termformat._write_index(self.path + ".idx", offsets[2], termformat._index_stamp(os.stat(self.path), last), offsets[:2])
+    with termformat.TermFile(self.path) as tf:
+      self.assertEqual(list(tf), self.terms)
+    self.assertEqual(termformat._read_index(self.path + ".idx"), (size, count, stamp, offsets))
+    self.assertFalse(os.path.exists(os.path.join(self.directory, "other.idx")))
+    with termformat.TermFile(self.path, index=os.path.join(self.directory, "other.idx")) as tf:
+      self.assertEqual(list(tf), self.terms)
+    self.assertTrue(os.path.exists(os.path.join(self.directory, "other.idx")))
+
+  def test_index_catches_up_with_appends(self):
+    self.write(self.terms[:10])
+    termformat.TermFile(self.path).close()
+    self.write(self.terms[10:])
+    with termformat.TermFile(self.path) as tf:
+      self.assertEqual(list(tf), self.terms)
+
+  def test_stale_index_rebuilt(self):
+    self.write(self.terms)
+    termformat.TermFile(self.path).close()
+    open(self.path, "wb").close()
+    self.write(self.terms[:2])
+    with termformat.TermFile(self.path) as tf:
+      self.assertEqual(list(tf), self.terms[:2])
+
+  def test_rewritten_index_rebuilt(self):
+    self.write([1, 2, 3])
+    termformat.TermFile(self.path).close()
+    open(self.path, "wb").close()
+    self.write([300, 4])
+    self.assertEqual(os.path.getsize(self.path), 9)
+    with termformat.TermFile(self.path) as tf:
+      self.assertEqual(list(tf), [300, 4])
+    # Same size and same last term, told apart by the modification time.
+    open(self.path, "wb").close()
+    self.write([1, 2, 3])
+    os.utime(self.path, (0, 0))
+    termformat.TermFile(self.path).close()
+    with open(self.path, "r+b") as output:
+      output.write(termformat.encode(300))
+    os.utime(self.path, (1, 1))
+    with termformat.TermFile(self.path) as tf:
+      self.assertEqual(list(tf), [300, 3])
+
+  def test_incomplete_tail(self):
+    self.write(self.terms[:2])
+    with open(self.path, "ab") as output:
+      output.write(termformat.encode(self.terms[2])[:-3])
+    with termformat.TermFile(self.path) as tf:
+      self.assertEqual(list(tf), self.terms[:2])
+
+  def test_invalid_magic(self):
+    self.write(self.terms[:2])
+    with open(self.path, "ab") as output:
+      output.write(b"\x84a\x01")
+    with self.assertRaises(ValueError):
+      termformat.TermFile(self.path)
+
+  def test_zero_copy_binaries(self):
+    self.write([b"\x00\xff"])
+    tf = termformat.TermFile(self.path, binary="memoryview")
+    value = tf[0]
+    self.assertEqual(value.tobytes(), b"\x00\xff")
+    del value
+    tf.close()
+
+
+class TermFileWriterTest(TermFileTest):
+
+  def write(self, terms, compressed=False):
+    with termformat.TermFileWriter(self.path, compressed=compressed) as writer:
+      for term in terms:
+        writer.write(term)
+
+  def test_writer_offsets(self):
+    with termformat.TermFileWriter(self.path) as writer:
+      self.assertEqual(writer.write(1), 0)
+      self.assertEqual(writer.write(2), 3)
+    with termformat.TermFileWriter(self.path) as writer:
+      self.assertEqual(writer.write(3), 6)
+
+  def test_writer_extends_index(self):
+    self.write(self.terms[:10])
+    termformat.TermFile(self.path).close()
+    self.write(self.terms[10:])
+    size, count, _, offsets = termformat._read_index(self.path + ".idx")
+    self.assertEqual((size, count), (os.path.getsize(self.path), len(self.terms)))
+    with termformat.TermFile(self.path) as tf:
+      self.assertEqual(list(tf), self.terms)
+      self.assertEqual(list(offsets), list(tf._offsets))
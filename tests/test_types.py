@@ -0,0 +1,75 @@
+# coding: utf-8
+import termformat
+from unittest import TestCase
+
+
+class Point(object):
+
+  def __init__(self, x, y):
+    self.x, self.y = x, y
+
+  def __eq__(self, other):
+    return type(other) is Point and (self.x, self.y) == (other.x, other.y)
+
+
+class MapTest(TestCase):
+
+  def test_roundtrip(self):
+    term = {"name": "foo", 1: [1, 2.5], (1, ":a"): {":nested": True}, ":empty": {}}
+    self.assertEqual(termformat.decode(termformat.encode(term)), term)
+
+  def test_encoded_size(self):
+    for term in ({}, {1: 2}, {"a": {"b": [None, False]}}, [u":тест", ":ok"]):
+      self.assertEqual(termformat.encoded_size(term), len(termformat.encode(term)))
+
+  def test_incomplete(self):
+    binary = termformat.encode({1: 2, 3: 4})
+    for end in range(2, len(binary)):
+      with self.assertRaises(ValueError):
+        termformat.decode(binary[:end])
+
+  def test_unhashable_key(self):
+    with self.assertRaises(ValueError):
+      termformat.decode(b"\x83t\x00\x00\x00\x01l\x00\x00\x00\x01a\x01ja\x02")
+
+  def test_max_depth(self):
+    with self.assertRaises(ValueError):
+      termformat.encode({1: {2: 3}}, max_depth=1)
+    with self.assertRaises(ValueError):
+      termformat.decode(termformat.encode({1: {2: 3}}), max_depth=1)
+
+  def test_skip(self):
+    binary = termformat.encode(({1: [2, 3]}, ":w", u":тест", "tail"))
+    self.assertEqual(termformat.extract(binary, (3,)), "tail")
+    self.assertEqual(termformat.extract(binary, (0, 1)), [2, 3])
+    lazy = termformat.decode_lazy(binary)
+    self.assertEqual(lazy[0], {1: [2, 3]})
+    self.assertEqual(termformat.encode(lazy), binary)
+
+
+class CustomTypeTest(TestCase):
+
+  def setUp(self):
+    termformat.register_type(Point, lambda point: (":point", point.x, point.y),
+                             ":point", lambda term: Point(term[1], term[2]))
+
+  def tearDown(self):
+    termformat.unregister_type(Point, ":point")
+
+  def test_roundtrip(self):
+    term = [Point(1, 2), {"at": Point(3, 4)}, (":other", 5)]
+    binary = termformat.encode(term)
+    self.assertEqual(binary, termformat.encode([(":point", 1, 2), {"at": (":point", 3, 4)}, (":other", 5)]))
+    self.assertEqual(termformat.encoded_size(term), len(binary))
+    self.assertEqual(termformat.decode(binary), term)
+
+  def test_unregister(self):
+    termformat.unregister_type(Point, ":point")
+    with self.assertRaises(ValueError):
+      termformat.encode(Point(1, 2))
+    self.assertEqual(termformat.decode(termformat.encode((":point", 1, 2))), (":point", 1, 2))
+
+  def test_invalid_registration(self):
+    for cls, tag, decoder in ((int, None, None), (Point, ":point", None), (Point, "point", tuple)):
+      with self.assertRaises(ValueError):
+        termformat.register_type(cls, tuple, tag, decoder)